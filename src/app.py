@@ -1,13 +1,16 @@
 from dash import dash, dcc, html, Input, Output, State, dash_table, ctx
+import numpy as np
 import pandas as pd
 from plotly import graph_objects as go
 import plotly.express as px
 import json
 from datetime import datetime, date
 from typing import List, Dict, Tuple, Any
+import logging
 import os
+import time
 import geopandas as gpd
-from shapely.geometry import box
+from flask import g, request
 
 import os
 from dotenv import load_dotenv, find_dotenv
@@ -15,32 +18,257 @@ load_dotenv(find_dotenv())
 
 from models.trajectory import Trajectory
 from models.trajectories import Trajectories
-from utils.trackmap import plot_map
+from models.encoded import EncodedTrajectories
+from models.density import DensityGrid, level_for_zoom
+from models.feature_table import FeatureTable
+from models.summary import TrajectorySummaries
+from utils.trackmap import plot_density, plot_map
 from utils.timeline import plot_timeline
+from utils.store import DatasetStore
+from utils.cache import FigureCache, UserCache, make_key
+from utils.metrics import metrics
 
-from layout import create_layout
+from layout import create_layout, table_records
 
 import pickle
+logger = logging.getLogger(__name__)
 # Get OUTPUT_PATH from environment variables with a fallback
 output_path = os.getenv('OUTPUT_PATH', 'data')
-print(f'output_path: {output_path}')
+logger.info('output_path: %s', output_path)
+store_path = os.getenv('STORE_PATH', os.path.join(output_path, 'store'))
+
+# Open the columnar store when it exists, the encoded file (see `utils.encoding`) or the pickle file otherwise.
+# The users of the store are only read when selected; the encoded file is kept in memory in its compact form
+# and a user is decoded when selected; the pickle is loaded at once and split by user.
+# The density grids come with the partitions of the store and are merged once per version of the store, they are
+# aggregated once from all the points otherwise; the map viewports query the merged grids.
+density_levels: Dict[float, DensityGrid] = {}
+store = DatasetStore(store_path)
+encoded_path = os.path.join(output_path, 'trajectories_001.npz')
+if store.user_ids:
+    user_ids = store.user_ids
+
+    def load_user(user_id: str) -> Trajectories:
+        return Trajectories.from_store(store_path, user_ids=[user_id])
+
+    def read_summaries() -> TrajectorySummaries:
+        return store.read_summaries()
+
+    density_version = None
+
+    def read_density(cell_size: float, bbox: List[float] = None) -> DensityGrid:
+        # the grids of the users are merged once per level, again once a partition is rewritten
+        global density_version
+        version = store.version()
+        if version != density_version:
+            density_levels.clear()
+            density_version = version
+        if cell_size not in density_levels:
+            density_levels[cell_size] = store.read_density(cell_size)
+        return density_levels[cell_size] if bbox is None else density_levels[cell_size].query(*bbox)
+
+    def data_version(user_ids: List[str] = None) -> str:
+        return store.version(user_ids)
+elif os.path.exists(encoded_path):
+    encoded = EncodedTrajectories.load(encoded_path)
+    user_ids = encoded.user_ids.tolist()
+
+    def load_user(user_id: str) -> Trajectories:
+        return Trajectories.from_encoded(encoded.select_users([user_id]), method='vincenty')
+
+    def read_summaries() -> TrajectorySummaries:
+        # decoded chunk by chunk, the whole dataset is never decoded at once
+        return encoded.summaries(method='vincenty')
+
+    def read_density(cell_size: float, bbox: List[float] = None) -> DensityGrid:
+        if not density_levels:
+            density_levels.update(encoded.density(method='vincenty'))
+        return density_levels[cell_size] if bbox is None else density_levels[cell_size].query(*bbox)
+
+    encoded_version = str(os.stat(encoded_path).st_mtime_ns)
+
+    def data_version(user_ids: List[str] = None) -> str:
+        return encoded_version
+else:
+    pickle_path = os.path.join(output_path, 'trajectories_001.pkl')
+    with open(pickle_path, 'rb') as f:
+        dataset: Trajectories = pickle.load(f)
+    pickle_version = str(os.stat(pickle_path).st_mtime_ns)
+    user_ids = dataset.user_ids_list
+
+    def load_user(user_id: str) -> Trajectories:
+        return Trajectories([trajectory for trajectory in dataset.trajectories if trajectory.user_id == user_id])
+
+    def read_summaries() -> TrajectorySummaries:
+        return dataset.summaries
+
+    def read_density(cell_size: float, bbox: List[float] = None) -> DensityGrid:
+        if not density_levels:
+            density_levels.update(dataset.density())
+        return density_levels[cell_size] if bbox is None else density_levels[cell_size].query(*bbox)
+
+    def data_version(user_ids: List[str] = None) -> str:
+        return pickle_version
+
+point_budget = int(os.getenv('POINT_BUDGET', 20000))
+# rows of the features table per page, paged, sorted and filtered on the server; 0 embeds the whole table
+# of the user in the page, handled in the browser
+table_page_size = int(os.getenv('TABLE_PAGE_SIZE', 50))
+# draw all the trajectories of a figure in a single trace, lighter for many trajectories but with a single
+# line color
+batched = os.getenv('BATCHED_TRACES', '0') == '1'
+# trajectories added by the "similar" action, compared as simplified with the tolerance in meters
+similar_count = int(os.getenv('SIMILAR_COUNT', 5))
+similar_measure = os.getenv('SIMILAR_MEASURE', 'frechet')
+similar_tolerance = float(os.getenv('SIMILAR_TOLERANCE', 20))
+# figures and filtered subsets of the recent selections, the figures are shared by the workers through FIGURE_CACHE_PATH
+figure_cache = FigureCache(
+    max_entries=int(os.getenv('FIGURE_CACHE_SIZE', 64)),
+    ttl=float(os.getenv('FIGURE_CACHE_TTL', 600)),
+    disk_path=os.getenv('FIGURE_CACHE_PATH') or None,
+)
 
-# Open the pickle file
-with open(os.path.join(output_path, 'trajectories_001.pkl'), 'rb') as f:
-    trajectories: Trajectories = pickle.load(f)
-    
-color_scale = px.colors.sample_colorscale(px.colors.cyclical.HSV, [i/len(trajectories.trajectory_ids_list) for i in range(len(trajectories.trajectory_ids_list))])
-# shuffle color_scale
 import random
-random.shuffle(color_scale)
 
-[setattr(traj, 'color', color_scale[i]) for i, traj in enumerate(trajectories.trajectories)]    
+def prepare_user(user_id: str) -> Trajectories:
+    """
+    Load the trajectories of a user with their levels of detail and colors
+    """
+    trajectories = load_user(user_id)
+    # levels of detail of the map, precomputed by the ingest for the store
+    if any(trajectory.columns.significance is None for trajectory in trajectories.trajectories):
+        trajectories.compute_lod()
+    color_scale = px.colors.sample_colorscale(px.colors.cyclical.HSV, [i/len(trajectories.trajectories) for i in range(len(trajectories.trajectories))])
+    # seeded so that every worker process draws the trajectories with the same colors
+    random.Random(user_id).shuffle(color_scale)
+    [setattr(traj, 'color', color_scale[i]) for i, traj in enumerate(trajectories.trajectories)]
+    return trajectories
+
+# loaded users, within USER_CACHE_BYTES of arrays; the selection of each session comes from the callback inputs
+users = UserCache(
+    user_ids,
+    prepare_user,
+    max_bytes=int(os.getenv('USER_CACHE_BYTES', 2 * 2 ** 30)),
+    prefetch_count=int(os.getenv('USER_PREFETCH', 2)),
+)
 
-trajectories_subset = Trajectories([trajectories.trajectories[0]])
+# features of all the trajectories, from the precomputed summaries only
+if table_page_size:
+    feature_table = FeatureTable(read_summaries())
 
 app = dash.Dash(__name__)
-print('app created')
-app.layout = create_layout(trajectories)
+server = app.server
+logger.info('app created')
+# only the first user is loaded to build the layout, whatever the size of the dataset
+app.layout = create_layout(users.get(user_ids[0]), user_ids=user_ids, page_size=table_page_size)
+
+
+@app.server.route('/cache/stats')
+def cache_stats():
+    return {**figure_cache.stats, 'users': users.stats}
+
+
+@app.server.route('/metrics')
+def metrics_snapshot():
+    """
+    Timings and counters of this worker process (see utils.metrics)
+    """
+    return {**metrics.snapshot(), 'figure_cache': figure_cache.stats, 'users': users.stats}
+
+
+# each request is timed under its path: for the callbacks, the request time minus the callback span is
+# the time spent decoding the inputs and serializing the figures
+@app.server.before_request
+def start_request_span():
+    g.request_start = time.perf_counter()
+
+
+@app.server.after_request
+def end_request_span(response):
+    if metrics.enabled and 'request_start' in g:
+        name = 'http' + request.path.replace('/', '.').rstrip('.')
+        metrics.record(name, time.perf_counter() - g.request_start)
+        metrics.count(f'{name}.bytes', response.calculate_content_length() or 0)
+    return response
+
+
+@app.callback(
+    [
+        Output('trajectories-dropdown', 'options'),
+        Output('trajectories-dropdown', 'value'),
+    ] + ([] if table_page_size else [Output('trajectories-table', 'data')]),
+    [
+        Input('user-dropdown', 'value'),
+        Input('similar-button', 'n_clicks'),
+    ],
+    State('trajectories-dropdown', 'value'),
+)
+@metrics.timed('callback.update_user')
+def update_user(user_id: str, n_clicks: int, selected_ids: List[str]) -> Tuple:
+    """
+    Load the selected user, list its trajectories and select the first one
+    (and fill the features table when it is not paged on the server).
+    The "similar" action selects the first selected trajectory and the trajectories of the user nearest to it.
+    """
+    trajectories = users.get(user_id or user_ids[0])
+    users.prefetch(user_id or user_ids[0])
+    trajectory_ids = trajectories.trajectory_ids_list
+    selection = trajectory_ids[:1]
+    if isinstance(selected_ids, str):
+        selected_ids = [selected_ids]
+    if ctx.triggered_id == 'similar-button' and selected_ids and selected_ids[0] in trajectory_ids:
+        metrics.count('callback.update_user.similar')
+        similar = trajectories.similar(
+            selected_ids[0], k=similar_count, measure=similar_measure, tolerance=similar_tolerance
+        )
+        selection = [selected_ids[0]] + similar['trajectory_id'].tolist()
+    if table_page_size:
+        return trajectory_ids, selection
+    return trajectory_ids, selection, table_records(trajectories.features)
+
+
+if table_page_size:
+    @app.callback(
+        [
+            Output('trajectories-table', 'data'),
+            Output('trajectories-table', 'page_count'),
+            Output('trajectories-table', 'page_current'),
+        ],
+        [
+            Input('trajectories-table', 'page_current'),
+            Input('trajectories-table', 'page_size'),
+            Input('trajectories-table', 'sort_by'),
+            Input('trajectories-table', 'filter_query'),
+            Input('user-dropdown', 'value'),
+        ]
+    )
+    @metrics.timed('callback.update_table')
+    def update_table(
+        page_current: int,
+        page_size: int,
+        sort_by: List[Dict],
+        filter_query: str,
+        user_id: str,
+    ) -> Tuple[List[Dict], int, int]:
+        """
+        Return a page of the features of the selected user (of all the users when none is selected),
+        back to the first page when the user, the filters or the sorting change
+        """
+        if 'trajectories-table.page_current' not in ctx.triggered_prop_ids:
+            page_current = 0
+        try:
+            page, total = feature_table.query(filter_query, sort_by, page_current or 0, page_size, user_id=user_id)
+        except ValueError as error:
+            # a filter being typed, the table stays empty until it is valid
+            logger.debug('invalid table filter: %s', error)
+            metrics.count('callback.update_table.invalid_filter')
+            return [], 1, 0
+        page_count = max(1, -(-total // page_size))
+        if (page_current or 0) >= page_count:
+            # the last page, after the rows of the current one were filtered out
+            page_current = page_count - 1
+            page, total = feature_table.query(filter_query, sort_by, page_current, page_size, user_id=user_id)
+        return table_records(page), page_count, page_current or 0
 
 
 
@@ -51,68 +279,150 @@ app.layout = create_layout(trajectories)
         Output('timeline-graph', 'figure')
     ],
     [
-        Input('user-dropdown', 'value'),
         Input('trajectories-dropdown', 'value'),
-        Input('timeline-graph', 'relayoutData')
-    ]
+        Input('timeline-graph', 'relayoutData'),
+        Input('map-graph', 'relayoutData'),
+        Input('map-mode', 'value'),
+    ],
+    State('user-dropdown', 'value'),
 )
+@metrics.timed('callback.update_graphs')
 def update_graphs(
     # Inputs
-    user_id: str, 
     trajectory_ids: List[str],
     relayoutData: Dict[str, Any],
+    mapRelayoutData: Dict[str, Any],
+    map_mode: str,
+    # States
+    user_id: str,
 ) -> Tuple[go.Figure, go.Figure]:
     
-    global trajectories
-    global trajectories_subset
-    
     if trajectory_ids is None:
         trajectory_ids = []
     if not isinstance(trajectory_ids, list):
         trajectory_ids = [trajectory_ids]
     color_scale = px.colors.sample_colorscale(px.colors.cyclical.HSV, [i/len(trajectory_ids) for i in range(len(trajectory_ids))])
-    print(f'ctx.triggered_id: {ctx.triggered_id}')
-    
-    if ctx.triggered_id == 'trajectories-dropdown':
-        print(f'trajectory_ids: {trajectory_ids}')
-        trajectories_subset = Trajectories([traj for traj in trajectories.trajectories if traj.trajectory_id in trajectory_ids])
+    # the trajectories changing user arrive with the new user, the ones of another user are ignored
+    selected = set(trajectory_ids)
+    trajectories = users.get(user_id or user_ids[0])
+    trajectories_subset = Trajectories([trajectory for trajectory in trajectories.trajectories if trajectory.trajectory_id in selected])
 
     
-    if relayoutData and 'xaxis.range[0]' in relayoutData.keys():
-        print('---relayoutData---')
-        if 'xaxis.range[0]' in relayoutData.keys():
-            print(relayoutData)
-            start_datetime = pd.to_datetime(relayoutData['xaxis.range[0]'].split('.')[0])
-            end_datetime = pd.to_datetime(relayoutData['xaxis.range[1]'].split('.')[0])
-            datetime_range = [start_datetime, end_datetime]
-            
-            trajectories_subset_filtered = trajectories_subset.filter_trajectories(datetime_range=datetime_range)
-            print(f'Filtered trajectories: {len(trajectories_subset_filtered.trajectories)}')
-            print(f'trajectories_subset_filtered.gdf: {trajectories_subset_filtered.gdf}')
+    # the subset is identified by its trajectories and the version of the data of the user, which changes when
+    # the data is re-ingested
+    subset_key = [data_version([user_id or user_ids[0]]), [trajectory.trajectory_id for trajectory in trajectories_subset.trajectories]]
+    settings = dict(point_budget=point_budget, batched=batched)
+
+    if map_mode == 'density':
+        # the grid of all the users at the level of the zoom, reduced to the viewport once the map moved
+        mapRelayoutData = mapRelayoutData or {}
+        bbox = None
+        if 'mapbox._derived' in mapRelayoutData:
+            coordinates = np.array(mapRelayoutData['mapbox._derived']['coordinates'])
+            bbox = [round(float(value), 5) for value in (*coordinates.min(axis=0), *coordinates.max(axis=0))]
+        center = mapRelayoutData.get('mapbox.center', {})
+        zoom = mapRelayoutData.get('mapbox.zoom', 8)
+        latitude = center.get('lat', trajectories.average_centroid['latitude'] if trajectories.trajectories else 0.0)
+        cell_size = level_for_zoom(zoom, latitude)
+
+        def density_figures() -> Tuple[go.Figure, go.Figure]:
+            map_fig = plot_density(
+                read_density(cell_size, bbox),
+                center_lat=center.get('lat'),
+                center_lon=center.get('lon'),
+                zoom=zoom,
+                point_budget=point_budget,
+            )
+            map_fig.update_layout(uirevision='density')
+            timeline_fig = plot_timeline(
+                trajectories=trajectories_subset,
+                colors_list=color_scale,
+                **settings,
+            )
+            return map_fig, timeline_fig
+
+        key = make_key('density', subset_key, data_version(), cell_size, bbox, center.get('lat'), center.get('lon'), zoom, settings)
+        metrics.count('callback.update_graphs.density')
+        return figure_cache.get_or_compute(key, density_figures)
+
+    if ctx.triggered_id == 'map-graph' and mapRelayoutData and 'mapbox._derived' in mapRelayoutData:
+        # fetch only the points visible in the map viewport
+        coordinates = np.array(mapRelayoutData['mapbox._derived']['coordinates'])
+        min_lon, min_lat = coordinates.min(axis=0)
+        max_lon, max_lat = coordinates.max(axis=0)
+        bbox = [round(float(value), 5) for value in (min_lon, min_lat, max_lon, max_lat)]
+        center = mapRelayoutData.get('mapbox.center', {})
+        zoom = mapRelayoutData.get('mapbox.zoom', 8)
+
+        def viewport_figures() -> Tuple[go.Figure, go.Figure]:
+            # the spatial index of the user is built once, not for each selection
+            trajectories_visible = trajectories.query_bbox(*bbox, clip=True, trajectory_ids=selected)
             map_fig = plot_map(
-                trajectories=trajectories_subset_filtered, 
+                trajectories=trajectories_visible,
                 colors_list=color_scale,
-                marker_size=5)
+                marker_size=5,
+                center_lat=center.get('lat'),
+                center_lon=center.get('lon'),
+                zoom=zoom,
+                **settings)
+            map_fig.update_layout(uirevision='viewport')
             timeline_fig = plot_timeline(
-                trajectories=trajectories_subset_filtered,
+                trajectories=trajectories_visible,
                 colors_list=color_scale,
+                **settings,
             )
             return map_fig, timeline_fig
-            
-    
-    
-    map_fig = plot_map(
-        trajectories=trajectories_subset, 
-        colors_list=color_scale,
-        marker_size=5)
-    
-    timeline_fig = plot_timeline(
-        trajectories=trajectories_subset, 
-        colors_list=color_scale,
-    )
-    print('---bottom---')   
-    return map_fig, timeline_fig
 
-    
+        key = make_key('viewport', subset_key, bbox, center.get('lat'), center.get('lon'), zoom, settings)
+        metrics.count('callback.update_graphs.viewport')
+        return figure_cache.get_or_compute(key, viewport_figures)
+
+    if relayoutData and 'xaxis.range[0]' in relayoutData.keys():
+        if 'xaxis.range[0]' in relayoutData.keys():
+            metrics.count('callback.update_graphs.range')
+            start_datetime = pd.to_datetime(relayoutData['xaxis.range[0]'].split('.')[0])
+            end_datetime = pd.to_datetime(relayoutData['xaxis.range[1]'].split('.')[0])
+            datetime_range = [start_datetime, end_datetime]
+            window = [start_datetime.isoformat(), end_datetime.isoformat()]
+
+            def range_figures() -> Tuple[go.Figure, go.Figure]:
+                # the filtered columns are views on the loaded arrays, they are only kept in memory
+                trajectories_subset_filtered = figure_cache.get_or_compute(
+                    make_key('filtered', subset_key, window),
+                    lambda: trajectories_subset.filter_trajectories(datetime_range=datetime_range),
+                    persist=False,
+                )
+                map_fig = plot_map(
+                    trajectories=trajectories_subset_filtered,
+                    colors_list=color_scale,
+                    marker_size=5,
+                    **settings)
+                timeline_fig = plot_timeline(
+                    trajectories=trajectories_subset_filtered,
+                    colors_list=color_scale,
+                    **settings,
+                )
+                return map_fig, timeline_fig
+
+            return figure_cache.get_or_compute(make_key('range', subset_key, window, settings), range_figures)
+
+    def subset_figures() -> Tuple[go.Figure, go.Figure]:
+        map_fig = plot_map(
+            trajectories=trajectories_subset,
+            colors_list=color_scale,
+            marker_size=5,
+            **settings)
+
+        timeline_fig = plot_timeline(
+            trajectories=trajectories_subset,
+            colors_list=color_scale,
+            **settings,
+        )
+        return map_fig, timeline_fig
+
+    metrics.count('callback.update_graphs.subset')
+    return figure_cache.get_or_compute(make_key('subset', subset_key, settings), subset_figures)
+
+
 if __name__ == '__main__':
     app.run_server(debug=False, host='0.0.0.0', port=8050)
@@ -0,0 +1,80 @@
+"""
+Cleaning, gap splitting and resampling of synthetic users (`Trajectories.preprocess`), in one vectorized pass
+over all the trajectories against the same stages applied trajectory by trajectory.
+
+Speed spikes, duplicate timestamps and recording gaps are added to the synthetic tracks.
+
+Run from `src/`:
+    python -m benchmarks.cleaning --users 20 --trajectories 20 --points 2000 --step 5
+"""
+import argparse
+import time
+import numpy as np
+
+from benchmarks.synthetic import synthetic_trajectories
+from models.columns import TrajectoryColumns
+from models.trajectories import Trajectories
+from models.trajectory import Trajectory
+
+
+def corrupt(trajectory: Trajectory, rng: np.random.Generator, spikes: int = 5, duplicates: int = 5) -> Trajectory:
+    """
+    Return the trajectory with spikes of about 5 km, repeated points and a gap of 2 hours in the middle
+    """
+    columns = trajectory.columns
+    n = len(columns)
+    latitude = columns.latitude.copy()
+    latitude[rng.choice(np.arange(1, n - 1), spikes, replace=False)] += 0.05
+    keep = np.sort(np.concatenate([np.arange(n), rng.choice(np.arange(1, n - 1), duplicates, replace=False)]))
+    timestamp = columns.timestamp[keep].copy()
+    timestamp[len(keep) // 2:] += 7200
+    return Trajectory(
+        trajectory_id=trajectory.trajectory_id,
+        user_id=trajectory.user_id,
+        columns=TrajectoryColumns(
+            latitude=latitude[keep], longitude=columns.longitude[keep], altitude=columns.altitude[keep],
+            timestamp=timestamp, label=columns.label[keep],
+        ),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--trajectories', type=int, default=20)
+    parser.add_argument('--points', type=int, default=2000)
+    parser.add_argument('--step', type=float, default=5.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    trajectories = Trajectories([
+        corrupt(trajectory, rng)
+        for trajectory in synthetic_trajectories(args.users, args.trajectories, args.points).trajectories
+    ])
+    points = sum(trajectory.count for trajectory in trajectories.trajectories)
+
+    start = time.perf_counter()
+    looped = [
+        segment.resample(args.step)
+        for trajectory in trajectories.trajectories
+        for segment in trajectory.clean().split_gaps()
+    ]
+    seconds = time.perf_counter() - start
+    print(f'{"per trajectory":>16}: {seconds:8.3f} s  {points / seconds:12.0f} points/s')
+
+    start = time.perf_counter()
+    preprocessed = trajectories.preprocess(step=args.step)
+    seconds = time.perf_counter() - start
+    print(f'{"vectorized":>16}: {seconds:8.3f} s  {points / seconds:12.0f} points/s')
+
+    assert [t.trajectory_id for t in looped] == [t.trajectory_id for t in preprocessed.trajectories]
+    cleaned = trajectories.clean()
+    print(
+        f'{len(trajectories.trajectories)} trajectories, {points} points -> {len(cleaned.trajectories)} trajectories, '
+        f'{sum(t.count for t in cleaned.trajectories)} points cleaned -> {len(preprocessed.trajectories)} segments, '
+        f'{sum(t.count for t in preprocessed.trajectories)} points resampled every {args.step:g} s'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Density grids (`models.density`) of synthetic users written in a DatasetStore: time of the aggregation of all
+the points against adding one user to the store, cells and bytes of each level, and time of reading the grid
+of the dataset to draw the density map.
+
+Run from `src/`:
+    python -m benchmarks.density --users 20 --trajectories 20 --points 2000
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+
+from benchmarks.synthetic import synthetic_trajectories
+from models.density import LEVELS
+from utils.store import DatasetStore
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--trajectories', type=int, default=20)
+    parser.add_argument('--points', type=int, default=2000)
+    args = parser.parse_args()
+
+    trajectories = synthetic_trajectories(args.users, args.trajectories, args.points)
+    trajectories.compute_trajectories_speed()
+    points = sum(trajectory.count for trajectory in trajectories.trajectories)
+
+    start = time.perf_counter()
+    grids = trajectories.density()
+    seconds = time.perf_counter() - start
+    print(f'{"all the points":>24}: {seconds:8.3f} s  {points / seconds:12.0f} points/s')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = DatasetStore(os.path.join(tmp, 'store'))
+        last = trajectories.user_ids_list[-1]
+        store.write([trajectory for trajectory in trajectories.trajectories if trajectory.user_id != last])
+        added = [trajectory for trajectory in trajectories.trajectories if trajectory.user_id == last]
+        start = time.perf_counter()
+        store.write_user(last, added)
+        seconds = time.perf_counter() - start
+        print(f'{"add a user":>24}: {seconds:8.3f} s  {sum(t.count for t in added)} points, partition and grids')
+
+        for cell_size in LEVELS:
+            start = time.perf_counter()
+            grid = store.read_density(cell_size)
+            seconds = time.perf_counter() - start
+            assert np.array_equal(grid.count, grids[cell_size].count)
+            nbytes = sum(values.nbytes for values in grid.arrays.values() if values is not None)
+            print(
+                f'{f"read level {cell_size:g}":>24}: {seconds:8.3f} s  {len(grid):8d} cells  '
+                f'{nbytes / 2 ** 10:8.1f} KiB  {points / len(grid):8.1f} points/cell'
+            )
+        sizes = [os.path.getsize(os.path.join(store.user_path(user_id), 'density.npz')) for user_id in store.user_ids]
+        print(f'{"density.npz":>24}: {np.mean(sizes) / 2 ** 10:8.1f} KiB per user')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Memory and file size of the compact encoding (`models.encoded.EncodedTrajectories`) against the columns with
+their kinematics and the pickle of the trajectories, and the time of the encoding, decoding and filters.
+
+Run from `src/`:
+    python -m benchmarks.encoding --users 10 --trajectories 20 --points 2000
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import time
+from datetime import timedelta
+import pandas as pd
+
+from benchmarks.synthetic import START_TIMESTAMP, synthetic_trajectories
+from models.trajectories import Trajectories
+
+
+def timed(label: str, function, points: int):
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    print(f'{label:>28}: {seconds:8.3f} s  {points / seconds:12.0f} points/s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--trajectories', type=int, default=20)
+    parser.add_argument('--points', type=int, default=2000)
+    args = parser.parse_args()
+
+    trajectories = synthetic_trajectories(args.users, args.trajectories, args.points)
+    trajectories.compute_trajectories_speed()
+    trajectories.compute_lod()
+    points = sum(trajectory.count for trajectory in trajectories.trajectories)
+
+    encoded = timed('encode', trajectories.encode, points)
+    timed('decode', lambda: Trajectories.from_encoded(encoded), points)
+    timed('decode with kinematics', lambda: Trajectories.from_encoded(encoded, method='vincenty'), points)
+
+    start = pd.Timestamp(START_TIMESTAMP, unit='s')
+    datetime_range = (start + timedelta(hours=6), start + timedelta(days=args.trajectories // 2, hours=6))
+    timed('time range, columns', lambda: trajectories.filter_trajectories(datetime_range), points)
+    timed('time range, encoded', lambda: encoded.filter_time_range(datetime_range), points)
+    bbox = (116.35, 39.85, 116.45, 39.95)
+    timed('bbox, columns', lambda: trajectories.query_bbox(*bbox, clip=True), points)
+    timed('bbox, encoded', lambda: encoded.query_bbox(*bbox, clip=True), points)
+
+    columns_bytes = trajectories.columns.nbytes
+    print(f'{"columns":>28}: {columns_bytes / 2 ** 20:8.1f} MiB  {columns_bytes / points:6.1f} bytes/point')
+    print(f'{"encoded":>28}: {encoded.nbytes / 2 ** 20:8.1f} MiB  {encoded.nbytes / points:6.1f} bytes/point  x{columns_bytes / encoded.nbytes:.1f}')
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'trajectories.pkl'), 'wb') as f:
+            pickle.dump(trajectories, f, protocol=pickle.HIGHEST_PROTOCOL)
+        encoded.save(os.path.join(tmp, 'encoded.npz'), compressed=False)
+        encoded.save(os.path.join(tmp, 'compressed.npz'))
+        sizes = {name: os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp)}
+    for name in ('trajectories.pkl', 'encoded.npz', 'compressed.npz'):
+        print(f'{name:>28}: {sizes[name] / 2 ** 20:8.1f} MiB  x{sizes["trajectories.pkl"] / sizes[name]:.1f}')
+
+
+if __name__ == '__main__':
+    main()
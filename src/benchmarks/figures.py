@@ -0,0 +1,49 @@
+"""
+Build time and JSON size of the map and timeline figures for 10, 100 and 1,000 trajectories,
+one trace per trajectory against the batched mode.
+
+Run from `src/`:
+    python -m benchmarks.figures --points 500
+"""
+import argparse
+import time
+
+from benchmarks.synthetic import synthetic_trajectories
+from models.trajectories import Trajectories
+from utils.timeline import plot_timeline
+from utils.trackmap import plot_map
+
+
+def random_trajectories(count: int, points: int, seed: int = 0) -> Trajectories:
+    """
+    Synthetic trajectories of a user with their kinematics and colors
+    """
+    trajectories = synthetic_trajectories(users=1, trajectories=count, points=points, seed=seed)
+    for i, trajectory in enumerate(trajectories.trajectories):
+        trajectory.color = f'hsl({i * 37 % 360}, 80%, 50%)'
+    trajectories.compute_trajectories_speed(method='haversine')
+    return trajectories
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=500)
+    args = parser.parse_args()
+
+    for count in (10, 100, 1000):
+        trajectories = random_trajectories(count, args.points)
+        for batched in (False, True):
+            for name, plot in (('map', plot_map), ('timeline', plot_timeline)):
+                start = time.perf_counter()
+                fig = plot(trajectories=trajectories, batched=batched)
+                built = time.perf_counter() - start
+                size = len(fig.to_json())
+                serialized = time.perf_counter() - start - built
+                print(
+                    f'{count:>5} trajectories {name:>8} batched={batched!s:<5}: {len(fig.data):>4} traces, '
+                    f'build {built:.3f} s, serialize {serialized:.3f} s, {size / 2 ** 20:.2f} MiB'
+                )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark of the .plt ingest: per-file PltRecordParser against the bulk PltBulkParser.
+
+Run from `src/`:
+    python -m benchmarks.ingest --data-path /path/to/Data --user-ids 000 001
+Without a data path, a synthetic tree of --users users is written in a temporary folder (see `benchmarks.synthetic`).
+"""
+from typing import List
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+
+from benchmarks.synthetic import write_dataset
+from utils.parsers import PltBulkParser, PltRecordParser, list_plt_files, list_users
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-path', default=os.getenv('DATA_PATH'))
+    parser.add_argument('--user-ids', nargs='*', default=None)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--trajectories', type=int, default=20)
+    parser.add_argument('--points', type=int, default=2000)
+    args = parser.parse_args()
+    if args.data_path:
+        run(args.data_path, args.user_ids)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        write_dataset(tmp, users=args.users, trajectories=args.trajectories, points=args.points)
+        run(tmp, args.user_ids)
+
+
+def run(data_path: str, user_ids: List[str] = None):
+    user_ids = user_ids or list_users(data_path)
+
+    file_paths = [file for user_id in user_ids for file in list_plt_files(os.path.join(data_path, user_id))]
+    start = time.perf_counter()
+    record_parser = PltRecordParser()
+    points = sum(len(record_parser.parse(file, user_id=None, trajectory_id=None)) for file in file_paths)
+    seconds = time.perf_counter() - start
+    print(f'PltRecordParser: {len(file_paths)} files, {points} points in {seconds:.3f} s, {points / seconds:.0f} points/s')
+
+    bulk_parser = PltBulkParser()
+    batch = bulk_parser.parse_tree(data_path, user_ids=user_ids)
+    print(
+        f'PltBulkParser:   {bulk_parser.files} files, {bulk_parser.points} points in {bulk_parser.seconds:.3f} s, '
+        f'{bulk_parser.points_per_second:.0f} points/s'
+    )
+
+    reference = record_parser.parse_columns(file_paths[0])
+    first = batch.trajectory_columns(0)
+    assert np.array_equal(reference.timestamp, first.timestamp), 'timestamps differ from the per-file parser'
+    assert np.allclose(reference.latitude, first.latitude) and np.allclose(reference.longitude, first.longitude)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark of the vectorized kinematics engine against the previous geopy row-by-row computation.
+
+Run from `src/`:
+    python -m benchmarks.kinematics --points 20000
+"""
+import argparse
+import time
+import numpy as np
+from geopy.distance import geodesic
+
+from benchmarks.synthetic import shared_places, synthetic_track
+from utils.kinematics import METHODS, compute_kinematics
+
+
+def random_track(points: int, seed: int = 0):
+    """
+    Synthetic track around Beijing, sampled every 1 to 5 seconds while moving like dense GeoLife tracks
+    """
+    rng = np.random.default_rng(seed)
+    track = synthetic_track(rng, shared_places(rng), points)
+    return track.latitude, track.longitude, track.timestamp
+
+
+def geopy_distances(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """
+    Reference distances, computed pair by pair with geopy like the former Trajectory._calculate_distances
+    """
+    return np.array([0] + [
+        geodesic((latitude[i - 1], longitude[i - 1]), (latitude[i], longitude[i])).meters
+        for i in range(1, len(latitude))
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=20000)
+    args = parser.parse_args()
+
+    latitude, longitude, timestamp = random_track(args.points)
+    start = time.perf_counter()
+    reference = geopy_distances(latitude, longitude)
+    geopy_seconds = time.perf_counter() - start
+    print(f'{"geopy":>10}: {geopy_seconds:8.3f} s  {args.points / geopy_seconds:12.0f} points/s')
+
+    for method in METHODS:
+        start = time.perf_counter()
+        kinematics = compute_kinematics(latitude, longitude, timestamp, method=method)
+        seconds = time.perf_counter() - start
+        error = np.abs(kinematics['distance'] - reference)
+        relative = error[1:] / np.maximum(reference[1:], 1e-9)
+        print(
+            f'{method:>10}: {seconds:8.3f} s  {args.points / seconds:12.0f} points/s  '
+            f'max abs error {error.max():.2e} m  max rel error {relative.max():.2e}  '
+            f'total distance error {abs(kinematics["distance"].sum() - reference.sum()):.3f} m'
+        )
+
+
+if __name__ == '__main__':
+    main()
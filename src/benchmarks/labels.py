@@ -0,0 +1,74 @@
+"""
+Benchmark of the interval-join labeller on users with thousands of labelled segments,
+against the previous merge_asof join (which ignored end_datetime).
+
+Run from `src/`:
+    python -m benchmarks.labels --users 20 --segments 5000 --points 200000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+from models.columns import LABELS
+from utils.labels import label_user_points, label_users
+
+
+def random_labels(segments: int, t0: float, rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Non-overlapping labelled segments separated by unlabelled gaps
+    """
+    bounds = t0 + np.cumsum(rng.integers(60, 1800, 2 * segments)).astype(np.float64)
+    return pd.DataFrame({
+        'start_datetime': pd.to_datetime(bounds[0::2], unit='s'),
+        'end_datetime': pd.to_datetime(bounds[1::2], unit='s'),
+        'label': rng.choice(LABELS, segments),
+    })
+
+
+def merge_asof_labels(timestamp: np.ndarray, df_labels: pd.DataFrame) -> np.ndarray:
+    """
+    The previous Trajectories.ugpdate_labels join, on the start of the segments only
+    """
+    df_records = pd.DataFrame({'datetime': pd.to_datetime(timestamp, unit='s')})
+    return pd.merge_asof(df_records, df_labels, left_on='datetime', right_on='start_datetime', direction='backward')['label'].to_numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--segments', type=int, default=5000)
+    parser.add_argument('--points', type=int, default=200000)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    labels, timestamps = {}, []
+    for user in range(args.users):
+        labels[user] = random_labels(args.segments, 1.2e9, rng)
+        end = labels[user]['end_datetime'].iloc[-1].value / 1e9
+        timestamps.append(np.sort(rng.uniform(1.2e9, end, args.points)))
+    timestamp = np.concatenate(timestamps)
+    point_users = np.repeat(np.arange(args.users), args.points)
+    total = len(timestamp)
+
+    start = time.perf_counter()
+    for user in range(args.users):
+        merge_asof_labels(timestamps[user], labels[user])
+    seconds = time.perf_counter() - start
+    print(f'merge_asof per user:     {seconds:.3f} s, {total / seconds:.0f} points/s')
+
+    start = time.perf_counter()
+    per_user = [label_user_points(timestamps[user], labels[user]) for user in range(args.users)]
+    seconds = time.perf_counter() - start
+    print(f'interval join per user:  {seconds:.3f} s, {total / seconds:.0f} points/s')
+
+    start = time.perf_counter()
+    batched = label_users(timestamp, point_users, labels)
+    seconds = time.perf_counter() - start
+    print(f'interval join all users: {seconds:.3f} s, {total / seconds:.0f} points/s')
+    assert np.array_equal(batched, np.concatenate(per_user))
+    print(f'labelled points: {(batched >= 0).mean():.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Peak memory of the streaming pipeline (`utils.pipeline`) against the in-memory ingestion (`Trajectories.from_user`
+then speed, levels of detail, labels and `DatasetStore.write`) on synthetic trees of a growing number of users.
+Each run is a separate process, its peak RSS is the `VmHWM` of /proc/self/status (`ru_maxrss` also counts
+the RSS of the parent at fork).
+
+Run from `src/`:
+    python -m benchmarks.pipeline --users 4 8 16 --trajectories 20 --points 5000 --memory-limit 64
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.synthetic import write_dataset
+
+RUN = '''
+import json, sys, time
+mode, data_path, store_path, memory_limit = sys.argv[1:5]
+start = time.perf_counter()
+if mode == 'stream':
+    from utils.pipeline import run_pipeline
+    points = run_pipeline(data_path, store_path, memory_limit=int(float(memory_limit) * 2 ** 20)).dataset()['points']
+else:
+    from models.trajectories import Trajectories
+    from utils.parsers import list_users
+    trajectories = Trajectories.from_user(data_path, user_ids=list_users(data_path))
+    trajectories.compute_trajectories_speed()
+    trajectories.compute_lod()
+    trajectories.update_users_labels(data_path)
+    trajectories.to_store(store_path)
+    points = sum(trajectory.count for trajectory in trajectories.trajectories)
+print(json.dumps({
+    'seconds': time.perf_counter() - start,
+    'points': points,
+    'peak_mib': next(int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmHWM')) / 1024,
+}))
+'''
+
+
+def run(mode: str, data_path: str, store_path: str, memory_limit: float) -> dict:
+    output = subprocess.run(
+        [sys.executable, '-c', RUN, mode, data_path, store_path, str(memory_limit)],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--trajectories', type=int, default=20)
+    parser.add_argument('--points', type=int, default=5000)
+    parser.add_argument('--memory-limit', type=float, default=64, help='MiB of points in flight in the pipeline')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for users in args.users:
+            data_path = os.path.join(tmp, f'Data{users}')
+            write_dataset(data_path, users=users, trajectories=args.trajectories, points=args.points)
+            for mode in ('stream', 'memory'):
+                result = run(mode, data_path, os.path.join(tmp, f'store_{mode}{users}'), args.memory_limit)
+                print(
+                    f'{users:>4} users {mode:>7}: {result["points"]:>10} points  {result["seconds"]:8.2f} s  '
+                    f'{result["points"] / result["seconds"]:10.0f} points/s  peak RSS {result["peak_mib"]:8.1f} MiB'
+                )
+
+
+if __name__ == '__main__':
+    main()
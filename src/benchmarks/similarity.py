@@ -0,0 +1,64 @@
+"""
+Similarity search (`Trajectories.similar`) against the brute force computation of the distances between the query
+and all the trajectories, with the same batched dynamic programs, and the share of exact distances computed.
+
+Run from `src/`:
+    python -m benchmarks.similarity --users 20 --trajectories 40 --points 1000 --queries 5 --tolerance 20
+"""
+import argparse
+import time
+import numpy as np
+
+from benchmarks.synthetic import synthetic_trajectories
+from utils.metrics import metrics
+from utils.similarity import BATCH_SIZE, MEASURES, curve_distances
+from utils.simplify import local_xy
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--trajectories', type=int, default=40)
+    parser.add_argument('--points', type=int, default=1000)
+    parser.add_argument('--queries', type=int, default=5)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--tolerance', type=float, default=20.0)
+    args = parser.parse_args()
+
+    trajectories = synthetic_trajectories(args.users, args.trajectories, args.points)
+    trajectories.compute_lod()
+    queries = np.random.default_rng(0).choice(len(trajectories.trajectories), args.queries, replace=False)
+    metrics.enabled = True
+    for measure in MEASURES:
+        brute_seconds = search_seconds = 0.0
+        metrics.reset()
+        for position in queries:
+            query = trajectories.trajectories[position]
+            start = time.perf_counter()
+            found = trajectories.similar(query.trajectory_id, k=args.k, measure=measure, tolerance=args.tolerance)
+            search_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            points = query.level_of_detail(args.tolerance)
+            reference = float(points.latitude.mean())
+            curves = [
+                local_xy(columns.latitude, columns.longitude, reference)
+                for columns in (trajectory.level_of_detail(args.tolerance) for i, trajectory in enumerate(trajectories.trajectories) if i != position)
+            ]
+            query_xy = local_xy(points.latitude, points.longitude, reference)
+            distances = np.concatenate([
+                curve_distances(query_xy, curves[i:i + BATCH_SIZE], measure=measure)
+                for i in range(0, len(curves), BATCH_SIZE)
+            ])
+            brute_seconds += time.perf_counter() - start
+            assert np.allclose(found['distance'], np.sort(distances)[:args.k])
+        counters = metrics.snapshot()['counters']
+        print(
+            f'{measure:>8}: search {search_seconds / args.queries * 1000:8.1f} ms  brute force '
+            f'{brute_seconds / args.queries * 1000:8.1f} ms  x{brute_seconds / search_seconds:.1f}  '
+            f'exact distances {counters["similarity.exact"] / counters["similarity.candidates"]:6.1%}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Stay point detection and significant place clustering on synthetic GeoLife-like users, against the
+reference loop of the stay point papers on a few of them.
+
+The users of `benchmarks.synthetic` alternate stays at places (a home of their own and places shared by all the
+users) with trips between them.
+
+Run from `src/`:
+    python -m benchmarks.staypoints --users 182 --trajectories 20 --points 2000
+"""
+import argparse
+import time
+import numpy as np
+
+from benchmarks.synthetic import synthetic_trajectories
+from models.columns import NO_LABEL, TrajectoryColumns
+from models.trajectories import Trajectories
+from models.trajectory import Trajectory
+from utils.kinematics import haversine
+from utils.staypoints import DISTANCE_THRESHOLD, TIME_THRESHOLD
+
+
+def reference_stays(latitude: np.ndarray, longitude: np.ndarray, timestamp: np.ndarray) -> int:
+    """
+    Number of stay points found by the nested loops of the stay point detection papers: the anchor moves to the
+    leaving point of a kept stay, to the next point otherwise
+    """
+    n, i, stays = len(latitude), 0, 0
+    while i < n:
+        j, kept = i + 1, False
+        while j < n:
+            if haversine(latitude[i], longitude[i], latitude[j], longitude[j]) > DISTANCE_THRESHOLD:
+                if timestamp[j] - timestamp[i] >= TIME_THRESHOLD:
+                    stays, i, kept = stays + 1, j, True
+                break
+            j += 1
+        if not kept:
+            i += 1
+    return stays
+
+
+def edge_case() -> Trajectory:
+    """
+    A first point 190 meters north of a place, 31 minutes within 20 meters of the place, then a point 1 km away.
+    The first point leaves its radius at the 13th point of the place, 15 meters south: the stay starts at the
+    second point, an anchor jumping to the leaving point instead would only see the last 19 minutes
+    """
+    meters = 1 / 111320
+    north = np.concatenate([[190.0], np.zeros(31), [1000.0]])
+    north[13] = -15.0
+    east = np.concatenate([[0.0], np.tile([-5.0, 5.0], 16)[:31], [0.0]])
+    return Trajectory(
+        trajectory_id='edge', user_id='edge',
+        columns=TrajectoryColumns(
+            latitude=40.0 + north * meters, longitude=116.0 + east * meters / np.cos(np.radians(40)),
+            altitude=np.zeros(len(north)), timestamp=1.2e9 + np.arange(len(north)) * 60.0,
+            label=np.full(len(north), NO_LABEL, dtype=np.int8),
+        ),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=182)
+    parser.add_argument('--trajectories', type=int, default=20)
+    parser.add_argument('--points', type=int, default=2000)
+    parser.add_argument('--reference-trajectories', type=int, default=20)
+    args = parser.parse_args()
+
+    edge = edge_case()
+    assert reference_stays(edge.columns.latitude, edge.columns.longitude, edge.columns.timestamp) == 1
+    assert len(edge.stay_points()) == 1
+
+    start = time.perf_counter()
+    trajectories = synthetic_trajectories(args.users, args.trajectories, args.points, labelled=False)
+    total = sum(trajectory.count for trajectory in trajectories.trajectories)
+    print(f'generated {len(trajectories.trajectories)} trajectories, {total} points in {time.perf_counter() - start:.1f} s')
+
+    sample = trajectories.trajectories[:args.reference_trajectories]
+    sample_points = sum(trajectory.count for trajectory in sample)
+    start = time.perf_counter()
+    expected = sum(reference_stays(t.columns.latitude, t.columns.longitude, t.columns.timestamp) for t in sample)
+    seconds = time.perf_counter() - start
+    print(f'{"reference loop":>16}: {seconds:8.3f} s  {sample_points / seconds:12.0f} points/s  {expected} stays')
+    start = time.perf_counter()
+    found = len(Trajectories(sample).stay_points())
+    seconds = time.perf_counter() - start
+    print(f'{"vectorized":>16}: {seconds:8.3f} s  {sample_points / seconds:12.0f} points/s  {found} stays')
+    assert found == expected
+
+    start = time.perf_counter()
+    stay_points = trajectories.stay_points()
+    seconds = time.perf_counter() - start
+    print(f'{"all users":>16}: {seconds:8.3f} s  {total / seconds:12.0f} points/s  {len(stay_points)} stays')
+
+    for time_eps in (None, 3600.0):
+        start = time.perf_counter()
+        places = stay_points.places(eps=100.0, min_samples=3, time_eps=time_eps)
+        seconds = time.perf_counter() - start
+        print(
+            f'{"places":>16}: {seconds:8.3f} s  {len(places)} places (time_eps={time_eps}), '
+            f'{(places["user_count"] > 1).sum()} visited by several users'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Startup time and resident memory of the dashboard dataset: pickle file against the columnar DatasetStore.
+Each loader runs in a fresh process so that its RSS is not shared with the other one.
+
+Run from `src/`:
+    python -m benchmarks.store --data-path /path/to/Data --user-ids 000 001
+Without a data path, a synthetic user is written in a temporary folder (see `benchmarks.synthetic`).
+"""
+import argparse
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.synthetic import write_dataset
+from models.trajectories import Trajectories
+
+LOADERS = {
+    'pickle': (
+        'import pickle\n'
+        'with open(path, "rb") as f:\n'
+        '    trajectories = pickle.load(f)\n'
+    ),
+    'store': (
+        'trajectories = Trajectories.from_store(path)\n'
+    ),
+}
+PROBE = (
+    'import sys, time, psutil\n'
+    'from models.trajectories import Trajectories\n'
+    'path = sys.argv[1]\n'
+    'start = time.perf_counter()\n'
+    '{loader}'
+    'seconds = time.perf_counter() - start\n'
+    'features = trajectories.features\n'
+    'print(seconds, psutil.Process().memory_info().rss)\n'
+)
+
+
+def probe(loader: str, path: str):
+    """
+    Return the load time and the RSS after the first query (features table) in a fresh process
+    """
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(loader=LOADERS[loader]), path],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ).stdout.split()
+    return float(output[-2]), int(output[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-path', default=os.getenv('DATA_PATH'))
+    parser.add_argument('--user-ids', nargs='*', default=['000'])
+    parser.add_argument('--trajectories', type=int, default=100)
+    parser.add_argument('--points', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = args.data_path
+        if not data_path:
+            data_path = os.path.join(tmp, 'Data')
+            write_dataset(data_path, users=len(args.user_ids), trajectories=args.trajectories, points=args.points)
+        trajectories = Trajectories.from_user(data_path, user_ids=args.user_ids)
+        trajectories.compute_trajectories_speed()
+        paths = {'pickle': os.path.join(tmp, 'trajectories.pkl'), 'store': os.path.join(tmp, 'store')}
+        with open(paths['pickle'], 'wb') as f:
+            pickle.dump(trajectories, f)
+        trajectories.to_store(paths['store'])
+        for loader, path in paths.items():
+            seconds, rss = probe(loader, path)
+            print(f'{loader:>6}: loaded in {seconds:.3f} s, RSS {rss / 2 ** 20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,347 @@
+"""
+Benchmark suite of the data pipeline and the dashboard on synthetic GeoLife trees (see `benchmarks.synthetic`).
+
+For each size, a tree is written in a temporary folder and each stage is timed (best and median of --repeat runs)
+then run once more under tracemalloc for its peak of allocated memory:
+    parse_record          PltRecordParser.parse_columns of every file
+    parse_bulk            PltBulkParser.parse_tree
+    compute_speed         Trajectory.compute_speed of every trajectory
+    compute_kinematics    Trajectories.compute_trajectories_speed
+    ugpdate_labels        Trajectories.ugpdate_labels of every user
+    update_users_labels   Trajectories.update_users_labels
+    filter_trajectories   Trajectories.filter_trajectories over a 3 day window
+    plot_map              plot_map of the trajectories of a user
+    plot_timeline         plot_timeline of the trajectories of a user
+    update_graphs_*       the update_graphs callback of the dashboard, requested through its Flask server with the
+                          figure cache disabled: selection of trajectories, timeline range, map viewport and
+                          density map
+
+The results are written to <output-dir>/<UTC time>.json and compared with the previous file of the folder
+(or --baseline): the stages slower or using more memory than --tolerance times the baseline are reported as
+regressions, and make the command fail with --fail-on-regression.
+
+Run from `src/`:
+    python -m benchmarks.suite --sizes small medium
+"""
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+from benchmarks.synthetic import write_dataset
+from models.trajectories import Trajectories
+from utils.parsers import PltBulkParser, PltRecordParser, list_tree_files
+from utils.timeline import plot_timeline
+from utils.trackmap import plot_map
+
+# users, trajectories per user and points per trajectory of each size
+SIZES = {
+    'tiny': (2, 5, 500),
+    'small': (4, 10, 1000),
+    'medium': (16, 25, 2000),
+    'large': (64, 50, 2000),
+}
+SRC_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# requests of the update_graphs callback, run in a fresh process serving a store of the synthetic tree
+APP_PROBE = '''
+import json, sys, time, tracemalloc
+import app
+client = app.server.test_client()
+user_id = app.user_ids[0]
+trajectories = app.users.get(user_id)
+ids = [trajectory.trajectory_id for trajectory in trajectories.trajectories][:10]
+start, end = trajectories.trajectories[0].columns.timestamp[[0, -1]]
+summaries = trajectories.summaries
+center = {'lat': float(summaries.centroid_latitude.mean()), 'lon': float(summaries.centroid_longitude.mean())}
+inputs = {
+    'subset': (None, None, 'trajectories', 'trajectories-dropdown.value'),
+    'range': ({'xaxis.range[0]': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start + 600)),
+               'xaxis.range[1]': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(end - 600))}, None, 'trajectories', 'timeline-graph.relayoutData'),
+    'viewport': (None, {'mapbox.center': center, 'mapbox.zoom': 13, 'mapbox._derived': {'coordinates': [
+        [center['lon'] - 0.02, center['lat'] + 0.02], [center['lon'] + 0.02, center['lat'] + 0.02],
+        [center['lon'] + 0.02, center['lat'] - 0.02], [center['lon'] - 0.02, center['lat'] - 0.02]]}}, 'trajectories', 'map-graph.relayoutData'),
+    'density': (None, None, 'density', 'map-mode.value'),
+}
+
+def request(name):
+    timeline, viewport, mode, changed = inputs[name]
+    response = client.post('/_dash-update-component', json={
+        'output': '..map-graph.figure...timeline-graph.figure..',
+        'outputs': [{'id': 'map-graph', 'property': 'figure'}, {'id': 'timeline-graph', 'property': 'figure'}],
+        'inputs': [
+            {'id': 'trajectories-dropdown', 'property': 'value', 'value': ids},
+            {'id': 'timeline-graph', 'property': 'relayoutData', 'value': timeline},
+            {'id': 'map-graph', 'property': 'relayoutData', 'value': viewport},
+            {'id': 'map-mode', 'property': 'value', 'value': mode},
+        ],
+        'changedPropIds': [changed],
+        'state': [{'id': 'user-dropdown', 'property': 'value', 'value': user_id}],
+    })
+    assert response.status_code == 200, response.status_code
+    return len(response.data)
+
+repeat = int(sys.argv[1])
+results = {}
+for name in inputs:
+    times = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        size = request(name)
+        times.append(time.perf_counter() - begin)
+    tracemalloc.start()
+    request(name)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    results[name] = {'times': times, 'peak': peak, 'items': sum(t.count for t in trajectories.trajectories if t.trajectory_id in ids), 'bytes': size}
+print('RESULTS ' + json.dumps(results))
+'''
+
+
+@dataclass
+class StageResult:
+    size: str
+    stage: str
+    items: int
+    repeat: int
+    seconds_min: float
+    seconds_median: float
+    peak_mib: float
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items / self.seconds_min if self.seconds_min > 0 else float('nan')
+
+
+@dataclass
+class Dataset:
+    """
+    A synthetic tree and the trajectories parsed from it, shared by the stages of a size
+    """
+    data_path: str
+    user_ids: List[str]
+    file_paths: List[str]
+    trajectories: Trajectories
+    points: int
+
+
+def measure(size: str, stage: str, function: Callable[[], int], repeat: int) -> StageResult:
+    """
+    Time `repeat` runs of a stage returning its number of items, then measure its peak memory in one more run
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return StageResult(size, stage, int(items), repeat, min(times), float(np.median(times)), peak / 2 ** 20)
+
+
+def pipeline_stages(dataset: Dataset) -> Dict[str, Callable[[], int]]:
+    """
+    Return the stages of the data pipeline, each returning the number of points it processed
+    """
+    trajectories = dataset.trajectories
+    users = {user_id: Trajectories([t for t in trajectories.trajectories if t.user_id == user_id]) for user_id in dataset.user_ids}
+    first_user = users[dataset.user_ids[0]]
+    first_points = sum(t.count for t in first_user.trajectories)
+    window_start = min(t.columns.timestamp[0] for t in trajectories.trajectories) + 86400
+    window = (datetime.fromtimestamp(window_start, timezone.utc).replace(tzinfo=None),
+              datetime.fromtimestamp(window_start + 3 * 86400, timezone.utc).replace(tzinfo=None))
+
+    def parse_record() -> int:
+        parser = PltRecordParser()
+        return sum(len(parser.parse_columns(file_path)) for file_path in dataset.file_paths)
+
+    def parse_bulk() -> int:
+        return len(PltBulkParser().parse_tree(dataset.data_path, user_ids=dataset.user_ids).columns)
+
+    def compute_speed() -> int:
+        for trajectory in trajectories.trajectories:
+            trajectory.compute_speed()
+        return dataset.points
+
+    def compute_kinematics() -> int:
+        trajectories.compute_trajectories_speed()
+        return dataset.points
+
+    def ugpdate_labels() -> int:
+        for user_id, user_trajectories in users.items():
+            user_trajectories.ugpdate_labels(os.path.join(dataset.data_path, user_id))
+        return dataset.points
+
+    def update_users_labels() -> int:
+        trajectories.update_users_labels(dataset.data_path)
+        return dataset.points
+
+    def filter_trajectories() -> int:
+        filtered = trajectories.filter_trajectories(datetime_range=window)
+        return sum(trajectory.count for trajectory in filtered.trajectories)
+
+    def map_figure() -> int:
+        plot_map(trajectories=first_user, batched=True)
+        return first_points
+
+    def timeline_figure() -> int:
+        plot_timeline(trajectories=first_user, batched=True)
+        return first_points
+
+    return {
+        'parse_record': parse_record,
+        'parse_bulk': parse_bulk,
+        'compute_speed': compute_speed,
+        'compute_kinematics': compute_kinematics,
+        'ugpdate_labels': ugpdate_labels,
+        'update_users_labels': update_users_labels,
+        'filter_trajectories': filter_trajectories,
+        'plot_map': map_figure,
+        'plot_timeline': timeline_figure,
+    }
+
+
+def app_stages(size: str, dataset: Dataset, output_path: str, repeat: int) -> List[StageResult]:
+    """
+    Serve a store of the dataset in a fresh process and time the update_graphs requests. The store holds the
+    kinematics and levels of detail like the ingested ones, whichever stages ran before.
+    """
+    dataset.trajectories.compute_trajectories_speed()
+    dataset.trajectories.compute_lod()
+    dataset.trajectories.to_store(os.path.join(output_path, 'store'))
+    env = {**os.environ, 'OUTPUT_PATH': output_path, 'STORE_PATH': os.path.join(output_path, 'store'),
+           'FIGURE_CACHE_SIZE': '0', 'FIGURE_CACHE_PATH': '', 'USER_PREFETCH': '0'}
+    output = subprocess.run(
+        [sys.executable, '-c', APP_PROBE, str(repeat)], capture_output=True, text=True, check=True, cwd=SRC_PATH, env=env,
+    ).stdout
+    results = json.loads(output[output.rindex('RESULTS ') + len('RESULTS '):])
+    return [
+        StageResult(size, f'update_graphs_{name}', result['items'], repeat, min(result['times']),
+                    float(np.median(result['times'])), result['peak'] / 2 ** 20)
+        for name, result in results.items()
+    ]
+
+
+def run_size(size: str, users: int, trajectories: int, points: int, repeat: int, stages: List[str] = None) -> List[StageResult]:
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = os.path.join(tmp, 'Data')
+        written = write_dataset(data_path, users=users, trajectories=trajectories, points=points)
+        user_ids = sorted(os.listdir(data_path))
+        file_paths = list_tree_files(data_path, user_ids)[0]
+        dataset = Dataset(data_path, user_ids, file_paths, Trajectories.from_user(data_path, user_ids=user_ids), written['points'])
+        for stage, function in pipeline_stages(dataset).items():
+            if stages is None or stage in stages:
+                results.append(measure(size, stage, function, repeat))
+                print(format_result(results[-1]))
+        if stages is None or any(stage.startswith('update_graphs') for stage in stages):
+            for result in app_stages(size, dataset, tmp, repeat):
+                results.append(result)
+                print(format_result(result))
+    return results
+
+
+def format_result(result: StageResult, baseline: StageResult = None) -> str:
+    line = (
+        f'{result.size:>7} {result.stage:<24} {result.seconds_min:9.4f} s (median {result.seconds_median:9.4f} s) '
+        f'{result.items_per_second:14.0f} items/s  peak {result.peak_mib:9.2f} MiB'
+    )
+    if baseline is not None:
+        line += f'  x{result.seconds_min / baseline.seconds_min:.2f} time, x{result.peak_mib / max(baseline.peak_mib, 1e-9):.2f} memory'
+    return line
+
+
+def environment() -> Dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=SRC_PATH).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def regressions(
+    results: List[StageResult],
+    baseline: Dict[tuple, StageResult],
+    tolerance: float,
+    min_seconds: float = 0.005
+) -> List[str]:
+    """
+    Return the stages slower, or with a larger memory peak, than tolerance times their baseline.
+    The time differences under min_seconds are ignored as noise.
+    """
+    found = []
+    for result in results:
+        reference = baseline.get((result.size, result.stage))
+        if reference is None:
+            continue
+        if result.seconds_min > tolerance * reference.seconds_min and result.seconds_min - reference.seconds_min > min_seconds:
+            found.append(f'{result.size} {result.stage}: {reference.seconds_min:.4f} s -> {result.seconds_min:.4f} s')
+        if result.peak_mib > tolerance * reference.peak_mib and result.peak_mib - reference.peak_mib > 1:
+            found.append(f'{result.size} {result.stage}: peak {reference.peak_mib:.2f} MiB -> {result.peak_mib:.2f} MiB')
+    return found
+
+
+def read_results(file_path: str) -> Dict[tuple, StageResult]:
+    with open(file_path) as f:
+        return {(r['size'], r['stage']): StageResult(**r) for r in json.load(f)['results']}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='*', default=['small', 'medium'], choices=list(SIZES))
+    parser.add_argument('--stages', nargs='*', default=None, help='all the stages by default')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output-dir', default=os.getenv('BENCHMARK_RESULTS', 'benchmark_results'))
+    parser.add_argument('--baseline', default=None, help='results file to compare with, the latest of output-dir by default')
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    previous = sorted(glob.glob(os.path.join(args.output_dir, '*.json')))
+    baseline_path = args.baseline or (previous[-1] if previous else None)
+
+    results = []
+    for size in args.sizes:
+        users, trajectories, points = SIZES[size]
+        print(f'{size}: {users} users x {trajectories} trajectories x {points} points')
+        results += run_size(size, users, trajectories, points, args.repeat, args.stages)
+
+    file_path = os.path.join(args.output_dir, datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ') + '.json')
+    with open(file_path, 'w') as f:
+        json.dump({**environment(), 'results': [asdict(result) for result in results]}, f, indent=1)
+    print(f'results written to {file_path}')
+
+    if baseline_path:
+        baseline = read_results(baseline_path)
+        print(f'compared with {baseline_path}:')
+        for result in results:
+            print(format_result(result, baseline.get((result.size, result.stage))))
+        found = regressions(results, baseline, args.tolerance)
+        for regression in found:
+            print(f'REGRESSION {regression}')
+        if found and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""
+Synthetic GeoLife data for the benchmarks.
+
+Each user alternates stays at a few places (a home of its own and places shared by all the users) with trips
+between them in a transportation mode, sampled every 1 to 5 seconds while moving, with GPS noise. The tracks are
+returned as arrays or `Trajectories`, or written as a `Data/<user_id>/Trajectory/*.plt` tree with the
+`labels.txt` of the trips for a part of the users, like the GeoLife release.
+
+Run from `src/` to write a tree:
+    python -m benchmarks.synthetic /tmp/Data --users 10 --trajectories 20 --points 2000
+"""
+from dataclasses import dataclass
+from typing import Dict, List
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+from models.columns import LABELS, NO_LABEL, TrajectoryColumns
+from models.trajectories import Trajectories
+from models.trajectory import Trajectory
+from utils.kinematics import haversine
+from utils.parsers import PLT_EPOCH_DAYS
+
+# speed ranges in meters per second of the synthetic trips
+MODE_SPEEDS = {
+    'walk': (0.8, 1.8),
+    'bike': (3.0, 6.0),
+    'bus': (4.0, 12.0),
+    'car': (6.0, 20.0),
+    'subway': (8.0, 20.0),
+    'taxi': (6.0, 18.0),
+}
+START_TIMESTAMP = 1224730384  # 2008-10-23, the first days of GeoLife
+FEET_PER_METER = 3.28084
+PLT_HEADER = 'Geolife trajectory\nWGS 84\nAltitude is in Feet\nReserved 3\n0,2,255,My Track,0,0,2,8421376\n0\n'
+
+
+@dataclass
+class SyntheticTrack:
+    """
+    Points of a synthetic trajectory, with integer timestamps like the .plt files, and its labelled trips.
+    Attributes
+    ----------
+    latitude, longitude, altitude : np.ndarray
+        float64 coordinates, the altitude in meters.
+    timestamp : np.ndarray
+        float64 whole seconds since the epoch.
+    label : np.ndarray
+        int8 label code of each point, `NO_LABEL` during the stays.
+    trips : pd.DataFrame
+        start_datetime, end_datetime and label of each trip, the rows of a labels.txt file.
+    """
+
+    latitude: np.ndarray
+    longitude: np.ndarray
+    altitude: np.ndarray
+    timestamp: np.ndarray
+    label: np.ndarray
+    trips: pd.DataFrame
+
+    def columns(self, labelled: bool = True) -> TrajectoryColumns:
+        return TrajectoryColumns(
+            latitude=self.latitude,
+            longitude=self.longitude,
+            altitude=self.altitude,
+            timestamp=self.timestamp,
+            label=self.label if labelled else None,
+        )
+
+
+def synthetic_track(
+    rng: np.random.Generator,
+    places: np.ndarray,
+    points: int,
+    start: float = START_TIMESTAMP
+) -> SyntheticTrack:
+    """
+    Return a track of `points` points visiting random places of the (n, 2) latitude, longitude array:
+    stays of 5 to 60 minutes sampled every 5 to 30 seconds with 10 meters of noise, and straight trips
+    at the speed of a random mode sampled every 1 to 5 seconds
+    """
+    latitude, longitude, timestamp, label, trips = [], [], [], [], []
+    n, t = 0, float(start)
+    place = rng.integers(len(places))
+    while n < points:
+        position = places[place]
+        stay = int(rng.integers(10, 120))
+        times = t + np.cumsum(rng.integers(5, 31, stay))
+        latitude.append(position[0] + rng.normal(0, 1e-4, stay))
+        longitude.append(position[1] + rng.normal(0, 1e-4, stay))
+        timestamp.append(times)
+        label.append(np.full(stay, NO_LABEL, dtype=np.int8))
+        t = times[-1]
+
+        # another place
+        place = (place + rng.integers(1, len(places))) % len(places)
+        target = places[place]
+        mode = rng.choice(list(MODE_SPEEDS))
+        low, high = MODE_SPEEDS[mode]
+        intervals = rng.integers(1, 6, max(int(haversine(*position, *target) / ((low + high) / 2) / 3), 2))
+        steps = rng.uniform(low, high, len(intervals)) * intervals
+        fraction = np.cumsum(steps) / steps.sum()
+        latitude.append(position[0] + fraction * (target[0] - position[0]) + rng.normal(0, 3e-5, len(steps)))
+        longitude.append(position[1] + fraction * (target[1] - position[1]) + rng.normal(0, 3e-5, len(steps)))
+        times = t + np.cumsum(intervals)
+        timestamp.append(times)
+        label.append(np.full(len(steps), LABELS.index(mode), dtype=np.int8))
+        trips.append((times[0], times[-1], mode))
+        t = times[-1] + 1
+        n += stay + len(steps)
+
+    timestamp = np.concatenate(timestamp)[:points].astype(np.float64)
+    # the trips cut by the end of the track end with it
+    trips = pd.DataFrame(trips, columns=['start', 'end', 'label'])
+    trips = trips[trips['start'] <= timestamp[-1]]
+    return SyntheticTrack(
+        latitude=np.concatenate(latitude)[:points],
+        longitude=np.concatenate(longitude)[:points],
+        altitude=50 + np.cumsum(rng.normal(0, 0.5, points)),
+        timestamp=timestamp,
+        label=np.concatenate(label)[:points],
+        trips=pd.DataFrame({
+            'start_datetime': pd.to_datetime(trips['start'], unit='s'),
+            'end_datetime': pd.to_datetime(np.minimum(trips['end'], timestamp[-1]), unit='s'),
+            'label': trips['label'].astype(str),
+        }).reset_index(drop=True),
+    )
+
+
+def user_places(rng: np.random.Generator, shared: np.ndarray, count: int = 5) -> np.ndarray:
+    """
+    Return the places of a user: a home around Beijing and `count` of the shared places
+    """
+    home = np.array([[39.9 + rng.uniform(-0.15, 0.15), 116.4 + rng.uniform(-0.15, 0.15)]])
+    return np.concatenate([home, shared[rng.choice(len(shared), min(count, len(shared)), replace=False)]])
+
+
+def shared_places(rng: np.random.Generator, count: int = 50) -> np.ndarray:
+    return np.column_stack([39.9 + rng.uniform(-0.1, 0.1, count), 116.4 + rng.uniform(-0.1, 0.1, count)])
+
+
+def synthetic_users(
+    users: int,
+    trajectories: int,
+    points: int,
+    seed: int = 0
+) -> Dict[str, List[SyntheticTrack]]:
+    """
+    Return the tracks of the users, `trajectories` tracks of `points` points each, one track per day
+    """
+    rng = np.random.default_rng(seed)
+    shared = shared_places(rng)
+    tracks = {}
+    for u in range(users):
+        places = user_places(rng, shared)
+        tracks[f'{u:03d}'] = [synthetic_track(rng, places, points, START_TIMESTAMP + i * 86400) for i in range(trajectories)]
+    return tracks
+
+
+def synthetic_trajectories(
+    users: int = 1,
+    trajectories: int = 10,
+    points: int = 1000,
+    seed: int = 0,
+    labelled: bool = True
+) -> Trajectories:
+    """
+    Return synthetic users as `Trajectories`, the trajectory IDs numbered like the .plt files of a user
+    """
+    return Trajectories([
+        Trajectory(trajectory_id=f'{user_id}_{i}', user_id=user_id, columns=track.columns(labelled=labelled))
+        for user_id, tracks in synthetic_users(users, trajectories, points, seed=seed).items()
+        for i, track in enumerate(tracks)
+    ])
+
+
+def write_plt(file_path: str, track: SyntheticTrack) -> None:
+    """
+    Write a track as a .plt file: latitude, longitude, 0, altitude in feet, days since 1899-12-30, date and time
+    """
+    datetimes = np.datetime_as_string(track.timestamp.astype('datetime64[s]'), unit='s')
+    days = track.timestamp / 86400 + PLT_EPOCH_DAYS
+    altitude = np.round(track.altitude * FEET_PER_METER).astype(np.int64)
+    with open(file_path, 'w') as f:
+        f.write(PLT_HEADER)
+        f.write(''.join(map(
+            '{:.6f},{:.6f},0,{:d},{:.10f},{}\n'.format,
+            track.latitude, track.longitude, altitude, days, np.char.replace(datetimes, 'T', ',')
+        )))
+
+
+def write_labels(file_path: str, trips: pd.DataFrame) -> None:
+    with open(file_path, 'w') as f:
+        f.write('Start Time\tEnd Time\tTransportation Mode\n')
+        f.write(''.join(
+            f'{start:%Y/%m/%d %H:%M:%S}\t{end:%Y/%m/%d %H:%M:%S}\t{label}\n'
+            for start, end, label in trips.itertuples(index=False)
+        ))
+
+
+def write_dataset(
+    data_path: str,
+    users: int = 5,
+    trajectories: int = 10,
+    points: int = 1000,
+    labelled_users: float = 0.5,
+    seed: int = 0
+) -> Dict:
+    """
+    Write a GeoLife tree in data_path (the `Data/` folder): `<user_id>/Trajectory/<start>.plt` files and,
+    for the first labelled_users fraction of the users, a `<user_id>/labels.txt` of their trips.
+    Return the numbers of users, files and points written.
+    """
+    tracks = synthetic_users(users, trajectories, points, seed=seed)
+    files = 0
+    for u, (user_id, user_tracks) in enumerate(tracks.items()):
+        trajectory_path = os.path.join(data_path, user_id, 'Trajectory')
+        os.makedirs(trajectory_path, exist_ok=True)
+        for track in user_tracks:
+            name = pd.Timestamp(track.timestamp[0], unit='s').strftime('%Y%m%d%H%M%S')
+            write_plt(os.path.join(trajectory_path, f'{name}.plt'), track)
+            files += 1
+        if u < round(labelled_users * users):
+            write_labels(os.path.join(data_path, user_id, 'labels.txt'), pd.concat([track.trips for track in user_tracks]))
+    return {'users': users, 'files': files, 'points': files * points}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data_path')
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--trajectories', type=int, default=10)
+    parser.add_argument('--points', type=int, default=1000)
+    parser.add_argument('--labelled-users', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    written = write_dataset(
+        args.data_path, users=args.users, trajectories=args.trajectories, points=args.points,
+        labelled_users=args.labelled_users, seed=args.seed,
+    )
+    print(f'{written["users"]} users, {written["files"]} files, {written["points"]} points written in {args.data_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+"""
+Gunicorn settings of the dashboard:
+
+    gunicorn --config gunicorn.conf.py app:server
+
+The app is imported once in the master process (preload_app) and the workers are forked from it: the
+memory-mapped store arrays are shared through the page cache and the arrays loaded from a pickle are shared
+copy-on-write, the dataset is not loaded again by each worker.
+"""
+import gc
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8050)}"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.getenv('GUNICORN_THREADS', 2))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+preload_app = True
+
+
+def when_ready(server):
+    # objects tracked by the garbage collector before the fork are moved to a permanent generation,
+    # so that collections in the workers do not write to (and copy) the pages of the shared dataset
+    gc.freeze()
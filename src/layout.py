@@ -5,9 +5,66 @@ import geopandas as gpd
 
 from models.trajectories import Trajectories
 
+def table_records(features: pd.DataFrame) -> list:
+    """
+    Return the rows of the features table with JSON-serializable values, durations as strings and
+    distances and speeds rounded
+    """
+    df = pd.DataFrame(features)
+    for column in df.columns:
+        if pd.api.types.is_timedelta64_dtype(df[column]):
+            df[column] = df[column].astype(str)
+        elif pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].round(2)
+    return df.to_dict('records')
+
+def table_columns(features: pd.DataFrame) -> list:
+    """
+    Return the DataTable columns of the features, typed so that the filters of the dates and numbers use
+    the matching operators
+    """
+    columns = []
+    for column in features.columns:
+        if pd.api.types.is_datetime64_any_dtype(features[column]):
+            columns.append({"name": column, "id": column, "type": "datetime"})
+        elif pd.api.types.is_numeric_dtype(features[column]):
+            columns.append({"name": column, "id": column, "type": "numeric"})
+        else:
+            columns.append({"name": column, "id": column})
+    return columns
+
 def create_layout(
-    trajectories: Trajectories
+    trajectories: Trajectories,
+    user_ids: list = None,
+    page_size: int = None
 ) -> html.Div:
+    """
+    Build the dashboard layout showing the given trajectories, the user dropdown lists user_ids
+    (the users of the trajectories by default).
+    With a page_size, the features table is paged, sorted and filtered on the server ('custom' actions) and
+    starts empty, its pages are sent by a callback; otherwise the features of the trajectories are embedded
+    and handled in the browser.
+    """
+    user_ids = trajectories.user_ids_list if user_ids is None else user_ids
+    features = trajectories.features
+    if page_size:
+        table_options = dict(
+            data=[],
+            page_action='custom',
+            page_current=0,
+            page_size=page_size,
+            filter_action='custom',
+            filter_query='',
+            sort_action='custom',
+            sort_mode='multi',
+            sort_by=[],
+        )
+    else:
+        table_options = dict(
+            data=table_records(features),
+            filter_action='native',
+            sort_action='native',
+        )
     return html.Div(
         className='container',
         children=[
@@ -18,7 +75,7 @@ def create_layout(
                         html.H3('GeoLife Dashboard'),
                         dcc.Dropdown(
                             id='user-dropdown',
-                            options=trajectories.user_ids_list,
+                            options=user_ids,
                             value=trajectories.user_ids_list[0],
                         ),
                         dcc.Dropdown(
@@ -26,15 +83,17 @@ def create_layout(
                             options=trajectories.trajectory_ids_list,
                             value=trajectories.trajectory_ids_list[0],
                             multi=True,
-                        )],
-                    ),
+                        ),
+                        # adds the trajectories of the user most similar to the first selected one
+                        html.Button('Similar', id='similar-button', n_clicks=0),
+                        # the trajectories of the selection, or the density of the points of all the users
+                        dcc.RadioItems(id='map-mode', options=['trajectories', 'density'], value='trajectories', inline=True),
+                    ]),
                     html.Div(
                         dash_table.DataTable(
                             id='trajectories-table',
-                            columns=[{"name": col, "id": col} for col in trajectories.features.columns],
-                            data=trajectories.features.to_dict('records'),
-                            filter_action='native',
-                            sort_action='native',
+                            columns=table_columns(features),
+                            **table_options,
                             style_filter=dict(color='white', backgroundColor='#777'),
                             fixed_rows={'headers': True},
                             style_table={'overflowY': 'auto', 'height': '300px'},
@@ -0,0 +1,192 @@
+from dataclasses import dataclass, fields
+from typing import Dict, List, Sequence, Tuple, Union
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from models.record import Record
+
+# GeoLife transportation modes, a label is stored as its index in this tuple
+LABELS = ('walk', 'bike', 'bus', 'car', 'subway', 'train', 'airplane', 'boat', 'run', 'motorcycle', 'taxi')
+NO_LABEL = -1
+
+
+def encode_labels(labels: Sequence[str]) -> np.ndarray:
+    """
+    Convert label strings (None or NaN when missing) to int8 codes
+    """
+    codes = pd.Categorical(pd.Series(labels, dtype=object), categories=LABELS).codes
+    unknown = (codes == NO_LABEL) & pd.notna(pd.Series(labels, dtype=object)).to_numpy()
+    if unknown.any():
+        raise ValueError(f'Unknown labels {set(np.asarray(labels, dtype=object)[unknown])}, expected one of {LABELS}')
+    return codes.astype(np.int8)
+
+
+def decode_labels(codes: np.ndarray) -> np.ndarray:
+    """
+    Convert int8 label codes to an object array of label strings, None when missing
+    """
+    labels = np.array(LABELS + (None,), dtype=object)
+    return labels[np.where(codes == NO_LABEL, len(LABELS), codes)]
+
+
+def time_bounds(datetime_range: Sequence) -> Tuple[float, float]:
+    """
+    Convert a (start, end) datetime range to timestamps in seconds, comparable with `TrajectoryColumns.timestamp`
+    """
+    start, end = datetime_range
+    return pd.Timestamp(start).value / 1e9, pd.Timestamp(end).value / 1e9
+
+
+@dataclass
+class TrajectoryColumns:
+    """
+    Columnar storage of the points of a trajectory, one contiguous array per attribute.
+    Attributes
+    ----------
+    latitude, longitude, altitude : np.ndarray
+        float64 coordinates.
+    timestamp : np.ndarray
+        float64 seconds since the epoch (the .plt datetimes are naive, they are read as UTC).
+    label : np.ndarray
+        int8 codes into `LABELS`, `NO_LABEL` when the point has no transportation mode.
+    time_diff, distance, speed, acceleration, bearing : np.ndarray, optional
+        float64 kinematics, None until computed by `utils.kinematics.compute_kinematics`.
+    significance : np.ndarray, optional
+        float64 Douglas-Peucker significance of the points (see `utils.simplify`), None until computed.
+    """
+
+    latitude: np.ndarray
+    longitude: np.ndarray
+    altitude: np.ndarray
+    timestamp: np.ndarray
+    label: np.ndarray = None
+    time_diff: np.ndarray = None
+    distance: np.ndarray = None
+    speed: np.ndarray = None
+    acceleration: np.ndarray = None
+    bearing: np.ndarray = None
+    significance: np.ndarray = None
+
+    KINEMATICS = ('time_diff', 'distance', 'speed', 'acceleration', 'bearing')
+
+    def __post_init__(self):
+        for name in ('latitude', 'longitude', 'altitude', 'timestamp', 'significance') + self.KINEMATICS:
+            values = getattr(self, name)
+            if values is not None:
+                setattr(self, name, np.asarray(values, dtype=np.float64))
+        if self.label is None:
+            self.label = np.full(len(self.timestamp), NO_LABEL, dtype=np.int8)
+        else:
+            self.label = np.asarray(self.label, dtype=np.int8)
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def __getitem__(self, index: Union[slice, np.ndarray]) -> 'TrajectoryColumns':
+        """
+        Return the selected points, slices are views on the same arrays
+        """
+        return TrajectoryColumns(**{
+            name: None if values is None else values[index]
+            for name, values in self.arrays.items()
+        })
+
+    @property
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """
+        Return the arrays by column name, None for the kinematics not computed yet
+        """
+        return {field.name: getattr(self, field.name) for field in fields(self)}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(values.nbytes for values in self.arrays.values() if values is not None)
+
+    @property
+    def datetime(self) -> np.ndarray:
+        """
+        Return the timestamps as a datetime64[ns] array
+        """
+        return np.round(self.timestamp * 1e9).astype('datetime64[ns]')
+
+    @property
+    def labels(self) -> np.ndarray:
+        """
+        Return the labels as an object array of strings, None when missing
+        """
+        return decode_labels(self.label)
+
+    @property
+    def is_sorted(self) -> bool:
+        return bool(np.all(self.timestamp[1:] >= self.timestamp[:-1]))
+
+    def sort(self) -> 'TrajectoryColumns':
+        """
+        Return the points sorted by timestamp, self when they already are
+        """
+        if self.is_sorted:
+            return self
+        return self[np.argsort(self.timestamp, kind='stable')]
+
+    @classmethod
+    def concatenate(cls, columns: List['TrajectoryColumns']) -> 'TrajectoryColumns':
+        """
+        Concatenate the points of several trajectories, kinematics are kept only if computed for all of them
+        """
+        return cls(**{
+            name: None if any(getattr(c, name) is None for c in columns) else np.concatenate([getattr(c, name) for c in columns])
+            for name in (field.name for field in fields(cls))
+        })
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'TrajectoryColumns':
+        """
+        Create the columns from a DataFrame with the `Record` columns
+        """
+        timestamp = pd.to_datetime(df['datetime']).to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9
+        return cls(
+            latitude=df['latitude'].to_numpy(),
+            longitude=df['longitude'].to_numpy(),
+            altitude=df['altitude'].to_numpy(),
+            timestamp=timestamp,
+            label=encode_labels(df['label']) if 'label' in df else None,
+            **{name: df[name].to_numpy(dtype=np.float64, na_value=np.nan) for name in cls.KINEMATICS if name in df and df[name].notna().any()}
+        )
+
+    @classmethod
+    def from_records(cls, records: List[Record]) -> 'TrajectoryColumns':
+        """
+        Create the columns from a list of `Record` objects
+        """
+        return cls.from_frame(pd.DataFrame([record.__dict__ for record in records], columns=[f.name for f in fields(Record)]))
+
+    def to_frame(
+        self,
+        user_id: Union[str, np.ndarray],
+        trajectory_id: Union[str, np.ndarray],
+        geometry: bool = True
+    ) -> pd.DataFrame:
+        """
+        Return the points as a DataFrame with the `Record` columns (and the extra kinematics once computed),
+        a GeoDataFrame when `geometry` is True
+        """
+        n = len(self)
+        data = {
+            'user_id': np.broadcast_to(np.asarray(user_id, dtype=object), n),
+            'trajectory_id': np.broadcast_to(np.asarray(trajectory_id, dtype=object), n),
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'altitude': self.altitude,
+            'datetime': self.datetime,
+            'timestamp': self.timestamp,
+            'label': self.labels,
+        }
+        for name in self.KINEMATICS:
+            values = getattr(self, name)
+            if values is not None or name in ('time_diff', 'distance', 'speed'):
+                data[name] = values
+        df = pd.DataFrame(data)
+        if not geometry:
+            return df
+        return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(self.longitude, self.latitude))
@@ -0,0 +1,284 @@
+from dataclasses import dataclass, fields
+from typing import Dict, List, Sequence, Union
+import numpy as np
+import pandas as pd
+
+from models.columns import LABELS, NO_LABEL, TrajectoryColumns
+from utils.cleaning import MAX_TIME_GAP
+from utils.simplify import tolerance_for_zoom
+
+# cell sizes in degrees of the levels of the grids, each a multiple of the next one (about 11 km, 1.1 km and 110 m)
+LEVELS = (0.1, 0.01, 0.001)
+# the hour-of-day counts are only kept for the cells of at least this size, they would weigh 96 bytes per cell
+HOURS_CELL_SIZE = 0.01
+
+
+def n_cols(cell_size: float) -> int:
+    return int(np.ceil(360 / cell_size)) + 1
+
+
+def level_for_zoom(zoom: float, latitude: float, pixels: float = 4.0, levels: Sequence[float] = LEVELS) -> float:
+    """
+    Return the finest level whose cells are at least `pixels` screen pixels wide at a web map zoom level
+    """
+    meters = tolerance_for_zoom(zoom, latitude, pixels)
+    scale = 111320.0 * np.cos(np.radians(latitude))
+    wide = [cell_size for cell_size in levels if cell_size * scale >= meters]
+    return min(wide) if wide else max(levels)
+
+
+def cell_codes(latitude: np.ndarray, longitude: np.ndarray, cell_size: float) -> np.ndarray:
+    """
+    Return the row-major codes of the cells of the coordinates, row * n_cols + col
+    """
+    rows = np.floor((np.asarray(latitude, dtype=np.float64) + 90) / cell_size).astype(np.int64)
+    cols = np.floor((np.asarray(longitude, dtype=np.float64) + 180) / cell_size).astype(np.int64)
+    return rows * n_cols(cell_size) + cols
+
+
+@dataclass
+class DensityGrid:
+    """
+    Aggregates of the points of trajectories in the cells of a latitude/longitude grid, one entry per non-empty
+    cell, sorted by cell code. Grids of the same cell size are merged by adding their aggregates, the grid of a
+    dataset is the merge of the grids of its users; a grid is coarsened to the next levels without the points.
+    Attributes
+    ----------
+    cell_size : float
+        Size of the cells in degrees.
+    codes : np.ndarray
+        int64 row-major codes of the cells, see `cell_codes`.
+    count : np.ndarray
+        int64 number of points.
+    dwell : np.ndarray
+        float64 seconds from the points to the next point of their trajectory, the gaps longer than
+        `MAX_TIME_GAP` are not counted.
+    speed_sum : np.ndarray
+        float64 sum of the speeds of the points in meters per second, NaN when they were not computed.
+    label_counts : np.ndarray
+        int32 (n, len(LABELS) + 1) number of points of each label, the last column counts the points without label.
+    hour_counts : np.ndarray, optional
+        int32 (n, 24) number of points of each hour of the day (UTC), None when not kept.
+    Properties
+    ----------
+    latitude, longitude : np.ndarray
+        Centers of the cells.
+    mean_speed : np.ndarray
+        Mean speed of the points.
+    label : np.ndarray
+        Most frequent label of each cell, None when no point is labelled.
+    Methods
+    -------
+    from_columns(cls, columns: TrajectoryColumns, offsets: Sequence[int], cell_size: float) -> 'DensityGrid'
+        Aggregate the points of concatenated trajectories, in one vectorized pass.
+    coarsen(cell_size: float) -> 'DensityGrid'
+        Aggregate the cells into the cells of a coarser level.
+    merge(cls, grids: List['DensityGrid'], cell_size: float) -> 'DensityGrid'
+        Add grids of the same cell size.
+    query(min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> 'DensityGrid'
+        Keep the cells intersecting a bbox, with one binary search per row of cells.
+    to_frame() -> pd.DataFrame
+        Return one row per cell with its center and aggregates.
+    to_arrays() -> Dict[str, np.ndarray] / from_arrays(cls, arrays: Dict[str, np.ndarray]) -> 'DensityGrid'
+        Convert to and from the arrays persisted in the `DatasetStore` partitions.
+    """
+
+    cell_size: float
+    codes: np.ndarray
+    count: np.ndarray
+    dwell: np.ndarray
+    speed_sum: np.ndarray
+    label_counts: np.ndarray
+    hour_counts: np.ndarray = None
+
+    def __post_init__(self):
+        self.cell_size = float(self.cell_size)
+        self.codes = np.asarray(self.codes, dtype=np.int64)
+        self.count = np.asarray(self.count, dtype=np.int64)
+        self.dwell = np.asarray(self.dwell, dtype=np.float64)
+        self.speed_sum = np.asarray(self.speed_sum, dtype=np.float64)
+        self.label_counts = np.asarray(self.label_counts, dtype=np.int32).reshape(len(self.codes), len(LABELS) + 1)
+        if self.hour_counts is not None:
+            self.hour_counts = np.asarray(self.hour_counts, dtype=np.int32).reshape(len(self.codes), 24)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, index: Union[slice, np.ndarray]) -> 'DensityGrid':
+        return DensityGrid(cell_size=self.cell_size, **{
+            name: None if values is None else values[index] for name, values in self.arrays.items()
+        })
+
+    @property
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {f.name: getattr(self, f.name) for f in fields(self) if f.name != 'cell_size'}
+
+    @property
+    def latitude(self) -> np.ndarray:
+        return (self.codes // n_cols(self.cell_size) + 0.5) * self.cell_size - 90
+
+    @property
+    def longitude(self) -> np.ndarray:
+        return (self.codes % n_cols(self.cell_size) + 0.5) * self.cell_size - 180
+
+    @property
+    def mean_speed(self) -> np.ndarray:
+        return self.speed_sum / self.count
+
+    @property
+    def label(self) -> np.ndarray:
+        labels = np.array(LABELS + (None,), dtype=object)
+        main = np.argmax(self.label_counts[:, :len(LABELS)], axis=1)
+        return np.where(self.label_counts[:, :len(LABELS)].sum(axis=1) > 0, labels[main], None)
+
+    @classmethod
+    def from_columns(
+        cls,
+        columns: TrajectoryColumns,
+        offsets: Sequence[int],
+        cell_size: float
+    ) -> 'DensityGrid':
+        """
+        Aggregate the points of the trajectories concatenated in `columns`, trajectory i holding the points
+        offsets[i]:offsets[i + 1], with one sort of the cell codes and one reduceat per aggregate
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        n = len(columns)
+        timestamp = np.asarray(columns.timestamp, dtype=np.float64)
+        # time to the next point, 0 for the last point of a trajectory and over the gaps
+        dwell = np.zeros(n)
+        if n > 1:
+            dwell[:-1] = np.diff(timestamp)
+        ends = offsets[1:][offsets[1:] > offsets[:-1]] - 1
+        dwell[ends] = 0
+        dwell[dwell > MAX_TIME_GAP] = 0
+        label_index = np.where(columns.label == NO_LABEL, len(LABELS), columns.label).astype(np.int64)
+        hour = (np.floor(timestamp / 3600) % 24).astype(np.int64)
+
+        codes = cell_codes(columns.latitude, columns.longitude, cell_size)
+        order = np.argsort(codes, kind='stable')
+        cells, starts, inverse = np.unique(codes[order], return_index=True, return_inverse=True)
+        speed = np.full(n, np.nan) if columns.speed is None else np.asarray(columns.speed, dtype=np.float64)
+
+        def reduce(values: np.ndarray) -> np.ndarray:
+            return np.add.reduceat(values[order], starts) if len(starts) else np.zeros(0)
+
+        return cls(
+            cell_size=cell_size,
+            codes=cells,
+            count=np.diff(np.append(starts, n)),
+            dwell=reduce(dwell),
+            speed_sum=reduce(speed),
+            label_counts=np.bincount(
+                inverse * (len(LABELS) + 1) + label_index[order], minlength=len(cells) * (len(LABELS) + 1)
+            ),
+            hour_counts=np.bincount(inverse * 24 + hour[order], minlength=len(cells) * 24),
+        )
+
+    @classmethod
+    def _reduce(cls, cell_size: float, codes: np.ndarray, arrays: Dict[str, np.ndarray]) -> 'DensityGrid':
+        """
+        Return the grid of cells with possibly repeated codes, adding the aggregates of the same cells
+        """
+        order = np.argsort(codes, kind='stable')
+        cells, starts = np.unique(codes[order], return_index=True)
+        return cls(cell_size=cell_size, codes=cells, **{
+            name: None if values is None else (np.add.reduceat(values[order], starts) if len(starts) else values[:0])
+            for name, values in arrays.items()
+        })
+
+    def coarsen(self, cell_size: float) -> 'DensityGrid':
+        """
+        Aggregate the cells into the cells of cell_size degrees, a multiple of the cell size of the grid
+        """
+        factor = int(round(cell_size / self.cell_size))
+        rows, cols = np.divmod(self.codes, n_cols(self.cell_size))
+        codes = rows // factor * n_cols(cell_size) + cols // factor
+        return self._reduce(cell_size, codes, {name: values for name, values in self.arrays.items() if name != 'codes'})
+
+    @classmethod
+    def merge(cls, grids: List['DensityGrid'], cell_size: float) -> 'DensityGrid':
+        """
+        Add the grids, the hour counts are kept when all of them have some
+        """
+        hours = all(grid.hour_counts is not None for grid in grids)
+        arrays = {
+            f.name: None if f.name == 'hour_counts' and not hours else np.concatenate(
+                [getattr(grid, f.name) for grid in grids]
+                or [np.zeros((0,) + ((len(LABELS) + 1,) if f.name == 'label_counts' else (24,) if f.name == 'hour_counts' else ()))]
+            )
+            for f in fields(cls) if f.name not in ('cell_size', 'codes')
+        }
+        codes = np.concatenate([grid.codes for grid in grids] or [np.zeros(0, dtype=np.int64)])
+        return cls._reduce(cell_size, codes, arrays)
+
+    def query(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> 'DensityGrid':
+        """
+        Return the cells intersecting the bbox: the codes of a row of cells are contiguous, each row is found
+        with a binary search. The latitudes are clamped to [-90, 90]; the longitudes of the maps may go beyond
+        [-180, 180], a bbox crossing the antimeridian is split in two ranges of columns.
+        """
+        n = n_cols(self.cell_size)
+        min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0)
+        if max_lon < min_lon or max_lat < min_lat:
+            return self[np.zeros(0, dtype=np.int64)]
+        if max_lon - min_lon >= 360:
+            lon_ranges = [(-180.0, 180.0)]
+        else:
+            west = (min_lon + 180) % 360 - 180
+            east = west + (max_lon - min_lon)
+            lon_ranges = [(west, min(east, 180.0))] + ([(-180.0, east - 360)] if east > 180 else [])
+        row_min, row_max = (cell_codes([min_lat, max_lat], [-180, -180], self.cell_size) // n).tolist()
+        rows = np.arange(row_min, row_max + 1)
+        cells = []
+        for west, east in lon_ranges:
+            col_min, col_max = np.clip(cell_codes([-90, -90], [west, east], self.cell_size) % n, 0, n - 1).tolist()
+            starts = np.searchsorted(self.codes, rows * n + col_min, side='left')
+            ends = np.searchsorted(self.codes, rows * n + col_max, side='right')
+            cells += [np.arange(start, end) for start, end in zip(starts, ends)]
+        return self[np.unique(np.concatenate(cells or [np.zeros(0, dtype=np.int64)]))]
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Return one row per cell: center, count, dwell, mean speed, main label and one count column per label
+        """
+        df = pd.DataFrame({
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'count': self.count,
+            'dwell': pd.to_timedelta(self.dwell, unit='s'),
+            'mean_speed': self.mean_speed,
+            'label': self.label,
+        })
+        for i, label in enumerate(LABELS + ('unlabelled',)):
+            df[f'{label}_count'] = self.label_counts[:, i]
+        return df
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            'cell_size': np.float64(self.cell_size),
+            **{name: values for name, values in self.arrays.items() if values is not None},
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> 'DensityGrid':
+        return cls(**{name: float(values) if name == 'cell_size' else values for name, values in arrays.items()})
+
+
+def build_levels(
+    columns: TrajectoryColumns,
+    offsets: Sequence[int],
+    levels: Sequence[float] = LEVELS
+) -> Dict[float, DensityGrid]:
+    """
+    Return the grids of the points of the trajectories at each level, the finest one aggregated from the points
+    and coarsened to the others. The hour counts are dropped from the levels finer than `HOURS_CELL_SIZE`.
+    """
+    levels = sorted(levels)
+    grids = {levels[0]: DensityGrid.from_columns(columns, offsets, levels[0])}
+    for finer, cell_size in zip(levels[:-1], levels[1:]):
+        grids[cell_size] = grids[finer].coarsen(cell_size)
+    for cell_size, grid in grids.items():
+        if cell_size < HOURS_CELL_SIZE:
+            grid.hour_counts = None
+    return grids
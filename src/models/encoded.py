@@ -0,0 +1,317 @@
+from dataclasses import dataclass, fields
+from typing import Dict, Iterator, List, Sequence, Tuple
+import sys
+import numpy as np
+
+from models.columns import TrajectoryColumns, time_bounds
+from models.density import LEVELS, DensityGrid, build_levels
+from models.summary import TrajectorySummaries
+from utils.encoding import (decode_coordinates, decode_times, encode_bounds, encode_coordinates, encode_dictionary,
+                            encode_times)
+from utils.kinematics import compute_kinematics
+
+# the arrays with one entry per point
+POINT_ARRAYS = ('latitude', 'longitude', 'altitude', 'time_delta', 'label', 'significance')
+# points of the chunks decoded together to summarize the trajectories, about 64 MiB in flight with their kinematics
+CHUNK_POINTS = 2 ** 18
+
+
+@dataclass
+class EncodedTrajectories:
+    """
+    Compact encoding of the points of trajectories stored back to back (see `utils.encoding`), 17 bytes per
+    point (21 with the significance) against the 81 bytes of `TrajectoryColumns` with their kinematics.
+    The kinematics are not stored, they are computed from the encoded arrays; the time and bbox filters
+    compare the encoded arrays.
+    Attributes
+    ----------
+    user_ids : np.ndarray
+        object array, the dictionary of the user IDs.
+    trajectory_ids : np.ndarray
+        object array of the IDs of the trajectories.
+    user_code : np.ndarray
+        int32 index of the user of each trajectory in user_ids.
+    offsets : np.ndarray
+        int64, trajectory i holds the points offsets[i]:offsets[i + 1].
+    start_timestamp : np.ndarray
+        int64 seconds since the epoch the time deltas of each trajectory are counted from.
+    latitude, longitude : np.ndarray
+        int32 multiples of 1e-6 degree.
+    altitude : np.ndarray
+        float32 altitude.
+    time_delta : np.ndarray
+        int32 seconds from the start_timestamp of the trajectory.
+    label : np.ndarray
+        int8 codes into `LABELS`.
+    significance : np.ndarray, optional
+        float32 Douglas-Peucker significance of the points, None when not computed.
+    Properties
+    ----------
+    points : int
+        Number of points.
+    nbytes : int
+        Memory of the arrays and of the ID strings.
+    timestamp : np.ndarray
+        float64 seconds since the epoch of the points.
+    Methods
+    -------
+    from_columns(cls, columns: TrajectoryColumns, offsets: Sequence[int], trajectory_ids: Sequence[str], user_ids: Sequence[str]) -> 'EncodedTrajectories'
+        Encode trajectories concatenated in columns, in one vectorized pass.
+    decode(i: int) -> TrajectoryColumns
+        Return the points of the i-th trajectory, without kinematics.
+    compute_kinematics(method: str = 'vincenty') -> Dict[str, np.ndarray]
+        Compute the kinematics of all the points in one pass.
+    decode_columns(method: str = None) -> TrajectoryColumns
+        Return the points of all the trajectories, with their kinematics when a method is given.
+    chunks(max_points: int = CHUNK_POINTS) -> Iterator['EncodedTrajectories']
+        Split the trajectories in consecutive chunks of at most max_points points.
+    summaries(method: str = 'vincenty', max_points: int = CHUNK_POINTS) -> TrajectorySummaries
+        Return the summary statistics of the trajectories, decoded chunk by chunk.
+    density(method: str = 'vincenty', max_points: int = CHUNK_POINTS, levels: Sequence[float] = LEVELS) -> Dict[float, DensityGrid]
+        Return the density grids of the points, decoded chunk by chunk.
+    select(trajectory_mask: np.ndarray, point_mask: np.ndarray = None) -> 'EncodedTrajectories'
+        Keep the selected trajectories, reduced to the selected points when a point mask is given.
+    select_users(user_ids: List[str]) -> 'EncodedTrajectories'
+        Keep the trajectories of the users.
+    filter_time_range(datetime_range: Tuple) -> 'EncodedTrajectories'
+        Keep the points in the time range.
+    query_bbox(min_lon: float, min_lat: float, max_lon: float, max_lat: float, clip: bool = False) -> 'EncodedTrajectories'
+        Keep the trajectories with points in the bbox, reduced to these points when clip is True.
+    save(file_path: str, compressed: bool = True) -> None / load(cls, file_path: str) -> 'EncodedTrajectories'
+        Write and read the arrays as a .npz file.
+    """
+
+    user_ids: np.ndarray
+    trajectory_ids: np.ndarray
+    user_code: np.ndarray
+    offsets: np.ndarray
+    start_timestamp: np.ndarray
+    latitude: np.ndarray
+    longitude: np.ndarray
+    altitude: np.ndarray
+    time_delta: np.ndarray
+    label: np.ndarray
+    significance: np.ndarray = None
+
+    def __post_init__(self):
+        self.user_ids = np.asarray(self.user_ids, dtype=object)
+        self.trajectory_ids = np.asarray(self.trajectory_ids, dtype=object)
+        self.user_code = np.asarray(self.user_code, dtype=np.int32)
+        self.offsets = np.asarray(self.offsets, dtype=np.int64)
+        self.start_timestamp = np.asarray(self.start_timestamp, dtype=np.int64)
+        self.latitude = np.asarray(self.latitude, dtype=np.int32)
+        self.longitude = np.asarray(self.longitude, dtype=np.int32)
+        self.altitude = np.asarray(self.altitude, dtype=np.float32)
+        self.time_delta = np.asarray(self.time_delta, dtype=np.int32)
+        self.label = np.asarray(self.label, dtype=np.int8)
+        if self.significance is not None:
+            self.significance = np.asarray(self.significance, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.trajectory_ids)
+
+    @property
+    def points(self) -> int:
+        return len(self.time_delta)
+
+    @property
+    def nbytes(self) -> int:
+        strings = sum(sys.getsizeof(value) for value in self.user_ids) + sum(sys.getsizeof(value) for value in self.trajectory_ids)
+        return strings + sum(
+            getattr(self, f.name).nbytes for f in fields(self)
+            if getattr(self, f.name) is not None and f.name not in ('user_ids', 'trajectory_ids')
+        )
+
+    @property
+    def timestamp(self) -> np.ndarray:
+        return decode_times(self.start_timestamp, self.time_delta, self.offsets)
+
+    @classmethod
+    def from_columns(
+        cls,
+        columns: TrajectoryColumns,
+        offsets: Sequence[int],
+        trajectory_ids: Sequence[str],
+        user_ids: Sequence[str]
+    ) -> 'EncodedTrajectories':
+        """
+        Encode the trajectories concatenated in `columns`, trajectory i holding the points offsets[i]:offsets[i + 1]
+        and belonging to user_ids[i]
+        """
+        start_timestamp, time_delta = encode_times(columns.timestamp, offsets)
+        user_code, user_dictionary = encode_dictionary(user_ids)
+        return cls(
+            user_ids=user_dictionary,
+            trajectory_ids=trajectory_ids,
+            user_code=user_code,
+            offsets=offsets,
+            start_timestamp=start_timestamp,
+            latitude=encode_coordinates(columns.latitude),
+            longitude=encode_coordinates(columns.longitude),
+            altitude=columns.altitude,
+            time_delta=time_delta,
+            label=columns.label,
+            significance=columns.significance,
+        )
+
+    def decode(self, i: int) -> TrajectoryColumns:
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return TrajectoryColumns(
+            latitude=decode_coordinates(self.latitude[start:end]),
+            longitude=decode_coordinates(self.longitude[start:end]),
+            altitude=self.altitude[start:end],
+            timestamp=self.time_delta[start:end] + np.float64(self.start_timestamp[i]),
+            label=self.label[start:end],
+            significance=None if self.significance is None else self.significance[start:end],
+        )
+
+    def compute_kinematics(self, method: str = 'vincenty') -> Dict[str, np.ndarray]:
+        """
+        Compute the time differences, distance, speed, acceleration and bearing of all the points, see
+        `utils.kinematics.compute_kinematics`
+        """
+        return compute_kinematics(
+            decode_coordinates(self.latitude), decode_coordinates(self.longitude), self.timestamp,
+            offsets=self.offsets[:-1], method=method
+        )
+
+    def decode_columns(self, method: str = None) -> TrajectoryColumns:
+        """
+        Return the points of all the trajectories in one TrajectoryColumns, with their kinematics when a method
+        is given
+        """
+        kinematics = self.compute_kinematics(method=method) if method else {}
+        return TrajectoryColumns(
+            latitude=decode_coordinates(self.latitude),
+            longitude=decode_coordinates(self.longitude),
+            altitude=self.altitude,
+            timestamp=self.timestamp,
+            label=self.label,
+            significance=self.significance,
+            **kinematics,
+        )
+
+    def chunks(self, max_points: int = CHUNK_POINTS) -> Iterator['EncodedTrajectories']:
+        """
+        Yield the trajectories in consecutive chunks of at most max_points points (a longer trajectory is a chunk
+        of its own), as views on the arrays
+        """
+        start = 0
+        while start < len(self):
+            end = max(int(np.searchsorted(self.offsets, self.offsets[start] + max_points, side='right')) - 1, start + 1)
+            first, last = self.offsets[start], self.offsets[end]
+            yield EncodedTrajectories(
+                user_ids=self.user_ids,
+                trajectory_ids=self.trajectory_ids[start:end],
+                user_code=self.user_code[start:end],
+                offsets=self.offsets[start:end + 1] - first,
+                start_timestamp=self.start_timestamp[start:end],
+                **{
+                    name: None if getattr(self, name) is None else getattr(self, name)[first:last]
+                    for name in POINT_ARRAYS
+                },
+            )
+            start = end
+
+    def summaries(self, method: str = 'vincenty', max_points: int = CHUNK_POINTS) -> TrajectorySummaries:
+        """
+        Return the summary statistics of the trajectories with their kinematics, decoding max_points points at a
+        time instead of the whole dataset
+        """
+        return TrajectorySummaries.concatenate([
+            TrajectorySummaries.from_columns(
+                chunk.decode_columns(method), chunk.offsets, chunk.trajectory_ids, chunk.user_ids[chunk.user_code],
+            )
+            for chunk in self.chunks(max_points)
+        ])
+
+    def density(
+        self,
+        method: str = 'vincenty',
+        max_points: int = CHUNK_POINTS,
+        levels: Sequence[float] = LEVELS
+    ) -> Dict[float, DensityGrid]:
+        """
+        Return the density grids of the points at each level, merged from the grids of chunks of max_points points
+        """
+        grids = [build_levels(chunk.decode_columns(method), chunk.offsets, levels) for chunk in self.chunks(max_points)]
+        return {cell_size: DensityGrid.merge([chunk[cell_size] for chunk in grids], cell_size) for cell_size in levels}
+
+    def select(
+        self,
+        trajectory_mask: np.ndarray,
+        point_mask: np.ndarray = None
+    ) -> 'EncodedTrajectories':
+        """
+        Keep the trajectories of trajectory_mask; with a point_mask only its points are kept and the
+        trajectories left without points are dropped. The user dictionary is kept as is.
+        """
+        counts = np.diff(self.offsets)
+        keep = np.repeat(trajectory_mask, counts)
+        if point_mask is not None:
+            keep &= point_mask
+            counts = np.bincount(np.repeat(np.arange(len(self)), counts)[keep], minlength=len(self))
+            trajectory_mask = trajectory_mask & (counts > 0)
+        return EncodedTrajectories(
+            user_ids=self.user_ids,
+            trajectory_ids=self.trajectory_ids[trajectory_mask],
+            user_code=self.user_code[trajectory_mask],
+            offsets=np.concatenate([[0], np.cumsum(counts[trajectory_mask])]),
+            start_timestamp=self.start_timestamp[trajectory_mask],
+            **{
+                name: None if getattr(self, name) is None else getattr(self, name)[keep]
+                for name in POINT_ARRAYS
+            },
+        )
+
+    def select_users(self, user_ids: List[str]) -> 'EncodedTrajectories':
+        return self.select(np.isin(self.user_ids[self.user_code], list(user_ids)))
+
+    def filter_time_range(self, datetime_range: Tuple) -> 'EncodedTrajectories':
+        """
+        Keep the points with start <= timestamp <= end, the bounds are shifted to the time deltas of each trajectory
+        """
+        start, end = time_bounds(datetime_range)
+        counts = np.diff(self.offsets)
+        low = np.repeat(np.ceil(start) - self.start_timestamp, counts)
+        high = np.repeat(np.floor(end) - self.start_timestamp, counts)
+        return self.select(np.ones(len(self), dtype=bool), (self.time_delta >= low) & (self.time_delta <= high))
+
+    def query_bbox(
+        self,
+        min_lon: float,
+        min_lat: float,
+        max_lon: float,
+        max_lat: float,
+        clip: bool = False
+    ) -> 'EncodedTrajectories':
+        """
+        Return the trajectories with points in the bbox, reduced to these points when clip is True.
+        The bbox is encoded once, the points are compared as int32.
+        """
+        min_lat, max_lat = encode_bounds(min_lat, max_lat)
+        min_lon, max_lon = encode_bounds(min_lon, max_lon)
+        inside = (
+            (self.latitude >= min_lat) & (self.latitude <= max_lat)
+            & (self.longitude >= min_lon) & (self.longitude <= max_lon)
+        )
+        if clip:
+            return self.select(np.ones(len(self), dtype=bool), inside)
+        trajectory_inside = np.bincount(np.repeat(np.arange(len(self)), np.diff(self.offsets))[inside], minlength=len(self)) > 0
+        return self.select(trajectory_inside)
+
+    def save(self, file_path: str, compressed: bool = True) -> None:
+        """
+        Write the arrays in a .npz file, the IDs as unicode arrays
+        """
+        arrays = {
+            f.name: np.asarray(getattr(self, f.name), dtype=str) if f.name in ('user_ids', 'trajectory_ids') else getattr(self, f.name)
+            for f in fields(self) if getattr(self, f.name) is not None
+        }
+        with open(file_path, 'wb') as f:
+            (np.savez_compressed if compressed else np.savez)(f, **arrays)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'EncodedTrajectories':
+        with np.load(file_path) as data:
+            return cls(**{name: data[name] for name in data.files})
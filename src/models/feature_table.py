@@ -0,0 +1,199 @@
+from typing import Dict, List, Tuple
+import re
+import numpy as np
+import pandas as pd
+
+from models.summary import FEATURES, TrajectorySummaries
+
+# operators of the DataTable filter syntax, the symbolic and the word forms
+FILTER_OPERATORS = {
+    '>=': 'ge', '<=': 'le', '!=': 'ne', '>': 'gt', '<': 'lt', '=': 'eq',
+    'ge': 'ge', 'le': 'le', 'ne': 'ne', 'gt': 'gt', 'lt': 'lt', 'eq': 'eq',
+    'contains': 'contains', 'datestartswith': 'datestartswith',
+}
+# the text operators may be prefixed with s (case sensitive, the default) or i (case insensitive)
+FILTER_PATTERN = re.compile(
+    r'^\s*\{(?P<column>[^}]+)\}\s*(?P<case>[si])?(?P<operator>>=|<=|!=|>|<|=|ge|le|ne|gt|lt|eq|contains|datestartswith)\s+'
+    r'(?P<value>.*?)\s*$'
+)
+
+# a datetime prefix made of complete components, the period it starts is looked up in the sorted index
+DATE_PREFIX_PATTERN = re.compile(r'^\d{4}(-\d{2}(-\d{2}([ T]\d{2}(:\d{2}(:\d{2})?)?)?)?)?$')
+
+
+def parse_filter_query(filter_query: str) -> List[Tuple[str, str, str]]:
+    """
+    Split a DataTable filter_query ('{user_id} = 000 && {duration} > 600') into (column, operator, value) triples,
+    with the operators of `FILTER_OPERATORS` normalized to their word form, prefixed with 'i' when case insensitive
+    """
+    filters = []
+    for part in (filter_query or '').split(' && '):
+        if not part.strip():
+            continue
+        match = FILTER_PATTERN.match(part)
+        if match is None:
+            raise ValueError(f'Unsupported filter {part!r}')
+        value = match['value']
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'`':
+            value = value[1:-1]
+        operator = FILTER_OPERATORS[match['operator']]
+        filters.append((match['column'], f'i{operator}' if match['case'] == 'i' else operator, value))
+    return filters
+
+
+_COMPARISONS = ('eq', 'ne', 'gt', 'ge', 'lt', 'le')
+
+
+def _compare(values: np.ndarray, operator: str, value) -> np.ndarray:
+    with np.errstate(invalid='ignore'):
+        return {
+            'eq': lambda: values == value,
+            'ne': lambda: values != value,
+            'gt': lambda: values > value,
+            'ge': lambda: values >= value,
+            'lt': lambda: values < value,
+            'le': lambda: values <= value,
+        }[operator]()
+
+
+class FeatureTable:
+    """
+    Features of the trajectories of a dataset (see `summary.FEATURES`), paged, sorted and filtered on the
+    server for a DataTable in custom mode.
+    The filters on the user, the start and end datetimes and the duration are answered with sorted indexes:
+    the user rows come from a dictionary and the ranges from binary searches, then the other filters are
+    evaluated on these candidate rows only.
+    Methods
+    -------
+    query(filter_query: str = '', sort_by: List[Dict] = None, page_current: int = 0, page_size: int = 50, user_id: str = None) -> Tuple[pd.DataFrame, int]
+        Return the rows of a page and the number of matching rows.
+    """
+
+    RANGE_COLUMNS = ('start_datetime', 'end_datetime', 'duration')
+
+    def __init__(self, summaries: TrajectorySummaries):
+        frame = summaries.to_frame()[list(FEATURES)]
+        # rows in start order, the default order of the table
+        order = np.argsort(summaries.start_timestamp, kind='stable')
+        self.frame = frame.iloc[order].reset_index(drop=True)
+        self.size = len(self.frame)
+        self.values = {
+            'start_datetime': summaries.start_timestamp[order],
+            'end_datetime': summaries.end_timestamp[order],
+            'duration': summaries.duration[order],
+        }
+        self.sorted = {}
+        for column, values in self.values.items():
+            column_order = np.argsort(values, kind='stable')
+            self.sorted[column] = (values[column_order], column_order)
+        user_ids = self.frame['user_id'].to_numpy()
+        users, inverse = np.unique(user_ids.astype(str), return_inverse=True)
+        rows = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[rows], np.arange(len(users) + 1))
+        self.user_rows = {user: rows[bounds[i]:bounds[i + 1]] for i, user in enumerate(users)}
+
+    @staticmethod
+    def _range_value(column: str, value: str) -> float:
+        """
+        Convert a filter value to the seconds of the range indexes: datetimes for the start and end, seconds or a
+        timedelta ('00:10:00', '2 days') for the duration
+        """
+        if column == 'duration':
+            try:
+                return float(value)
+            except ValueError:
+                return pd.Timedelta(value).total_seconds()
+        return pd.Timestamp(value).value / 1e9
+
+    def _range_rows(self, column: str, operator: str, value: str) -> np.ndarray:
+        """
+        Return the rows matching a comparison on an indexed column with binary searches on its sorted values
+        """
+        values, order = self.sorted[column]
+        if operator == 'datestartswith':
+            if not DATE_PREFIX_PATTERN.match(value):
+                # a partial component ('2008-11-0') is matched as a text prefix
+                return self._filter_rows(np.arange(self.size), column, operator, value)
+            period = pd.Period(value)
+            low, high = period.start_time.value / 1e9, period.end_time.value / 1e9
+            return order[np.searchsorted(values, low, side='left'):np.searchsorted(values, high, side='right')]
+        x = self._range_value(column, value)
+        # NaN (empty trajectories) are sorted last and never match
+        n = len(values) - np.isnan(values).sum()
+        left, right = np.searchsorted(values[:n], x, side='left'), np.searchsorted(values[:n], x, side='right')
+        selected = {
+            'eq': order[left:right],
+            'ge': order[left:n], 'gt': order[right:n],
+            'le': order[:right], 'lt': order[:left],
+            'ne': np.concatenate([order[:left], order[right:n]]),
+        }[operator]
+        return selected
+
+    def _filter_rows(self, rows: np.ndarray, column: str, operator: str, value: str) -> np.ndarray:
+        """
+        Return the candidate rows matching a filter on a column without index
+        """
+        if column not in self.frame:
+            raise ValueError(f'Unknown column {column!r}')
+        insensitive = operator.startswith('i')
+        operator = operator[1:] if insensitive else operator
+        values = self.frame[column].to_numpy()[rows]
+        if pd.api.types.is_numeric_dtype(self.frame[column]) and operator in _COMPARISONS:
+            return rows[_compare(values.astype(np.float64), operator, float(value))]
+        text = pd.Series(values, dtype=object).astype(str)
+        if insensitive:
+            text, value = text.str.lower(), value.lower()
+        if operator == 'contains':
+            keep = text.str.contains(value, regex=False).to_numpy()
+        elif operator == 'datestartswith':
+            keep = text.str.startswith(value).to_numpy()
+        else:
+            keep = _compare(text.to_numpy(dtype=str), operator, value)
+        return rows[keep]
+
+    def query(
+        self,
+        filter_query: str = '',
+        sort_by: List[Dict] = None,
+        page_current: int = 0,
+        page_size: int = 50,
+        user_id: str = None
+    ) -> Tuple[pd.DataFrame, int]:
+        """
+        Return the rows of page page_current, after filtering and sorting, and the number of matching rows.
+        user_id restricts the rows to one user, like a '{user_id} = ...' filter.
+        """
+        filters = parse_filter_query(filter_query)
+        if user_id is not None:
+            filters.append(('user_id', 'eq', str(user_id)))
+
+        # the indexed filters give candidate rows, the smallest set is refined by the other filters
+        candidates = []
+        others = []
+        for column, operator, value in filters:
+            if column == 'user_id' and operator == 'eq':
+                candidates.append(self.user_rows.get(value, np.array([], dtype=np.int64)))
+            elif column in self.RANGE_COLUMNS and (operator in _COMPARISONS or (operator == 'datestartswith' and column != 'duration')):
+                candidates.append(self._range_rows(column, operator, value))
+            else:
+                others.append((column, operator, value))
+        if candidates:
+            candidates.sort(key=len)
+            rows = np.sort(candidates[0])
+            for other in candidates[1:]:
+                rows = rows[np.isin(rows, other)]
+        else:
+            rows = np.arange(self.size)
+        for column, operator, value in others:
+            rows = self._filter_rows(rows, column, operator, value)
+
+        page = self.frame.iloc[rows]
+        if sort_by:
+            page = page.sort_values(
+                by=[sort['column_id'] for sort in sort_by],
+                ascending=[sort['direction'] == 'asc' for sort in sort_by],
+                kind='stable',
+                na_position='last',
+            )
+        start = page_current * page_size
+        return page.iloc[start:start + page_size], len(rows)
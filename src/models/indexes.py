@@ -0,0 +1,187 @@
+from typing import Dict, List, Tuple
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from models.summary import TrajectorySummaries
+from models.trajectory import Trajectory
+from utils.kinematics import EARTH_RADIUS, haversine
+
+
+class TimeIndex:
+    """
+    Interval index over the [start, end] timestamps of a list of trajectories.
+    The trajectories are sorted by start, a query keeps the prefix starting before the end of the window
+    (binary search) and, within it, those ending after its start: trajectories that do not overlap the window
+    are skipped without touching their points.
+    With the summaries of the trajectories, the index is built without reading their points either.
+    """
+
+    def __init__(self, trajectories: List[Trajectory], summaries: TrajectorySummaries = None):
+        self.size = len(trajectories)
+        if summaries is not None:
+            starts = np.where(summaries.count > 0, summaries.start_timestamp, np.inf)
+            ends = np.where(summaries.count > 0, summaries.end_timestamp, -np.inf)
+        else:
+            starts = np.array([trajectory.columns.timestamp[0] if trajectory.count else np.inf for trajectory in trajectories])
+            ends = np.array([trajectory.columns.timestamp[-1] if trajectory.count else -np.inf for trajectory in trajectories])
+        self.order = np.argsort(starts, kind='stable')
+        self.starts = starts[self.order]
+        self.ends = ends[self.order]
+
+    def query(self, start: float, end: float) -> np.ndarray:
+        """
+        Return the positions, in the original list, of the trajectories overlapping [start, end], in list order
+        """
+        prefix = np.searchsorted(self.starts, end, side='right')
+        return np.sort(self.order[:prefix][self.ends[:prefix] >= start])
+
+
+class EndpointIndex:
+    """
+    Index over the first and last points of a list of trajectories, for the similarity search.
+    An STRtree over the first points finds the trajectories starting near a point; the first and last points
+    and the bounding boxes give the lower bounds of `utils.similarity` without reading the other points.
+    With the summaries of the trajectories, the bounding boxes are not computed from the points.
+    """
+
+    def __init__(self, trajectories: List[Trajectory], summaries: TrajectorySummaries = None):
+        self.size = len(trajectories)
+        endpoints = np.array([
+            [trajectory.columns.latitude[0], trajectory.columns.longitude[0],
+             trajectory.columns.latitude[-1], trajectory.columns.longitude[-1]]
+            if trajectory.count else [np.nan] * 4
+            for trajectory in trajectories
+        ]).reshape(-1, 4)
+        self.start_latitude, self.start_longitude, self.end_latitude, self.end_longitude = endpoints.T
+        if summaries is not None:
+            self.bounds = summaries.bounds.reshape(-1, 4)
+            self.count = summaries.count
+        else:
+            self.bounds = np.array([
+                [trajectory.columns.longitude.min(), trajectory.columns.latitude.min(),
+                 trajectory.columns.longitude.max(), trajectory.columns.latitude.max()]
+                if trajectory.count else [np.nan] * 4
+                for trajectory in trajectories
+            ]).reshape(-1, 4)
+            self.count = np.array([trajectory.count for trajectory in trajectories], dtype=np.int64)
+        self.indexed = np.flatnonzero(~np.isnan(self.start_latitude))
+        self.tree = STRtree(shapely.points(self.start_longitude[self.indexed], self.start_latitude[self.indexed]))
+
+    def query(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> np.ndarray:
+        """
+        Return the sorted positions of the trajectories whose first point is in the bbox
+        """
+        return np.sort(self.indexed[self.tree.query(shapely.box(min_lon, min_lat, max_lon, max_lat))])
+
+
+class SpatialIndex:
+    """
+    Spatial index over a list of trajectories, with two levels:
+    - the bounding box of each trajectory, compared with a bbox in one vectorized test; the point queries
+      return early when no box intersects theirs;
+    - a packed grid over all the points, built on first use: the points are sorted by the row-major code of
+      their `cell_size` degrees cell, so the points of a bbox are read with one binary search per row of cells.
+    With the summaries of the trajectories, the bounding boxes are not computed from the points, and neither is
+    the grid for the queries away from all the trajectories.
+    """
+
+    def __init__(self, trajectories: List[Trajectory], cell_size: float = 0.01, summaries: TrajectorySummaries = None):
+        self.size = len(trajectories)
+        self.cell_size = cell_size
+        self.n_cols = int(np.ceil(360 / cell_size)) + 1
+        self.trajectories = trajectories
+        if summaries is not None:
+            self.bounds = summaries.bounds.reshape(-1, 4)
+        else:
+            self.bounds = np.array([
+                [trajectory.columns.longitude.min(), trajectory.columns.latitude.min(),
+                 trajectory.columns.longitude.max(), trajectory.columns.latitude.max()]
+                if trajectory.count else [np.nan] * 4
+                for trajectory in trajectories
+            ]).reshape(-1, 4)
+        self._points = None
+
+    def query(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> np.ndarray:
+        """
+        Return the sorted positions of the trajectories whose bounding box intersects the bbox
+        """
+        # NaN boxes of the empty trajectories fail every comparison
+        return np.flatnonzero(
+            (self.bounds[:, 0] <= max_lon) & (self.bounds[:, 2] >= min_lon)
+            & (self.bounds[:, 1] <= max_lat) & (self.bounds[:, 3] >= min_lat)
+        )
+
+    def cell_codes(self, latitude: np.ndarray, longitude: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the row and the column of the grid cells of the coordinates
+        """
+        rows = np.floor((np.asarray(latitude) + 90) / self.cell_size).astype(np.int64)
+        cols = np.floor((np.asarray(longitude) + 180) / self.cell_size).astype(np.int64)
+        return rows, cols
+
+    @property
+    def points(self) -> Dict[str, np.ndarray]:
+        """
+        Return the packed grid: cell codes, global point positions and coordinates, sorted by cell code
+        """
+        if self._points is None:
+            latitude = np.concatenate([trajectory.columns.latitude for trajectory in self.trajectories] or [[]])
+            longitude = np.concatenate([trajectory.columns.longitude for trajectory in self.trajectories] or [[]])
+            rows, cols = self.cell_codes(latitude, longitude)
+            codes = rows * self.n_cols + cols
+            order = np.argsort(codes, kind='stable')
+            self._points = {
+                'offsets': np.cumsum([0] + [trajectory.count for trajectory in self.trajectories]),
+                'codes': codes[order],
+                'positions': order.astype(np.int64),
+                'latitude': latitude[order],
+                'longitude': longitude[order],
+            }
+        return self._points
+
+    def _query_packed(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> np.ndarray:
+        """
+        Return the positions, in the packed arrays, of the points in the bbox
+        """
+        if not len(self.query(min_lon, min_lat, max_lon, max_lat)):
+            return np.array([], dtype=np.int64)
+        points = self.points
+        (row_min, row_max), (col_min, col_max) = self.cell_codes([min_lat, max_lat], [min_lon, max_lon])
+        rows = np.arange(row_min, row_max + 1)
+        starts = np.searchsorted(points['codes'], rows * self.n_cols + col_min, side='left')
+        ends = np.searchsorted(points['codes'], rows * self.n_cols + col_max, side='right')
+        candidates = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)] or [np.array([], dtype=np.int64)])
+        latitude, longitude = points['latitude'][candidates], points['longitude'][candidates]
+        return candidates[(latitude >= min_lat) & (latitude <= max_lat) & (longitude >= min_lon) & (longitude <= max_lon)]
+
+    def _unpack(self, packed: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the trajectory positions and the point indices of packed positions, sorted by trajectory then point
+        """
+        if not len(packed):
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        offsets = self.points['offsets']
+        positions = np.sort(self.points['positions'][packed])
+        trajectory_positions = np.searchsorted(offsets, positions, side='right') - 1
+        return trajectory_positions, positions - offsets[trajectory_positions]
+
+    def query_points(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the trajectory positions and the point indices, within their trajectory, of the points in the bbox,
+        sorted by trajectory then point
+        """
+        return self._unpack(self._query_packed(min_lon, min_lat, max_lon, max_lat))
+
+    def query_radius(self, latitude: float, longitude: float, radius: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the trajectory positions and the point indices of the points within radius meters of
+        (latitude, longitude), sorted by trajectory then point
+        """
+        delta_lat = np.degrees(radius / EARTH_RADIUS)
+        delta_lon = delta_lat / max(np.cos(np.radians(latitude)), 1e-6)
+        packed = self._query_packed(longitude - delta_lon, latitude - delta_lat, longitude + delta_lon, latitude + delta_lat)
+        if not len(packed):
+            return self._unpack(packed)
+        distances = haversine(latitude, longitude, self.points['latitude'][packed], self.points['longitude'][packed])
+        return self._unpack(packed[distances <= radius])
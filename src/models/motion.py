@@ -0,0 +1,185 @@
+from dataclasses import dataclass, fields
+from typing import Dict, Iterator, List, Sequence, Union
+import numpy as np
+import pandas as pd
+
+from models.columns import NO_LABEL, TrajectoryColumns, decode_labels
+from utils.kinematics import compute_kinematics
+from utils.motion import MOTION_FEATURES, point_features, segment_features, segment_offsets
+from utils.store import DatasetStore
+
+# the columns the features are computed from
+MOTION_COLUMNS = ('label',) + TrajectoryColumns.KINEMATICS
+
+
+def _kinematics(columns: TrajectoryColumns, offsets: np.ndarray, method: str) -> Dict[str, np.ndarray]:
+    """
+    Return the stored kinematics of the columns, computed in one pass when they are missing
+    """
+    if all(getattr(columns, name) is not None for name in TrajectoryColumns.KINEMATICS):
+        return {name: getattr(columns, name) for name in TrajectoryColumns.KINEMATICS}
+    return compute_kinematics(columns.latitude, columns.longitude, columns.timestamp, offsets=offsets[:-1], method=method)
+
+
+@dataclass
+class MotionFeatures:
+    """
+    Motion features of the segments of trajectories, the runs of consecutive points with the same transportation
+    mode, for mode detection: one row per segment in each array and in the feature matrix.
+    Attributes
+    ----------
+    trajectory_id, user_id : np.ndarray
+        object arrays of the identifiers of the trajectory of each segment.
+    label : np.ndarray
+        int8 label code of the segment, `NO_LABEL` for the unlabelled points.
+    start_timestamp, end_timestamp : np.ndarray
+        float64 seconds since the epoch of the first and last points of the segment.
+    count : np.ndarray
+        int64 number of points of the segment.
+    matrix : np.ndarray
+        float32 (segments, len(MOTION_FEATURES)) features (see `utils.motion.segment_features`).
+    Properties
+    ----------
+    labels : np.ndarray
+        Label strings of the segments, None when unlabelled.
+    Methods
+    -------
+    from_columns(cls, columns: TrajectoryColumns, offsets: Sequence[int], trajectory_ids: Sequence[str], user_ids: Sequence[str], method: str = 'vincenty', labelled_only: bool = False, **thresholds) -> 'MotionFeatures'
+        Compute the features of the segments of concatenated trajectories in one vectorized pass.
+    from_store(cls, store_path: str, user_ids: List[str] = None, users_per_chunk: int = 8, method: str = 'vincenty', labelled_only: bool = False, **thresholds) -> Iterator['MotionFeatures']
+        Yield the features of the users of a `DatasetStore`, chunk by chunk.
+    concatenate(cls, features: List['MotionFeatures']) -> 'MotionFeatures'
+        Concatenate features.
+    to_frame() -> pd.DataFrame
+        Return one row per segment with the identifiers, the label and one column per feature.
+    """
+
+    trajectory_id: np.ndarray
+    user_id: np.ndarray
+    label: np.ndarray
+    start_timestamp: np.ndarray
+    end_timestamp: np.ndarray
+    count: np.ndarray
+    matrix: np.ndarray
+
+    def __post_init__(self):
+        self.trajectory_id = np.asarray(self.trajectory_id, dtype=object)
+        self.user_id = np.asarray(self.user_id, dtype=object)
+        self.label = np.asarray(self.label, dtype=np.int8)
+        self.start_timestamp = np.asarray(self.start_timestamp, dtype=np.float64)
+        self.end_timestamp = np.asarray(self.end_timestamp, dtype=np.float64)
+        self.count = np.asarray(self.count, dtype=np.int64)
+        self.matrix = np.asarray(self.matrix, dtype=np.float32).reshape(len(self.count), len(MOTION_FEATURES))
+
+    def __len__(self) -> int:
+        return len(self.count)
+
+    def __getitem__(self, index: Union[slice, np.ndarray]) -> 'MotionFeatures':
+        return MotionFeatures(**{f.name: getattr(self, f.name)[index] for f in fields(self)})
+
+    @property
+    def labels(self) -> np.ndarray:
+        return decode_labels(self.label)
+
+    @classmethod
+    def from_columns(
+        cls,
+        columns: TrajectoryColumns,
+        offsets: Sequence[int],
+        trajectory_ids: Sequence[str],
+        user_ids: Sequence[str],
+        method: str = 'vincenty',
+        labelled_only: bool = False,
+        **thresholds
+    ) -> 'MotionFeatures':
+        """
+        Compute the features of the segments of the trajectories concatenated in `columns`, trajectory i holding
+        the points offsets[i]:offsets[i + 1]. The stored kinematics are used, computed with `method` when missing.
+        labelled_only drops the unlabelled segments; thresholds are passed to `utils.motion.segment_features`.
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        kinematics = _kinematics(columns, offsets, method)
+        segments, positions = segment_offsets(columns.label, offsets)
+        matrix = segment_features(
+            kinematics['time_diff'], kinematics['distance'], kinematics['speed'], kinematics['acceleration'],
+            kinematics['bearing'], offsets, segments, **thresholds
+        )
+        features = cls(
+            trajectory_id=np.asarray(trajectory_ids, dtype=object)[positions],
+            user_id=np.asarray(user_ids, dtype=object)[positions],
+            label=columns.label[segments[:-1]],
+            start_timestamp=columns.timestamp[segments[:-1]],
+            end_timestamp=columns.timestamp[segments[1:] - 1],
+            count=np.diff(segments),
+            matrix=matrix,
+        )
+        return features[features.label != NO_LABEL] if labelled_only else features
+
+    @classmethod
+    def from_store(
+        cls,
+        store_path: str,
+        user_ids: List[str] = None,
+        users_per_chunk: int = 8,
+        method: str = 'vincenty',
+        labelled_only: bool = False,
+        **thresholds
+    ) -> Iterator['MotionFeatures']:
+        """
+        Yield the features of the users of a DatasetStore (all of them by default), users_per_chunk users at a time:
+        only the points of one chunk are in memory, read from the memory-mapped partitions without building
+        `Trajectory` objects
+        """
+        store = DatasetStore(store_path)
+        user_ids = store.user_ids if user_ids is None else user_ids
+        for i in range(0, len(user_ids), users_per_chunk):
+            parts, offsets, trajectory_ids, trajectory_users = [], [0], [], []
+            for user_id in user_ids[i:i + users_per_chunk]:
+                columns, user_offsets, ids = store.read_columns(user_id, columns=MOTION_COLUMNS)
+                if columns is None:
+                    continue
+                parts.append(columns)
+                offsets.extend(offsets[-1] + np.asarray(user_offsets[1:]))
+                trajectory_ids.extend(ids)
+                trajectory_users.extend([user_id] * len(ids))
+            if parts:
+                yield cls.from_columns(
+                    TrajectoryColumns.concatenate(parts), offsets, trajectory_ids, trajectory_users,
+                    method=method, labelled_only=labelled_only, **thresholds
+                )
+
+    @classmethod
+    def concatenate(cls, features: List['MotionFeatures']) -> 'MotionFeatures':
+        if not features:
+            return cls(**{f.name: [] for f in fields(cls)})
+        return cls(**{
+            f.name: np.concatenate([getattr(feature, f.name) for feature in features])
+            for f in fields(cls)
+        })
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Return one row per segment, with the start and end datetimes, the label and one column per feature
+        """
+        df = pd.DataFrame({
+            'trajectory_id': self.trajectory_id,
+            'user_id': self.user_id,
+            'label': self.labels,
+            'start_datetime': pd.to_datetime(self.start_timestamp, unit='s'),
+            'end_datetime': pd.to_datetime(self.end_timestamp, unit='s'),
+            'count': self.count,
+        })
+        return pd.concat([df, pd.DataFrame(self.matrix, columns=list(MOTION_FEATURES))], axis=1)
+
+
+def motion_point_features(columns: TrajectoryColumns, offsets: Sequence[int], method: str = 'vincenty') -> Dict[str, np.ndarray]:
+    """
+    Return the per-point motion features (jerk, heading change and its rate, velocity change, see
+    `utils.motion.point_features`) of the trajectories concatenated in `columns`
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    kinematics = _kinematics(columns, offsets, method)
+    return point_features(
+        kinematics['time_diff'], kinematics['distance'], kinematics['speed'], kinematics['acceleration'],
+        kinematics['bearing'], offsets
+    )
@@ -0,0 +1,108 @@
+from typing import Tuple
+import numpy as np
+
+from models.columns import TrajectoryColumns
+from utils.cleaning import (MAX_ACCELERATION, MAX_DISTANCE_GAP, MAX_SPEED, MAX_TIME_GAP, MIN_POINTS, drop_kinematics,
+                            duplicate_mask, gap_offsets, mask_offsets, outlier_mask, resample_positions)
+from utils.kinematics import compute_kinematics
+from utils.metrics import metrics
+
+# The functions take the points of trajectories concatenated in a TrajectoryColumns, trajectory i holding the
+# points offsets[i]:offsets[i + 1], and return new columns with their kinematics computed (one pass over all
+# the points) and without significance, the levels of detail of the original points being no longer valid.
+
+
+def _with_kinematics(columns: TrajectoryColumns, offsets: np.ndarray, method: str) -> TrajectoryColumns:
+    kinematics = compute_kinematics(columns.latitude, columns.longitude, columns.timestamp, offsets=offsets[:-1], method=method)
+    for name, values in kinematics.items():
+        setattr(columns, name, values)
+    columns.significance = None
+    return columns
+
+
+@metrics.timed('preprocess.clean')
+def clean_columns(
+    columns: TrajectoryColumns,
+    offsets: np.ndarray,
+    max_speed: float = MAX_SPEED,
+    max_acceleration: float = MAX_ACCELERATION,
+    method: str = 'vincenty'
+) -> Tuple[TrajectoryColumns, np.ndarray]:
+    """
+    Drop the points with the timestamp of the previous point and the speed or acceleration outliers
+    (see `utils.cleaning.outlier_mask`), return the remaining points and their offsets
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    keep = ~duplicate_mask(columns.timestamp, offsets)
+    columns, offsets = columns[keep], mask_offsets(offsets, keep)
+    keep, kinematics = outlier_mask(
+        columns.latitude, columns.longitude, columns.timestamp, offsets,
+        max_speed=max_speed, max_acceleration=max_acceleration, method=method
+    )
+    metrics.count('preprocess.dropped_points', int(len(keep) - keep.sum()))
+    columns, offsets = columns[keep], mask_offsets(offsets, keep)
+    for name, values in kinematics.items():
+        setattr(columns, name, values)
+    columns.significance = None
+    return columns, offsets
+
+
+@metrics.timed('preprocess.split_gaps')
+def split_columns(
+    columns: TrajectoryColumns,
+    offsets: np.ndarray,
+    max_time_gap: float = MAX_TIME_GAP,
+    max_distance_gap: float = MAX_DISTANCE_GAP,
+    min_points: int = MIN_POINTS,
+    method: str = 'vincenty'
+) -> Tuple[TrajectoryColumns, np.ndarray, np.ndarray]:
+    """
+    Split the trajectories where the time or the distance from the previous point exceeds the gaps and drop the
+    segments of less than min_points points. Return the points of the segments, their offsets and the index of
+    the trajectory of each segment.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if any(getattr(columns, name) is None for name in TrajectoryColumns.KINEMATICS):
+        columns = _with_kinematics(columns[:], offsets, method)
+    bounds, parent = gap_offsets(columns.time_diff, columns.distance, offsets, max_time_gap, max_distance_gap)
+    counts = np.diff(bounds)
+    kept = counts >= min_points
+    keep = np.repeat(kept, counts)
+    offsets = np.concatenate([[0], np.cumsum(counts[kept])])
+    # the steps within the segments are unchanged, the first points of the segments lose theirs
+    kinematics = drop_kinematics(
+        {name: getattr(columns, name) for name in TrajectoryColumns.KINEMATICS}, keep,
+        columns.latitude, columns.longitude, columns.timestamp, offsets, method=method
+    )
+    columns = columns[keep]
+    for name, values in kinematics.items():
+        setattr(columns, name, values)
+    columns.significance = None
+    return columns, offsets, parent[kept]
+
+
+@metrics.timed('preprocess.resample')
+def resample_columns(
+    columns: TrajectoryColumns,
+    offsets: np.ndarray,
+    step: float,
+    method: str = 'vincenty'
+) -> Tuple[TrajectoryColumns, np.ndarray]:
+    """
+    Resample the trajectories every step seconds from their first point: the coordinates and the altitude are
+    interpolated linearly between the surrounding points, the label is the one of the point before.
+    Split the trajectories at their gaps first, the points of a gap would be interpolated along a straight line.
+    """
+    timestamp, offsets, previous, following, weight = resample_positions(columns.timestamp, offsets, step)
+
+    def interpolate(values: np.ndarray) -> np.ndarray:
+        return values[previous] + weight * (values[following] - values[previous])
+
+    resampled = TrajectoryColumns(
+        latitude=interpolate(columns.latitude),
+        longitude=interpolate(columns.longitude),
+        altitude=interpolate(columns.altitude),
+        timestamp=timestamp,
+        label=columns.label[previous],
+    )
+    return _with_kinematics(resampled, offsets, method), offsets
@@ -0,0 +1,154 @@
+from dataclasses import dataclass, fields
+from typing import Dict, List, Sequence, Union
+import numpy as np
+import pandas as pd
+
+from models.columns import TrajectoryColumns
+from utils.staypoints import DISTANCE_THRESHOLD, TIME_THRESHOLD, dbscan, detect_stays
+
+
+@dataclass
+class StayPoints:
+    """
+    Stay points of trajectories, the places where a user stayed within a distance for a minimum time,
+    one entry per stay in each array.
+    Attributes
+    ----------
+    trajectory_id, user_id : np.ndarray
+        object arrays of the identifiers of the trajectory of each stay.
+    latitude, longitude : np.ndarray
+        float64 average coordinates of the points of the stay.
+    arrival, leave : np.ndarray
+        float64 seconds since the epoch of the first point of the stay and of the point leaving it, the first
+        point outside the radius.
+    count : np.ndarray
+        int64 number of points of the stay.
+    Properties
+    ----------
+    duration : np.ndarray
+        Duration of the stays in seconds.
+    Methods
+    -------
+    from_columns(cls, columns: TrajectoryColumns, offsets: Sequence[int], trajectory_ids: Sequence[str], user_ids: Sequence[str], distance_threshold: float = 200, time_threshold: float = 1200) -> 'StayPoints'
+        Detect the stay points of concatenated trajectories, with `utils.staypoints.detect_stays`.
+    concatenate(cls, stay_points: List['StayPoints']) -> 'StayPoints'
+        Concatenate stay points.
+    cluster(eps: float = 100, min_samples: int = 2, time_eps: float = None) -> np.ndarray
+        Return the place of each stay point, clustered with DBSCAN across trajectories and users, -1 for noise.
+    places(labels: np.ndarray = None, **kwargs) -> pd.DataFrame
+        Return the significant places, one row per cluster of stay points.
+    to_frame() -> pd.DataFrame
+        Return one row per stay point with datetimes and durations.
+    """
+
+    trajectory_id: np.ndarray
+    user_id: np.ndarray
+    latitude: np.ndarray
+    longitude: np.ndarray
+    arrival: np.ndarray
+    leave: np.ndarray
+    count: np.ndarray
+
+    def __post_init__(self):
+        for f in fields(self):
+            values = getattr(self, f.name)
+            if f.name in ('trajectory_id', 'user_id'):
+                setattr(self, f.name, np.asarray(values, dtype=object))
+            elif f.name == 'count':
+                setattr(self, f.name, np.asarray(values, dtype=np.int64))
+            else:
+                setattr(self, f.name, np.asarray(values, dtype=np.float64))
+
+    def __len__(self) -> int:
+        return len(self.count)
+
+    def __getitem__(self, index: Union[slice, np.ndarray]) -> 'StayPoints':
+        return StayPoints(**{name: values[index] for name, values in self.arrays.items()})
+
+    @property
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    @property
+    def duration(self) -> np.ndarray:
+        return self.leave - self.arrival
+
+    @classmethod
+    def from_columns(
+        cls,
+        columns: TrajectoryColumns,
+        offsets: Sequence[int],
+        trajectory_ids: Sequence[str],
+        user_ids: Sequence[str],
+        distance_threshold: float = DISTANCE_THRESHOLD,
+        time_threshold: float = TIME_THRESHOLD
+    ) -> 'StayPoints':
+        """
+        Detect the stay points of the trajectories concatenated in `columns`, trajectory i holding the points
+        offsets[i]:offsets[i + 1], within distance_threshold meters for at least time_threshold seconds
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        positions, first, after = detect_stays(
+            columns.latitude, columns.longitude, columns.timestamp, offsets,
+            distance_threshold=distance_threshold, time_threshold=time_threshold,
+        )
+        # the average coordinates of the points first:after of each stay, from cumulative sums
+        cumulative_latitude = np.concatenate([[0.0], np.cumsum(columns.latitude)])
+        cumulative_longitude = np.concatenate([[0.0], np.cumsum(columns.longitude)])
+        count = after - first
+        return cls(
+            trajectory_id=np.asarray(trajectory_ids, dtype=object)[positions],
+            user_id=np.asarray(user_ids, dtype=object)[positions],
+            latitude=(cumulative_latitude[after] - cumulative_latitude[first]) / np.maximum(count, 1),
+            longitude=(cumulative_longitude[after] - cumulative_longitude[first]) / np.maximum(count, 1),
+            arrival=columns.timestamp[first],
+            leave=columns.timestamp[after],
+            count=count,
+        )
+
+    @classmethod
+    def concatenate(cls, stay_points: List['StayPoints']) -> 'StayPoints':
+        if not stay_points:
+            return cls(**{f.name: [] for f in fields(cls)})
+        return cls(**{
+            f.name: np.concatenate([getattr(s, f.name) for s in stay_points])
+            for f in fields(cls)
+        })
+
+    def cluster(self, eps: float = 100.0, min_samples: int = 2, time_eps: float = None) -> np.ndarray:
+        """
+        Return the cluster of each stay point, -1 for noise: DBSCAN with eps meters over the stays of all the
+        trajectories, and the arrival times within time_eps seconds when given
+        """
+        return dbscan(self.latitude, self.longitude, eps, min_samples=min_samples, timestamp=self.arrival, time_eps=time_eps)
+
+    def places(self, labels: np.ndarray = None, **kwargs) -> pd.DataFrame:
+        """
+        Return the significant places, one row per cluster of `cluster(**kwargs)` (or of the given labels):
+        average coordinates, number of stays and of distinct users, total stay time, first arrival and last leave
+        """
+        if labels is None:
+            labels = self.cluster(**kwargs)
+        df = self.to_frame()
+        df['place'] = labels
+        df = df[df['place'] >= 0]
+        places = df.groupby('place').agg(
+            latitude=('latitude', 'mean'),
+            longitude=('longitude', 'mean'),
+            stay_count=('count', 'size'),
+            user_count=('user_id', 'nunique'),
+            total_duration=('duration', 'sum'),
+            first_arrival=('arrival_datetime', 'min'),
+            last_leave=('leave_datetime', 'max'),
+        )
+        return places.sort_values(by=['user_count', 'stay_count'], ascending=False)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Return one row per stay point, with the arrival and leave datetimes and the duration
+        """
+        df = pd.DataFrame({name: values for name, values in self.arrays.items() if name not in ('arrival', 'leave')})
+        df.insert(4, 'arrival_datetime', pd.to_datetime(self.arrival, unit='s'))
+        df.insert(5, 'leave_datetime', pd.to_datetime(self.leave, unit='s'))
+        df.insert(6, 'duration', df['leave_datetime'] - df['arrival_datetime'])
+        return df
@@ -0,0 +1,210 @@
+from dataclasses import dataclass, fields
+from typing import Dict, List, Sequence, Union
+import numpy as np
+import pandas as pd
+
+from models.columns import LABELS, NO_LABEL, TrajectoryColumns
+
+# columns of the features table of `Trajectories.features`
+FEATURES = ('trajectory_id', 'user_id', 'count', 'start_datetime', 'end_datetime', 'duration',
+            'total_distance', 'mean_speed', 'max_speed', 'label')
+
+
+@dataclass
+class TrajectorySummaries:
+    """
+    Summary statistics of trajectories, one entry per trajectory in each array.
+    They are computed once from the points and answer the features table, the time and bbox indexes and
+    the map centering without reading the points again.
+    Attributes
+    ----------
+    trajectory_id, user_id : np.ndarray
+        object arrays of the identifiers.
+    count : np.ndarray
+        int64 number of points.
+    start_timestamp, end_timestamp : np.ndarray
+        float64 seconds since the epoch of the first and last points, NaN for an empty trajectory.
+    min_latitude, min_longitude, max_latitude, max_longitude : np.ndarray
+        float64 bounding box of the points.
+    centroid_latitude, centroid_longitude : np.ndarray
+        float64 average coordinates of the points.
+    total_distance, mean_speed, max_speed : np.ndarray
+        float64 meters and meters per second (total distance over duration for the mean), NaN until the
+        kinematics are computed.
+    label_counts : np.ndarray
+        int64 (n, len(LABELS) + 1) number of points of each label, the last column counts the points without label.
+    Properties
+    ----------
+    duration : np.ndarray
+        Duration in seconds.
+    bounds : np.ndarray
+        (n, 4) min_longitude, min_latitude, max_longitude, max_latitude.
+    label : np.ndarray
+        Most frequent label of each trajectory, None when no point is labelled.
+    Methods
+    -------
+    from_columns(cls, columns: TrajectoryColumns, offsets: Sequence[int], trajectory_ids: Sequence[str], user_ids: Sequence[str]) -> 'TrajectorySummaries'
+        Compute the summaries of concatenated trajectories, in one vectorized pass over their points.
+    concatenate(cls, summaries: List['TrajectorySummaries']) -> 'TrajectorySummaries'
+        Concatenate summaries.
+    to_dict() -> Dict / from_dict(cls, data: Dict) -> 'TrajectorySummaries'
+        Convert to and from JSON-serializable lists, as persisted in the `DatasetStore` metadata.
+    to_frame() -> pd.DataFrame
+        Return one row per trajectory with datetimes, durations and one count column per label.
+    """
+
+    trajectory_id: np.ndarray
+    user_id: np.ndarray
+    count: np.ndarray
+    start_timestamp: np.ndarray
+    end_timestamp: np.ndarray
+    min_latitude: np.ndarray
+    min_longitude: np.ndarray
+    max_latitude: np.ndarray
+    max_longitude: np.ndarray
+    centroid_latitude: np.ndarray
+    centroid_longitude: np.ndarray
+    total_distance: np.ndarray
+    mean_speed: np.ndarray
+    max_speed: np.ndarray
+    label_counts: np.ndarray
+
+    def __post_init__(self):
+        for f in fields(self):
+            values = getattr(self, f.name)
+            if f.name in ('trajectory_id', 'user_id'):
+                setattr(self, f.name, np.asarray(values, dtype=object))
+            elif f.name in ('count', 'label_counts'):
+                setattr(self, f.name, np.asarray(values, dtype=np.int64))
+            else:
+                setattr(self, f.name, np.asarray(values, dtype=np.float64))
+        self.label_counts = self.label_counts.reshape(len(self.count), len(LABELS) + 1)
+
+    def __len__(self) -> int:
+        return len(self.count)
+
+    def __getitem__(self, index: Union[int, slice, np.ndarray]) -> 'TrajectorySummaries':
+        """
+        Return the summaries of the selected trajectories, an integer index keeps a single one
+        """
+        if isinstance(index, (int, np.integer)):
+            index = slice(index, index + 1 if index != -1 else None)
+        return TrajectorySummaries(**{name: values[index] for name, values in self.arrays.items()})
+
+    @property
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    @property
+    def duration(self) -> np.ndarray:
+        return self.end_timestamp - self.start_timestamp
+
+    @property
+    def bounds(self) -> np.ndarray:
+        return np.column_stack([self.min_longitude, self.min_latitude, self.max_longitude, self.max_latitude])
+
+    @property
+    def label(self) -> np.ndarray:
+        labels = np.array(LABELS + (None,), dtype=object)
+        main = np.argmax(self.label_counts[:, :len(LABELS)], axis=1)
+        return np.where(self.label_counts[:, :len(LABELS)].sum(axis=1) > 0, labels[main], None)
+
+    @classmethod
+    def from_columns(
+        cls,
+        columns: TrajectoryColumns,
+        offsets: Sequence[int],
+        trajectory_ids: Sequence[str],
+        user_ids: Sequence[str]
+    ) -> 'TrajectorySummaries':
+        """
+        Compute the summaries of the trajectories concatenated in `columns`, trajectory i holding the points
+        offsets[i]:offsets[i + 1], with one reduceat per statistic
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        counts = np.diff(offsets)
+        n = len(counts)
+        starts = offsets[:-1][counts > 0]
+
+        def reduce(ufunc: np.ufunc, values: np.ndarray) -> np.ndarray:
+            # reduceat needs non-empty segments, the empty trajectories get NaN
+            result = np.full(n, np.nan)
+            if len(starts):
+                result[counts > 0] = ufunc.reduceat(np.asarray(values, dtype=np.float64), starts)
+            return result
+
+        start_timestamp, end_timestamp = np.full(n, np.nan), np.full(n, np.nan)
+        start_timestamp[counts > 0] = columns.timestamp[starts]
+        end_timestamp[counts > 0] = columns.timestamp[offsets[1:][counts > 0] - 1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            total_distance = np.full(n, np.nan) if columns.distance is None else reduce(np.add, np.nan_to_num(columns.distance))
+            duration = end_timestamp - start_timestamp
+            mean_speed = np.where(duration > 0, total_distance / duration, np.nan)
+            max_speed = np.full(n, np.nan) if columns.speed is None else reduce(np.fmax, columns.speed)
+            centroid_latitude = reduce(np.add, columns.latitude) / counts
+            centroid_longitude = reduce(np.add, columns.longitude) / counts
+
+        trajectory_index = np.repeat(np.arange(n), counts)
+        label_index = np.where(columns.label == NO_LABEL, len(LABELS), columns.label).astype(np.int64)
+        label_counts = np.bincount(
+            trajectory_index * (len(LABELS) + 1) + label_index, minlength=n * (len(LABELS) + 1)
+        ).reshape(n, len(LABELS) + 1)
+
+        return cls(
+            trajectory_id=np.asarray(trajectory_ids, dtype=object),
+            user_id=np.asarray(user_ids, dtype=object),
+            count=counts,
+            start_timestamp=start_timestamp,
+            end_timestamp=end_timestamp,
+            min_latitude=reduce(np.minimum, columns.latitude),
+            min_longitude=reduce(np.minimum, columns.longitude),
+            max_latitude=reduce(np.maximum, columns.latitude),
+            max_longitude=reduce(np.maximum, columns.longitude),
+            centroid_latitude=centroid_latitude,
+            centroid_longitude=centroid_longitude,
+            total_distance=total_distance,
+            mean_speed=mean_speed,
+            max_speed=max_speed,
+            label_counts=label_counts,
+        )
+
+    @classmethod
+    def concatenate(cls, summaries: List['TrajectorySummaries']) -> 'TrajectorySummaries':
+        if not summaries:
+            return cls(**{f.name: [] for f in fields(cls)})
+        return cls(**{
+            f.name: np.concatenate([getattr(summary, f.name) for summary in summaries])
+            for f in fields(cls)
+        })
+
+    def to_dict(self) -> Dict:
+        """
+        Return the arrays as lists, NaN as None
+        """
+        return {
+            name: np.where(np.isnan(values), None, values).tolist() if values.dtype == np.float64 else values.tolist()
+            for name, values in self.arrays.items()
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'TrajectorySummaries':
+        return cls(**{
+            f.name: np.array(data[f.name], dtype=np.float64) if f.name not in ('trajectory_id', 'user_id', 'count', 'label_counts') else data[f.name]
+            for f in fields(cls)
+        })
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Return one row per trajectory, with the start and end datetimes, the duration and one count column per label
+        """
+        df = pd.DataFrame({
+            name: values for name, values in self.arrays.items()
+            if name not in ('label_counts', 'start_timestamp', 'end_timestamp')
+        })
+        df.insert(3, 'start_datetime', pd.to_datetime(self.start_timestamp, unit='s'))
+        df.insert(4, 'end_datetime', pd.to_datetime(self.end_timestamp, unit='s'))
+        df.insert(5, 'duration', df['end_datetime'] - df['start_datetime'])
+        df['label'] = self.label
+        for i, label in enumerate(LABELS + ('unlabelled',)):
+            df[f'{label}_count'] = self.label_counts[:, i]
+        return df
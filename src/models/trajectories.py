@@ -1,13 +1,43 @@
-from dataclasses import dataclass
-from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Collection, Dict, List, Tuple, Union
 import geopandas as gpd
 import pandas as pd
+import numpy as np
 import os
 from datetime import datetime
 
 
+from models.columns import TrajectoryColumns, time_bounds
+from models.density import LEVELS, DensityGrid, build_levels
+from models.encoded import EncodedTrajectories
+from models.indexes import EndpointIndex, SpatialIndex, TimeIndex
+from models.motion import MotionFeatures, motion_point_features
+from models.preprocessing import clean_columns, resample_columns, split_columns
+from models.staypoints import StayPoints
+from models.summary import FEATURES, TrajectorySummaries
 from models.trajectory import Trajectory
-from utils.parsers import PltRecordParser
+from utils.cleaning import MAX_ACCELERATION, MAX_DISTANCE_GAP, MAX_SPEED, MAX_TIME_GAP, MIN_POINTS
+from utils.kinematics import compute_kinematics
+from utils.labels import label_user_points, label_users, read_labels, split_codes
+from utils.metrics import metrics
+from utils.parsers import PltBatch, PltBulkParser, RecordParser, list_plt_files, list_tree_files
+from utils.similarity import lower_bounds, nearest
+from utils.simplify import local_xy
+from utils.staypoints import DISTANCE_THRESHOLD, TIME_THRESHOLD
+from utils.store import DatasetStore
+
+
+def _parse_files_chunk(
+    file_paths: List[str],
+    user_ids: List[str],
+    trajectory_ids: List[str]
+) -> PltBatch:
+    """
+    Parse a chunk of .plt files in a worker process of `Trajectories.from_user`
+    """
+    return PltBulkParser().parse_files(file_paths=file_paths, user_ids=user_ids, trajectory_ids=trajectory_ids)
+
 
 @dataclass
 class Trajectories:
@@ -19,22 +49,72 @@ class Trajectories:
         user_ids_list (List[str]): Returns a sorted list of unique user IDs from the trajectories.
         trajectory_ids_list (List[str]): Returns a sorted list of unique trajectory IDs from the trajectories.
         gdf (gpd.GeoDataFrame): Returns a GeoDataFrame containing all records from all trajectories.
+        columns (TrajectoryColumns): Returns the points of all the trajectories concatenated in one TrajectoryColumns.
         average_centroid (dict): Returns the average centroid (latitude and longitude) of the trajectories.
-        features (gpd.GeoDataFrame): Returns a GeoDataFrame with the features of all the trajectories.
+        summaries (TrajectorySummaries): Returns the cached summary statistics of the trajectories, computing the missing ones in one pass.
+        features (gpd.GeoDataFrame): Returns a GeoDataFrame with the features of all the trajectories, built from the summaries.
+        time_index (TimeIndex): Returns the interval index over the start and end of the trajectories.
+        spatial_index (SpatialIndex): Returns the spatial index over the bounding boxes and the points of the trajectories.
+        endpoint_index (EndpointIndex): Returns the index over the first and last points of the trajectories.
     Methods:
-        from_user(cls, data_path: str = os.getenv('DATA_PATH'), user_ids: List[str] = None, user_id: str = None) -> 'Trajectories':
-            Creates a `Trajectories` object from a list of user IDs or a single user ID.
-        load_trajectories(user_path: str, user_id: str) -> List['Trajectory']:
-            Loads trajectories from files in a user's folder.
-        extract_labels(user_path: str) -> gpd.GeoDataFrame:
-            Extracts labels from the `labels.txt` file and returns a GeoDataFrame.
+        from_user(cls, data_path: str, user_ids: List[str] = None, user_id: str = None, workers: int = 1, chunk_by: str = 'user', files_per_chunk: int = 64) -> 'Trajectories':
+            Creates a `Trajectories` object from a list of user IDs or a single user ID, optionally with a process pool.
+        from_batch(cls, batch: PltBatch) -> 'Trajectories':
+            Creates a `Trajectories` object from the files of a `PltBatch`.
+        from_store(cls, store_path: str, user_ids: List[str] = None, columns: List[str] = None) -> 'Trajectories':
+            Opens the trajectories of a `DatasetStore`, with memory-mapped columns.
+        to_store(store_path: str) -> None:
+            Writes the trajectories in a `DatasetStore`, one partition per user.
+        from_encoded(cls, encoded: EncodedTrajectories, method: str = None) -> 'Trajectories':
+            Decodes an `EncodedTrajectories`, computing the kinematics from the encoded arrays with a method.
+        encode() -> EncodedTrajectories:
+            Returns the compact fixed-point encoding of the trajectories.
+        load_trajectories(user_path: str, user_id: str, parser: RecordParser = None) -> List['Trajectory']:
+            Loads trajectories from files in a user's folder, with the bulk parser by default.
+        extract_labels(user_path: str) -> pd.DataFrame:
+            Extracts labels from the `labels.txt` file and returns a DataFrame.
         ugpdate_labels(user_path: str) -> None:
-            Updates the `Record.labels` values and the DataFrame with labels for each trajectory.
-        compute_trajectories_geodataframes() -> None:
-            Computes the GeoDataFrame with the trajectory records, time differences, distance, and speed.
+            Updates the label codes of the points of each trajectory with an interval join on the labelled segments.
+        update_users_labels(data_path: str) -> None:
+            Updates the label codes of the trajectories of all the users in a single interval join.
+        compute_lod(min_tolerance: float = 0.5) -> None:
+            Computes the Douglas-Peucker significance of the points of all the trajectories (levels of detail of the map).
+        filter_trajectories(datetime_range: Tuple[datetime, datetime]) -> 'Trajectories':
+            Returns the trajectories cut to a datetime range, using the time index.
+        invalidate_indexes() -> None:
+            Drops the indexes after the trajectories changed.
+        query_bbox(min_lon: float, min_lat: float, max_lon: float, max_lat: float, clip: bool = False, trajectory_ids: Collection[str] = None) -> 'Trajectories':
+            Returns the trajectories (optionally only some of them) with points in a bbox, optionally reduced to these points.
+        query_radius(latitude: float, longitude: float, radius: float, clip: bool = False) -> 'Trajectories':
+            Returns the trajectories with points within a radius in meters, optionally reduced to these points.
+        density(levels: Tuple[float, ...] = LEVELS) -> Dict[float, DensityGrid]:
+            Returns the density grids of all the points at each level, in one vectorized pass.
+        similar(query: Union[str, Trajectory], k: int = 10, measure: str = 'frechet', max_distance: float = None, tolerance: float = 0) -> pd.DataFrame:
+            Returns the k trajectories nearest to a trajectory by Fréchet or DTW distance, pruned by lower bounds.
+        compute_trajectories_speed(method: str = 'vincenty') -> None:
+            Computes the time differences, distance, speed, acceleration and bearing of all the trajectories in one pass.
+        stay_points(distance_threshold: float = 200, time_threshold: float = 1200) -> StayPoints:
+            Detects the stay points of all the trajectories in one vectorized pass.
+        significant_places(eps: float = 100, min_samples: int = 2, time_eps: float = None, distance_threshold: float = 200, time_threshold: float = 1200) -> pd.DataFrame:
+            Clusters the stay points of all the users into significant places.
+        motion_features(method: str = 'vincenty', labelled_only: bool = False, **thresholds) -> MotionFeatures:
+            Computes the transportation mode features of the label segments of all the trajectories in one pass.
+        point_motion_features(method: str = 'vincenty') -> Dict[str, np.ndarray]:
+            Computes the jerk, heading change and velocity change of all the points in one pass.
+        clean(max_speed: float = 100, max_acceleration: float = 10, method: str = 'vincenty') -> 'Trajectories':
+            Returns the trajectories without duplicate timestamps and speed or acceleration outliers.
+        split_gaps(max_time_gap: float = 1200, max_distance_gap: float = 2000, min_points: int = 2, method: str = 'vincenty') -> 'Trajectories':
+            Returns the segments of the trajectories between their recording gaps.
+        resample(step: float, method: str = 'vincenty') -> 'Trajectories':
+            Returns the trajectories resampled every step seconds.
+        preprocess(max_speed: float = 100, max_acceleration: float = 10, max_time_gap: float = 1200, max_distance_gap: float = 2000, min_points: int = 2, step: float = None, method: str = 'vincenty') -> 'Trajectories':
+            Cleans, splits and optionally resamples the trajectories, each stage in one pass over all the points.
     """
     
     trajectories: List['Trajectory']
+    _time_index: TimeIndex = field(default=None, init=False, repr=False, compare=False)
+    _spatial_index: SpatialIndex = field(default=None, init=False, repr=False, compare=False)
+    _endpoint_index: EndpointIndex = field(default=None, init=False, repr=False, compare=False)
 
     @property
     def user_ids_list(self) -> List[str]:
@@ -59,25 +139,55 @@ class Trajectories:
         """
         Return a GeoDataFrame with all the records from all the trajectories
         """
-        # columns = ['user_id', 'trajectory_id', 'label', 'datetime', 'latitude', 'longitude', 'altitude', 'timestamp']
-        # return gpd.concat([trajectory.gdf for trajectory in self.trajectories])[columns]
-        return gpd.GeoDataFrame(pd.concat([trajectory.gdf for trajectory in self.trajectories]))
+        counts = [trajectory.count for trajectory in self.trajectories]
+        return self.columns.to_frame(
+            user_id=np.repeat([trajectory.user_id for trajectory in self.trajectories], counts),
+            trajectory_id=np.repeat([trajectory.trajectory_id for trajectory in self.trajectories], counts),
+        )
+
+    @property
+    def columns(self) -> TrajectoryColumns:
+        """
+        Return the points of all the trajectories, concatenated in one TrajectoryColumns
+        """
+        return TrajectoryColumns.concatenate([trajectory.columns for trajectory in self.trajectories])
 
     @property
     def average_centroid(self) -> dict:
         """
         Return the average centroid of the trajectories
         """
-        latitude = sum([trajectory.centroid['latitude'] for trajectory in self.trajectories]) / self.trajectories_count
-        longitude = sum([trajectory.centroid['longitude'] for trajectory in self.trajectories]) / self.trajectories_count
-        return {'latitude': latitude, 'longitude': longitude}
-    
+        summaries = self.summaries
+        return {'latitude': float(summaries.centroid_latitude.mean()), 'longitude': float(summaries.centroid_longitude.mean())}
+
+    @property
+    def summaries(self) -> TrajectorySummaries:
+        """
+        Return the summary statistics of the trajectories.
+        The trajectories without a valid cached summary are summarized together, one vectorized pass per set of
+        computed kinematics, and their summaries are cached on them.
+        """
+        stale = {}
+        for trajectory in self.trajectories:
+            if not trajectory.has_summary:
+                stale.setdefault((trajectory.columns.distance is None, trajectory.columns.speed is None), []).append(trajectory)
+        for group in stale.values():
+            summaries = TrajectorySummaries.from_columns(
+                TrajectoryColumns.concatenate([trajectory.columns for trajectory in group]),
+                np.cumsum([0] + [trajectory.count for trajectory in group]),
+                [trajectory.trajectory_id for trajectory in group],
+                [trajectory.user_id for trajectory in group],
+            )
+            for i, trajectory in enumerate(group):
+                trajectory.cache_summary(summaries[i])
+        return TrajectorySummaries.concatenate([trajectory.summary for trajectory in self.trajectories])
+
     @property
     def features(self) -> gpd.GeoDataFrame:
         """
         Return a GeoDataFrame with the features of all the trajectories
         """
-        gdf = gpd.GeoDataFrame([trajectory.features for trajectory in self.trajectories])
+        gdf = gpd.GeoDataFrame(self.summaries.to_frame()[list(FEATURES)])
         gdf.sort_values(by='start_datetime', inplace=True)
         return gdf
 
@@ -86,44 +196,137 @@ class Trajectories:
         cls, 
         data_path: str,
         user_ids: List[str] = None,
-        user_id: str = None
+        user_id: str = None,
+        workers: int = 1,
+        chunk_by: str = 'user',
+        files_per_chunk: int = 64
     ) -> 'Trajectories':
         """
-        Create a Trajectories object from a user_ids list
+        Create a Trajectories object from a user_ids list.
+        With workers > 1 the .plt files are parsed by a process pool, in chunks of one user (chunk_by='user')
+        or of files_per_chunk files (chunk_by='file'); the workers send back PltBatch columns and the
+        trajectory IDs are assigned before dispatching, identical to the serial path.
         """
         if (user_id and user_ids
             or not user_ids and not user_id):
             raise ValueError('Provide either user_id:str or user_ids:List[str]')
         user_ids = [user_id] if user_id else user_ids
-        trajectories = []
-        for user_id in user_ids:
-            user_path = os.path.join(data_path, user_id)
-            trajectories += cls.load_trajectories(user_path, user_id)
-        return cls(trajectories)
+        if workers <= 1:
+            trajectories = []
+            for user_id in user_ids:
+                user_path = os.path.join(data_path, user_id)
+                trajectories += cls.load_trajectories(user_path, user_id)
+            return cls(trajectories)
+
+        file_paths, file_user_ids, trajectory_ids = list_tree_files(data_path, user_ids)
+        if chunk_by == 'user':
+            bounds = [0] + [i for i in range(1, len(file_paths)) if file_user_ids[i] != file_user_ids[i - 1]] + [len(file_paths)]
+        elif chunk_by == 'file':
+            bounds = list(range(0, len(file_paths), files_per_chunk)) + [len(file_paths)]
+        else:
+            raise ValueError(f"chunk_by must be 'user' or 'file', not {chunk_by!r}")
+        chunks = [
+            (file_paths[start:end], file_user_ids[start:end], trajectory_ids[start:end])
+            for start, end in zip(bounds[:-1], bounds[1:]) if end > start
+        ]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            batches = list(executor.map(_parse_files_chunk, *zip(*chunks))) if chunks else []
+        return cls.from_batch(PltBatch.concatenate(batches))
+
+    @classmethod
+    def from_batch(
+        cls,
+        batch: PltBatch
+    ) -> 'Trajectories':
+        """
+        Create a Trajectories object from the files of a PltBatch, the trajectory columns are views on the batch arrays
+        """
+        return cls([
+            Trajectory(
+                trajectory_id=batch.trajectory_ids[i],
+                user_id=batch.user_ids[i],
+                columns=batch.trajectory_columns(i),
+            )
+            for i in range(len(batch))
+        ])
+
+    @classmethod
+    def from_store(
+        cls,
+        store_path: str,
+        user_ids: List[str] = None,
+        columns: List[str] = None
+    ) -> 'Trajectories':
+        """
+        Open the trajectories of a DatasetStore (all its users by default), the columns are memory-mapped
+        and only read from disk when used
+        """
+        store = DatasetStore(store_path)
+        user_ids = store.user_ids if user_ids is None else user_ids
+        return cls([trajectory for user_id in user_ids for trajectory in store.read_user(user_id, columns=columns)])
+
+    def to_store(
+        self,
+        store_path: str
+    ) -> None:
+        """
+        Write the trajectories in a DatasetStore, one partition per user
+        """
+        DatasetStore(store_path).write(self.trajectories)
+
+    @classmethod
+    def from_encoded(
+        cls,
+        encoded: EncodedTrajectories,
+        method: str = None
+    ) -> 'Trajectories':
+        """
+        Decode the trajectories of an EncodedTrajectories. With a method ('haversine', 'vincenty' or 'karney')
+        the kinematics are computed in one pass over the encoded arrays, they are left empty otherwise.
+        """
+        kinematics = encoded.compute_kinematics(method=method) if method else None
+        offsets = encoded.offsets
+        return cls([
+            Trajectory.from_encoded(
+                encoded, i,
+                kinematics=None if kinematics is None else {
+                    column: values[offsets[i]:offsets[i + 1]] for column, values in kinematics.items()
+                },
+            )
+            for i in range(len(encoded))
+        ])
+
+    def encode(self) -> EncodedTrajectories:
+        """
+        Return the compact encoding of the trajectories, their kinematics are not kept
+        """
+        return EncodedTrajectories.from_columns(
+            self.columns,
+            np.cumsum([0] + [trajectory.count for trajectory in self.trajectories]),
+            [trajectory.trajectory_id for trajectory in self.trajectories],
+            [trajectory.user_id for trajectory in self.trajectories],
+        )
 
     @staticmethod
     def load_trajectories(
         user_path: str, 
-        user_id: str
+        user_id: str,
+        parser: RecordParser = None
     ) -> List['Trajectory']:
         """
-        Load trajectories from files in a user's folder
+        Load trajectories from files in a user's folder.
+        All the files are parsed at once by a PltBulkParser, unless a parser is given to parse them one by one.
         """
-        records_files_paths = [
-            os.path.join(user_path, 'Trajectory', file)
-            for file in os.listdir(os.path.join(user_path, 'Trajectory'))
-            if file.endswith('.plt')
-        ]
-        records_files_paths.sort()
+        if parser is None:
+            return Trajectories.from_batch(PltBulkParser().parse_user(user_path, user_id)).trajectories
         trajectories = []
-        for i, file in enumerate(records_files_paths):
+        for i, file in enumerate(list_plt_files(user_path)):
             trajectory = Trajectory.from_file(
                             file_path=file, 
                             user_id=user_id, 
                             trajectory_id=f'{user_id}_{i}',
-                            parser=PltRecordParser()
+                            parser=parser
                         )
-            print(f'Loaded trajectory {trajectory.trajectory_id} with {trajectory.count} records')
             trajectories.append(trajectory)
         return trajectories
     
@@ -132,75 +335,426 @@ class Trajectories:
         user_path: str
     ) -> pd.DataFrame:
         """
-        Extract the labels from the labels.txt file, return a GeoDataFrame
-        """
-        labels_file = os.path.join(user_path, 'labels.txt')
-        if not os.path.exists(labels_file):
-            return gpd.GeoDataFrame(columns=['start_datetime', 'end_datetime', 'label'])
-
-        df_labels = pd.DataFrame(columns=['start_datetime', 'end_datetime', 'label'])
-        with open(labels_file) as f:
-            for line in f:
-                if 'Time' in line:
-                    continue
-                start_datetime, end_datetime, mode = line.strip().split('\t')
-                df_labels = pd.concat([df_labels, gpd.GeoDataFrame({
-                    'start_datetime': [start_datetime],
-                    'end_datetime': [end_datetime],
-                    'label': [mode]
-                })])
-        
-        df_labels['start_datetime'] = pd.to_datetime(df_labels['start_datetime'])
-        df_labels['end_datetime'] = pd.to_datetime(df_labels['end_datetime'])
-        return df_labels
+        Extract the labels from the labels.txt file, return a DataFrame
+        """
+        return read_labels(user_path)
     
     def ugpdate_labels(
         self,
         user_path: str
     ) -> None:
         """
-        Ugpdate the Record.labels values & the gdf with labels for each trajectory
+        Ugpdate the label codes of the points of each trajectory: a point gets the mode of the labelled segment
+        whose [start_datetime, end_datetime] contains it, no label otherwise
         """
         df_labels = self.extract_labels(user_path)
-        df_labels.sort_values('start_datetime', inplace=True)
         if df_labels.empty:
             return
-        df_records = pd.concat([trajectory.gdf for trajectory in self.trajectories])
-        df_records.drop(columns=['label'], inplace=True)
-        df_records = pd.merge_asof(
-            df_records.sort_values('datetime'),
-            df_labels,
-            left_on='datetime',
-            right_on='start_datetime',
-            direction='backward',
-            suffixes=('', '_label'),
-            # add only the label column from right GeoDataFrame
-        ).drop(columns=['start_datetime', 'end_datetime'])
-        # ugpdate the Record values & the gdf for each trajectory
-        for trajectory in self.trajectories:
-            trajectory_gdf = df_records[df_records['trajectory_id'] == trajectory.trajectory_id]
-            trajectory.gdf = trajectory_gdf
-            for record, row in zip(trajectory.records, trajectory_gdf.itertuples()):
-                record.label = row.label
+        counts = [trajectory.count for trajectory in self.trajectories]
+        timestamp = np.concatenate([trajectory.columns.timestamp for trajectory in self.trajectories])
+        codes = label_user_points(timestamp, df_labels)
+        for trajectory, trajectory_codes in zip(self.trajectories, split_codes(codes, counts)):
+            trajectory.columns.label = trajectory_codes
+
+    def update_users_labels(
+        self,
+        data_path: str
+    ) -> None:
+        """
+        Update the label codes of the trajectories of all the users from their labels.txt files,
+        with a single interval join over all the points
+        """
+        if not self.trajectories:
+            return
+        user_index = {user_id: i for i, user_id in enumerate(self.user_ids_list)}
+        counts = [trajectory.count for trajectory in self.trajectories]
+        timestamp = np.concatenate([trajectory.columns.timestamp for trajectory in self.trajectories])
+        point_users = np.repeat([user_index[trajectory.user_id] for trajectory in self.trajectories], counts)
+        labels = {i: read_labels(os.path.join(data_path, user_id)) for user_id, i in user_index.items()}
+        codes = label_users(timestamp, point_users, labels)
+        for trajectory, trajectory_codes in zip(self.trajectories, split_codes(codes, counts)):
+            trajectory.columns.label = trajectory_codes
     
     def compute_trajectories_speed(
         self,
+        method: str = 'vincenty'
     ) -> None:
         """
-        Compute the GeoDataFrame with the trajectory records, time differences, distance, and speed
+        Compute the time differences, distance, speed, acceleration and bearing of all the trajectories in one pass
         """
-        for trajectory in self.trajectories:
-            trajectory.compute_speed()
+        if not self.trajectories:
+            return
+        columns = self.columns
+        bounds = np.cumsum([0] + [trajectory.count for trajectory in self.trajectories])
+        kinematics = compute_kinematics(
+            columns.latitude, columns.longitude, columns.timestamp,
+            offsets=bounds[:-1],
+            method=method
+        )
+        for trajectory, start, end in zip(self.trajectories, bounds[:-1], bounds[1:]):
+            trajectory.update_kinematics({column: values[start:end] for column, values in kinematics.items()})
             
+    def stay_points(
+        self,
+        distance_threshold: float = DISTANCE_THRESHOLD,
+        time_threshold: float = TIME_THRESHOLD
+    ) -> StayPoints:
+        """
+        Detect the stay points of all the trajectories together, within distance_threshold meters for at least
+        time_threshold seconds
+        """
+        counts = [trajectory.count for trajectory in self.trajectories]
+        columns = TrajectoryColumns(**{
+            name: np.concatenate([getattr(trajectory.columns, name) for trajectory in self.trajectories] or [[]])
+            for name in ('latitude', 'longitude', 'altitude', 'timestamp')
+        })
+        return StayPoints.from_columns(
+            columns,
+            np.cumsum([0] + counts),
+            [trajectory.trajectory_id for trajectory in self.trajectories],
+            [trajectory.user_id for trajectory in self.trajectories],
+            distance_threshold=distance_threshold,
+            time_threshold=time_threshold,
+        )
+
+    def significant_places(
+        self,
+        eps: float = 100.0,
+        min_samples: int = 2,
+        time_eps: float = None,
+        distance_threshold: float = DISTANCE_THRESHOLD,
+        time_threshold: float = TIME_THRESHOLD
+    ) -> pd.DataFrame:
+        """
+        Return the places where the users stay, from a DBSCAN clustering of the stay points of all the trajectories
+        (see `StayPoints.places`)
+        """
+        stay_points = self.stay_points(distance_threshold=distance_threshold, time_threshold=time_threshold)
+        return stay_points.places(eps=eps, min_samples=min_samples, time_eps=time_eps)
+
+    def motion_features(
+        self,
+        method: str = 'vincenty',
+        labelled_only: bool = False,
+        **thresholds
+    ) -> MotionFeatures:
+        """
+        Compute the motion features of the segments of consecutive points with the same label of all the
+        trajectories in one vectorized pass (see `MotionFeatures.from_columns`)
+        """
+        return MotionFeatures.from_columns(
+            self.columns,
+            np.cumsum([0] + [trajectory.count for trajectory in self.trajectories]),
+            [trajectory.trajectory_id for trajectory in self.trajectories],
+            [trajectory.user_id for trajectory in self.trajectories],
+            method=method,
+            labelled_only=labelled_only,
+            **thresholds
+        )
+
+    def point_motion_features(self, method: str = 'vincenty') -> Dict[str, np.ndarray]:
+        """
+        Compute the jerk, heading change, heading change rate and velocity change of the points of all the
+        trajectories, concatenated in the order of `columns`
+        """
+        return motion_point_features(self.columns, self._bounds(), method=method)
+
+    def _bounds(self) -> np.ndarray:
+        return np.cumsum([0] + [trajectory.count for trajectory in self.trajectories])
+
+    def _rebuild(
+        self,
+        columns: TrajectoryColumns,
+        offsets: np.ndarray,
+        parent: np.ndarray = None
+    ) -> 'Trajectories':
+        """
+        Return the trajectories of the processed columns, the i-th coming from the trajectory parent[i]
+        (the i-th one by default) and dropped when empty. The k-th segment of a trajectory split in several
+        gets the trajectory ID `{trajectory_id}_{k}`.
+        """
+        parent = np.arange(len(offsets) - 1) if parent is None else np.asarray(parent)
+        first = np.searchsorted(parent, parent, side='left')
+        segments = np.bincount(parent, minlength=len(self.trajectories))
+        trajectories = []
+        for i, p in enumerate(parent):
+            if offsets[i + 1] == offsets[i]:
+                continue
+            source = self.trajectories[p]
+            trajectories.append(Trajectory(
+                trajectory_id=f'{source.trajectory_id}_{i - first[i]}' if segments[p] > 1 else source.trajectory_id,
+                user_id=source.user_id,
+                columns=columns[offsets[i]:offsets[i + 1]],
+                color=source.color,
+            ))
+        return Trajectories(trajectories)
+
+    def clean(
+        self,
+        max_speed: float = MAX_SPEED,
+        max_acceleration: float = MAX_ACCELERATION,
+        method: str = 'vincenty'
+    ) -> 'Trajectories':
+        """
+        Return the trajectories without the points with the timestamp of the previous point and without the speed
+        or acceleration outliers (see `utils.cleaning.outlier_mask`), in one vectorized pass over all the points.
+        The trajectories left without points are dropped.
+        """
+        if not self.trajectories:
+            return Trajectories([])
+        columns, offsets = clean_columns(self.columns, self._bounds(), max_speed=max_speed, max_acceleration=max_acceleration, method=method)
+        return self._rebuild(columns, offsets)
+
+    def split_gaps(
+        self,
+        max_time_gap: float = MAX_TIME_GAP,
+        max_distance_gap: float = MAX_DISTANCE_GAP,
+        min_points: int = MIN_POINTS,
+        method: str = 'vincenty'
+    ) -> 'Trajectories':
+        """
+        Return the segments of the trajectories between the points more than max_time_gap seconds or
+        max_distance_gap meters apart, with at least min_points points
+        """
+        if not self.trajectories:
+            return Trajectories([])
+        columns, offsets, parent = split_columns(
+            self.columns, self._bounds(), max_time_gap=max_time_gap, max_distance_gap=max_distance_gap,
+            min_points=min_points, method=method
+        )
+        return self._rebuild(columns, offsets, parent)
+
+    def resample(
+        self,
+        step: float,
+        method: str = 'vincenty'
+    ) -> 'Trajectories':
+        """
+        Return the trajectories resampled every step seconds from their first point, see
+        `models.preprocessing.resample_columns`
+        """
+        if not self.trajectories:
+            return Trajectories([])
+        columns, offsets = resample_columns(self.columns, self._bounds(), step, method=method)
+        return self._rebuild(columns, offsets)
+
+    def preprocess(
+        self,
+        max_speed: float = MAX_SPEED,
+        max_acceleration: float = MAX_ACCELERATION,
+        max_time_gap: float = MAX_TIME_GAP,
+        max_distance_gap: float = MAX_DISTANCE_GAP,
+        min_points: int = MIN_POINTS,
+        step: float = None,
+        method: str = 'vincenty'
+    ) -> 'Trajectories':
+        """
+        Clean the trajectories, split them at their gaps and, with a step in seconds, resample the segments
+        """
+        trajectories = self.clean(max_speed=max_speed, max_acceleration=max_acceleration, method=method)
+        trajectories = trajectories.split_gaps(
+            max_time_gap=max_time_gap, max_distance_gap=max_distance_gap, min_points=min_points, method=method
+        )
+        return trajectories.resample(step, method=method) if step else trajectories
+
+    @metrics.timed('lod.compute')
+    def compute_lod(
+        self,
+        min_tolerance: float = 0.5
+    ) -> None:
+        """
+        Compute the Douglas-Peucker significance of the points of all the trajectories
+        """
+        for trajectory in self.trajectories:
+            trajectory.compute_lod(min_tolerance=min_tolerance)
+
+    @metrics.timed('filter.time_range')
     def filter_trajectories(self, datetime_range: Tuple[datetime, datetime]) -> 'Trajectories':
         """
         Filter the trajectories by start_datetime and end_datetime without recomputing speed.
+        The time index skips the trajectories outside of the range, the others are cut by binary search.
+        """
+        start, end = time_bounds(datetime_range)
+        filtered_trajectories = []
+        for i in self.time_index.query(start, end):
+            trajectory = self.trajectories[i]
+            time_slice = trajectory.time_slice(start, end)
+            if time_slice.stop > time_slice.start:
+                filtered_trajectories.append(Trajectory(
+                    user_id=trajectory.user_id,
+                    trajectory_id=trajectory.trajectory_id,
+                    columns=trajectory.columns[time_slice],
+                    color=trajectory.color,
+                ))
+        return Trajectories(filtered_trajectories)
+
+    @property
+    def time_index(self) -> TimeIndex:
         """
-        filtered_trajectories = Trajectories(
-            [
-                trajectory.filter_by_datetimerange(datetime_range)
-                for trajectory in self.trajectories
-                if trajectory.filter_by_datetimerange(datetime_range).gdf.shape[0] > 0
-            ]
+        Return the interval index over the start and end of the trajectories, built on first use.
+        It is rebuilt when trajectories are added or removed, call `invalidate_indexes` after other changes.
+        """
+        if self._time_index is None or self._time_index.size != len(self.trajectories):
+            self._time_index = TimeIndex(self.trajectories, summaries=self.summaries)
+        return self._time_index
+
+    @property
+    def spatial_index(self) -> SpatialIndex:
+        """
+        Return the spatial index over the bounding boxes and the points of the trajectories, built on first use.
+        It is rebuilt when trajectories are added or removed, call `invalidate_indexes` after other changes.
+        """
+        if self._spatial_index is None or self._spatial_index.size != len(self.trajectories):
+            self._spatial_index = SpatialIndex(self.trajectories, summaries=self.summaries)
+        return self._spatial_index
+
+    @property
+    def endpoint_index(self) -> EndpointIndex:
+        """
+        Return the index over the first and last points of the trajectories, built on first use.
+        It is rebuilt when trajectories are added or removed, call `invalidate_indexes` after other changes.
+        """
+        if self._endpoint_index is None or self._endpoint_index.size != len(self.trajectories):
+            self._endpoint_index = EndpointIndex(self.trajectories, summaries=self.summaries)
+        return self._endpoint_index
+
+    def invalidate_indexes(self) -> None:
+        """
+        Drop the indexes, they are rebuilt on next use
+        """
+        self._time_index = None
+        self._spatial_index = None
+        self._endpoint_index = None
+
+    @metrics.timed('filter.bbox')
+    def query_bbox(
+        self,
+        min_lon: float,
+        min_lat: float,
+        max_lon: float,
+        max_lat: float,
+        clip: bool = False,
+        trajectory_ids: Collection[str] = None
+    ) -> 'Trajectories':
+        """
+        Return the trajectories with points in the bbox, reduced to these points when clip is True.
+        With trajectory_ids, only these trajectories are returned: a selection queries the spatial index of all
+        the trajectories, built once, instead of building one for itself.
+        """
+        trajectory_positions, point_indices = self.spatial_index.query_points(min_lon, min_lat, max_lon, max_lat)
+        if trajectory_ids is not None:
+            selected = set(trajectory_ids)
+            keep = np.array([trajectory.trajectory_id in selected for trajectory in self.trajectories], dtype=bool)[trajectory_positions]
+            trajectory_positions, point_indices = trajectory_positions[keep], point_indices[keep]
+        return self._select_points(trajectory_positions, point_indices, clip)
+
+    @metrics.timed('filter.radius')
+    def query_radius(
+        self,
+        latitude: float,
+        longitude: float,
+        radius: float,
+        clip: bool = False
+    ) -> 'Trajectories':
+        """
+        Return the trajectories with points within radius meters of (latitude, longitude),
+        reduced to these points when clip is True
+        """
+        trajectory_positions, point_indices = self.spatial_index.query_radius(latitude, longitude, radius)
+        return self._select_points(trajectory_positions, point_indices, clip)
+
+    @metrics.timed('density.build')
+    def density(self, levels: Tuple[float, ...] = LEVELS) -> Dict[float, DensityGrid]:
+        """
+        Return the density grids of the points of all the trajectories at each level (cell size in degrees),
+        see `models.density`
+        """
+        if not self.trajectories:
+            return {cell_size: DensityGrid.merge([], cell_size) for cell_size in levels}
+        return build_levels(self.columns, self._bounds(), levels)
+
+    @metrics.timed('similarity.search')
+    def similar(
+        self,
+        query: Union[str, Trajectory],
+        k: int = 10,
+        measure: str = 'frechet',
+        max_distance: float = None,
+        tolerance: float = 0
+    ) -> pd.DataFrame:
+        """
+        Return the k trajectories nearest to the query (a trajectory or the ID of one of the trajectories, which
+        is left out) by discrete Fréchet or DTW distance in meters, sorted by distance: trajectory_id, user_id
+        and distance. With a max_distance, only the trajectories within it are returned and the candidates are
+        the trajectories starting within it, found with the endpoint index.
+        The trajectories are compared as simplified with the tolerance in meters (see `Trajectory.level_of_detail`),
+        the exact distances are only computed for the candidates whose lower bound is below the k-th distance
+        found (see `utils.similarity`).
+        """
+        if isinstance(query, str):
+            matches = [trajectory for trajectory in self.trajectories if trajectory.trajectory_id == query]
+            if not matches:
+                raise ValueError(f'Unknown trajectory {query!r}')
+            query = matches[0]
+        points = query.level_of_detail(tolerance)
+        if len(points) == 0:
+            return pd.DataFrame({'trajectory_id': [], 'user_id': [], 'distance': []})
+        reference = float(points.latitude.mean())
+        query_xy = local_xy(points.latitude, points.longitude, reference)
+        index = self.endpoint_index
+        if max_distance is None:
+            positions = index.indexed
+        else:
+            # the degrees of max_distance in the projection of local_xy
+            delta_lat = max_distance / 110540.0
+            delta_lon = max_distance / (111320.0 * max(np.cos(np.radians(reference)), 1e-6))
+            latitude, longitude = points.latitude[0], points.longitude[0]
+            positions = index.query(longitude - delta_lon, latitude - delta_lat, longitude + delta_lon, latitude + delta_lat)
+        positions = np.array([
+            i for i in positions
+            if (self.trajectories[i].trajectory_id, self.trajectories[i].user_id) != (query.trajectory_id, query.user_id)
+        ], dtype=np.int64)
+        bounds = index.bounds[positions]
+        boxes = np.column_stack([
+            local_xy(bounds[:, 1], bounds[:, 0], reference),
+            local_xy(bounds[:, 3], bounds[:, 2], reference),
+        ]).reshape(-1, 4)
+        starts = local_xy(index.start_latitude[positions], index.start_longitude[positions], reference).reshape(-1, 2)
+        ends = local_xy(index.end_latitude[positions], index.end_longitude[positions], reference).reshape(-1, 2)
+
+        def curves(candidates: np.ndarray) -> List[np.ndarray]:
+            simplified = [self.trajectories[i].level_of_detail(tolerance) for i in positions[candidates]]
+            return [local_xy(columns.latitude, columns.longitude, reference) for columns in simplified]
+
+        found, distances = nearest(
+            query_xy, lower_bounds(query_xy, starts, ends, boxes, index.count[positions], measure=measure),
+            curves, k=k, measure=measure, max_distance=max_distance
         )
-        return filtered_trajectories
\ No newline at end of file
+        return pd.DataFrame({
+            'trajectory_id': [self.trajectories[i].trajectory_id for i in positions[found]],
+            'user_id': [self.trajectories[i].user_id for i in positions[found]],
+            'distance': distances,
+        })
+
+    def _select_points(
+        self,
+        trajectory_positions: np.ndarray,
+        point_indices: np.ndarray,
+        clip: bool
+    ) -> 'Trajectories':
+        """
+        Return the trajectories of the positions, with only the given points when clip is True
+        """
+        positions, starts = np.unique(trajectory_positions, return_index=True)
+        if not clip:
+            return Trajectories([self.trajectories[i] for i in positions])
+        bounds = np.append(starts, len(point_indices))
+        return Trajectories([
+            Trajectory(
+                user_id=self.trajectories[i].user_id,
+                trajectory_id=self.trajectories[i].trajectory_id,
+                columns=self.trajectories[i].columns[point_indices[start:end]],
+                color=self.trajectories[i].color,
+            )
+            for i, start, end in zip(positions, bounds[:-1], bounds[1:])
+        ])
\ No newline at end of file
@@ -1,11 +1,21 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Dict, List, Tuple
 import geopandas as gpd
-from geopy.distance import geodesic
+import numpy as np
+import pandas as pd
 
+from models.columns import TrajectoryColumns, time_bounds
+from models.encoded import EncodedTrajectories
+from models.preprocessing import clean_columns, resample_columns, split_columns
 from models.record import Record
+from models.staypoints import StayPoints
+from models.summary import TrajectorySummaries
+from utils.cleaning import MAX_ACCELERATION, MAX_DISTANCE_GAP, MAX_SPEED, MAX_TIME_GAP, MIN_POINTS
+from utils.kinematics import compute_kinematics
 from utils.parsers import RecordParser
+from utils.simplify import douglas_peucker_significance
+from utils.staypoints import DISTANCE_THRESHOLD, TIME_THRESHOLD
 
 
 @dataclass
@@ -13,18 +23,24 @@ class Trajectory:
     """
     A class to represent a trajectory of records with various properties and methods to compute
     geospatial and temporal features.
+    The points are stored in a columnar `TrajectoryColumns`, sorted by timestamp; `records` and `gdf`
+    are built from it on demand.
     Attributes
     ----------
     trajectory_id : str
         Unique identifier for the trajectory.
     user_id : str
         Identifier for the user associated with the trajectory.
-    records : List[Record]
-        List of records that make up the trajectory.
-    gdf : gpd.GeoDataFrame, optional
-        GeoDataFrame containing the trajectory records (default is None).
+    columns : TrajectoryColumns
+        Arrays of the trajectory points (coordinates, timestamps, label codes and kinematics).
+    color : str, optional
+        Color of the trajectory in the plots (default is None).
     Properties
     ----------
+    records : List[Record]
+        List of records that make up the trajectory, built on each access.
+    gdf : gpd.GeoDataFrame
+        GeoDataFrame containing the trajectory records, built on each access.
     count : int
         Number of records in the trajectory.
     start_datetime : datetime
@@ -35,58 +51,130 @@ class Trajectory:
         The duration of the trajectory (end_datetime - start_datetime).
     centroid : Dict
         The centroid of the trajectory as the average latitude and longitude.
+    summary : TrajectorySummaries
+        The summary statistics of the trajectory (a single entry), computed once and cached until the
+        coordinates, timestamps, labels or kinematics are replaced.
     features : Dict
-        A dictionary with the trajectory features.
+        A dictionary with the trajectory features, read from the summary.
     Methods
     -------
     from_file(cls, file_path: str, user_id: str, trajectory_id: str, parser: RecordParser) -> 'Trajectory'
         Create a Trajectory object from file using a specific parser.
-    compute_geodataframe() -> gpd.GeoDataFrame
-        Compute the GeoDataFrame with the trajectory records, time differences, distance, and speed.
-    _calculate_time_diffs(gdf: gpd.GeoDataFrame) -> List[float]
-        Calculate the time difference in seconds between consecutive records.
-    _calculate_distances(gdf: gpd.GeoDataFrame) -> List[float]
-        Calculate the distance in meters between consecutive records using geopy.
-    _calculate_speeds(gdf: gpd.GeoDataFrame) -> List[float]
-        Calculate the speed in meters per second between consecutive records.
+    from_records(cls, trajectory_id: str, user_id: str, records: List[Record], color: str = None) -> 'Trajectory'
+        Create a Trajectory object from a list of records.
+    from_encoded(cls, encoded: EncodedTrajectories, i: int = 0, kinematics: Dict[str, np.ndarray] = None) -> 'Trajectory'
+        Decode the i-th trajectory of an EncodedTrajectories.
+    encode() -> EncodedTrajectories
+        Return the compact fixed-point encoding of the trajectory.
+    compute_speed(method: str = 'vincenty') -> None
+        Compute the time differences, distance, speed, acceleration and bearing columns,
+        with the vectorized engine of `utils.kinematics` ('haversine', 'vincenty' or 'karney' distances).
+    compute_lod(min_tolerance: float = 0.5) -> None
+        Compute the Douglas-Peucker significance of the points, used by `level_of_detail`.
+    level_of_detail(tolerance: float) -> TrajectoryColumns
+        Return the points of the simplified trajectory for a tolerance in meters.
+    quantile(column: str, q: float) -> float
+        Return the cached q-quantile of a column.
+    cache_summary(summary: TrajectorySummaries) -> None
+        Use precomputed summary statistics (e.g. read from a `DatasetStore`) for the current columns.
+    stay_points(distance_threshold: float = 200, time_threshold: float = 1200) -> StayPoints
+        Detect the places where the user stayed within distance_threshold meters for time_threshold seconds.
+    clean(max_speed: float = 100, max_acceleration: float = 10, method: str = 'vincenty') -> 'Trajectory'
+        Return the trajectory without duplicate timestamps and speed or acceleration outliers.
+    split_gaps(max_time_gap: float = 1200, max_distance_gap: float = 2000, min_points: int = 2, method: str = 'vincenty') -> List['Trajectory']
+        Return the segments of the trajectory between its recording gaps.
+    resample(step: float, method: str = 'vincenty') -> 'Trajectory'
+        Return the trajectory resampled every step seconds.
     """
-    
+
     trajectory_id: str
     user_id: str
-    records: List[Record]
-    gdf: gpd.GeoDataFrame = None
+    columns: TrajectoryColumns
     color: str = None
-    
+    _stats_cache: Dict = field(default_factory=dict, init=False, repr=False, compare=False)
+
     def __post_init__(self):
-        if self.gdf is None:
-            geometry = gpd.points_from_xy([record.longitude for record in self.records], [record.latitude for record in self.records])
-            self.gdf = gpd.GeoDataFrame([record.__dict__ for record in self.records], geometry=geometry)
-    
+        self.columns = self.columns.sort()
+        self._stats_cache = {}
+
+    def __setstate__(self, state: Dict):
+        # pickles written before the columnar storage hold `records` and `gdf`
+        if 'columns' not in state:
+            gdf = state.pop('gdf', None)
+            records = state.pop('records')
+            state['columns'] = TrajectoryColumns.from_frame(gdf) if gdf is not None else TrajectoryColumns.from_records(records)
+        self.__dict__.update(state)
+        self.__post_init__()
+
+    @property
+    def records(self) -> List[Record]:
+        """
+        Return the trajectory points as a list of Record objects
+        """
+        columns = ['user_id', 'trajectory_id', 'latitude', 'longitude', 'altitude', 'datetime', 'timestamp', 'label',
+                   'time_diff', 'distance', 'speed']
+        df = self.columns.to_frame(self.user_id, self.trajectory_id, geometry=False)[columns]
+        return [Record(**record) for record in df.astype(object).where(df.notna(), None).to_dict(orient='records')]
+
+    @property
+    def gdf(self) -> gpd.GeoDataFrame:
+        """
+        Return the trajectory points as a GeoDataFrame
+        """
+        return self.columns.to_frame(self.user_id, self.trajectory_id)
+
     @property
     def count(self) -> int:
-        return len(self.records)
-    
+        return len(self.columns)
+
     @property
     def start_datetime(self) -> datetime:
-        return min([record.datetime for record in self.records])
-    
+        return pd.Timestamp(self.columns.timestamp[0], unit='s')
+
     @property
     def end_datetime(self) -> datetime:
-        return max([record.datetime for record in self.records])
-    
+        return pd.Timestamp(self.columns.timestamp[-1], unit='s')
+
     @property
     def duration(self) -> datetime:
         return self.end_datetime - self.start_datetime
-    
+
     @property
     def centroid(self) -> Dict:
         """
         Return the centroid of the trajectory as the average latitude and longitude
         """
-        latitude = sum([record.latitude for record in self.records]) / self.count
-        longitude = sum([record.longitude for record in self.records]) / self.count
-        return {'latitude': latitude, 'longitude': longitude}
-    
+        summary = self.summary
+        return {'latitude': float(summary.centroid_latitude[0]), 'longitude': float(summary.centroid_longitude[0])}
+
+    def _summary_arrays(self) -> Tuple:
+        # the arrays the summary is computed from, a summary is valid while the columns hold the same arrays
+        columns = self.columns
+        return (columns.latitude, columns.longitude, columns.timestamp, columns.label, columns.distance, columns.speed)
+
+    @property
+    def summary(self) -> TrajectorySummaries:
+        """
+        Return the summary statistics of the trajectory, computed on first access and after the columns changed
+        """
+        if not self.has_summary:
+            self.cache_summary(TrajectorySummaries.from_columns(self.columns, [0, self.count], [self.trajectory_id], [self.user_id]))
+        return self._stats_cache['summary'][1]
+
+    @property
+    def has_summary(self) -> bool:
+        """
+        Return whether a summary valid for the current columns is cached
+        """
+        cached = self._stats_cache.get('summary')
+        return cached is not None and all(a is b for a, b in zip(cached[0], self._summary_arrays()))
+
+    def cache_summary(self, summary: TrajectorySummaries) -> None:
+        """
+        Use precomputed summary statistics of the trajectory for its current columns
+        """
+        self._stats_cache['summary'] = (self._summary_arrays(), summary)
+
     @classmethod
     def from_file(
         cls: 'Trajectory',
@@ -98,70 +186,165 @@ class Trajectory:
         """
         Create a Trajectory object from file using a specific parser
         """
-        records = parser.parse(
-            file_path=file_path, 
+        columns = parser.parse_columns(file_path=file_path)
+        return cls(trajectory_id=trajectory_id, user_id=user_id, columns=columns)
+
+    @classmethod
+    def from_records(
+        cls: 'Trajectory',
+        trajectory_id: str,
+        user_id: str,
+        records: List[Record],
+        color: str = None
+    ) -> 'Trajectory':
+        """
+        Create a Trajectory object from a list of records
+        """
+        return cls(
+            trajectory_id=trajectory_id,
             user_id=user_id,
-            trajectory_id=trajectory_id
+            columns=TrajectoryColumns.from_records(records),
+            color=color
         )
+
+    @classmethod
+    def from_encoded(
+        cls: 'Trajectory',
+        encoded: EncodedTrajectories,
+        i: int = 0,
+        kinematics: Dict[str, np.ndarray] = None
+    ) -> 'Trajectory':
+        """
+        Decode the i-th trajectory of an EncodedTrajectories, with the kinematics of its points when given
+        """
         trajectory = cls(
-            trajectory_id=trajectory_id, 
-            user_id=user_id, 
-            records=records, 
-            gdf=gpd.GeoDataFrame([record.__dict__ for record in records])
+            trajectory_id=encoded.trajectory_ids[i],
+            user_id=encoded.user_ids[encoded.user_code[i]],
+            columns=encoded.decode(i),
         )
+        if kinematics is not None:
+            trajectory.update_kinematics(kinematics)
         return trajectory
-    
-    def compute_speed(self):
-        """
-        Compute the speed with the trajectory records, time differences, distance, and speed
-        """
-        columns = ['user_id', 'trajectory_id', 'label', 'datetime', 'latitude', 'longitude', 'altitude', 'timestamp']
-        print(f'Computing speed for trajectory {self.trajectory_id} with {self.count} records')
-        self.gdf['time_diff'] = self._calculate_time_diffs(self.gdf)
-        self.gdf['distance'] = self._calculate_distances(self.gdf)
-        self.gdf['speed'] = self._calculate_speeds(self.gdf)
-        self.records = [Record(**record) for record in self.gdf[columns].to_dict(orient='records')]
-
-    def _calculate_time_diffs(self, gdf: gpd.GeoDataFrame) -> List[float]:
-        """
-        Calculate the time difference in seconds between consecutive records
-        """
-        gdf = gdf.sort_values(by='datetime')  # Ensure records are sorted by datetime
-        time_diffs = gdf['datetime'].diff().dt.total_seconds()  # Calculate time differences in seconds
-        return time_diffs.fillna(0).tolist()  # Fill NaN for the first row with 0 and return as a list
-    
-    def _calculate_distances(self, gdf: gpd.GeoDataFrame) -> List[float]:
-        """
-        Calculate the distance in meters between consecutive records using geopy
-        """
-        gdf = gdf.sort_values(by='datetime')  # Ensure records are sorted by datetime
-        distances = [0]  # The first record has 0 distance
-        for i in range(1, len(gdf)):
-            coord1 = (gdf.iloc[i - 1]['latitude'], gdf.iloc[i - 1]['longitude'])
-            coord2 = (gdf.iloc[i]['latitude'], gdf.iloc[i]['longitude'])
-            distance = geodesic(coord1, coord2).meters  # Distance in meters
-            distances.append(distance)
-        return distances
-    
-    def _calculate_speeds(self, gdf: gpd.GeoDataFrame) -> List[float]:
-        """
-        Calculate the speed in meters per second between consecutive records
-        Speed is computed as distance divided by time difference
-        """
-        gdf = gdf.sort_values(by='datetime')  # Ensure records are sorted by datetime
-        speeds = [0]  # The first record has 0 speed
-        for i in range(1, len(gdf)):
-            time_diff = gdf.iloc[i]['time_diff']  # Time difference in seconds
-            distance = gdf.iloc[i]['distance']  # Distance in meters
-            speed = distance / time_diff if time_diff > 0 else 0  # Speed in m/s
-            speeds.append(speed)
-        return speeds
-    
+
+    def encode(self) -> EncodedTrajectories:
+        """
+        Return the compact encoding of the trajectory, its kinematics are not kept
+        """
+        return EncodedTrajectories.from_columns(self.columns, [0, self.count], [self.trajectory_id], [self.user_id])
+
+    def compute_speed(self, method: str = 'vincenty'):
+        """
+        Compute the time differences, distance, speed, acceleration and bearing of the trajectory records
+        """
+        self.update_kinematics(compute_kinematics(
+            self.columns.latitude, self.columns.longitude, self.columns.timestamp, method=method
+        ))
+
+    def update_kinematics(self, kinematics: Dict[str, np.ndarray]) -> None:
+        """
+        Store the arrays computed by `utils.kinematics.compute_kinematics` in the columns
+        """
+        for column, values in kinematics.items():
+            setattr(self.columns, column, values)
+
+    def quantile(self, column: str, q: float) -> float:
+        """
+        Return the q-quantile of a column, ignoring NaN. The result is cached until the column array is replaced.
+        """
+        values = getattr(self.columns, column)
+        cached = self._stats_cache.get(('quantile', column, q))
+        if cached is None or cached[0] is not values:
+            cached = (values, float(np.nanquantile(values, q)))
+            self._stats_cache[('quantile', column, q)] = cached
+        return cached[1]
+
+    def stay_points(
+        self,
+        distance_threshold: float = DISTANCE_THRESHOLD,
+        time_threshold: float = TIME_THRESHOLD
+    ) -> StayPoints:
+        """
+        Return the stay points of the trajectory, within distance_threshold meters for at least time_threshold seconds
+        """
+        return StayPoints.from_columns(
+            self.columns, [0, self.count], [self.trajectory_id], [self.user_id],
+            distance_threshold=distance_threshold, time_threshold=time_threshold,
+        )
+
+    def clean(
+        self,
+        max_speed: float = MAX_SPEED,
+        max_acceleration: float = MAX_ACCELERATION,
+        method: str = 'vincenty'
+    ) -> 'Trajectory':
+        """
+        Return the trajectory without the points with the timestamp of the previous point and without the
+        speed or acceleration outliers, with its kinematics (see `models.preprocessing.clean_columns`)
+        """
+        columns, _ = clean_columns(self.columns, [0, self.count], max_speed=max_speed, max_acceleration=max_acceleration, method=method)
+        return Trajectory(trajectory_id=self.trajectory_id, user_id=self.user_id, columns=columns, color=self.color)
+
+    def split_gaps(
+        self,
+        max_time_gap: float = MAX_TIME_GAP,
+        max_distance_gap: float = MAX_DISTANCE_GAP,
+        min_points: int = MIN_POINTS,
+        method: str = 'vincenty'
+    ) -> List['Trajectory']:
+        """
+        Return the segments of the trajectory between the points more than max_time_gap seconds or
+        max_distance_gap meters apart, with at least min_points points. When the trajectory is split,
+        the k-th segment gets the trajectory ID `{trajectory_id}_{k}`.
+        """
+        columns, offsets, _ = split_columns(
+            self.columns, [0, self.count], max_time_gap=max_time_gap, max_distance_gap=max_distance_gap,
+            min_points=min_points, method=method
+        )
+        segments = len(offsets) - 1
+        return [
+            Trajectory(
+                trajectory_id=f'{self.trajectory_id}_{k}' if segments > 1 else self.trajectory_id,
+                user_id=self.user_id,
+                columns=columns[offsets[k]:offsets[k + 1]],
+                color=self.color,
+            )
+            for k in range(segments)
+        ]
+
+    def resample(self, step: float, method: str = 'vincenty') -> 'Trajectory':
+        """
+        Return the trajectory resampled every step seconds, see `models.preprocessing.resample_columns`
+        """
+        columns, _ = resample_columns(self.columns, [0, self.count], step, method=method)
+        return Trajectory(trajectory_id=self.trajectory_id, user_id=self.user_id, columns=columns, color=self.color)
+
+    def compute_lod(self, min_tolerance: float = 0.5) -> None:
+        """
+        Compute the Douglas-Peucker significance of the points, which holds every level of detail of the trajectory
+        """
+        self.columns.significance = douglas_peucker_significance(
+            self.columns.latitude, self.columns.longitude, min_tolerance=min_tolerance
+        )
+
+    def level_of_detail(self, tolerance: float) -> TrajectoryColumns:
+        """
+        Return the points kept by a Douglas-Peucker simplification with a tolerance in meters,
+        all of them when the tolerance is 0. The first and last points are always kept.
+        """
+        if tolerance <= 0 or self.count < 3:
+            return self.columns
+        if self.columns.significance is None:
+            self.compute_lod()
+        keep = self.columns.significance >= tolerance
+        keep[[0, -1]] = True
+        return self.columns[keep]
+
     @property
     def features(self) -> Dict:
         """
         Return a dictionary with the trajectory features
         """
+        summary = self.summary
         return {
             'trajectory_id': self.trajectory_id,
             'user_id': self.user_id,
@@ -169,20 +352,30 @@ class Trajectory:
             'start_datetime': self.start_datetime,
             'end_datetime': self.end_datetime,
             'duration': self.duration,
+            'total_distance': float(summary.total_distance[0]),
+            'mean_speed': float(summary.mean_speed[0]),
+            'max_speed': float(summary.max_speed[0]),
+            'label': summary.label[0],
             # 'centroid': self.centroid,
         }
-        
+
+    def time_slice(self, start: float, end: float) -> slice:
+        """
+        Return the slice of the points with start <= timestamp <= end, found by binary search on the sorted timestamps
+        """
+        i = np.searchsorted(self.columns.timestamp, start, side='left')
+        j = np.searchsorted(self.columns.timestamp, end, side='right')
+        return slice(int(i), int(j))
+
     def filter_by_datetimerange(self, datetime_range: Tuple[datetime, datetime]) -> 'Trajectory':
         """
         Filter the trajectory records by a specific time range and retain existing time_diff, distance, and speed values.
+        The filtered columns are views on the columns of the trajectory, nothing is copied.
         """
-        filtered_records = [record for record in self.records if datetime_range[0] <= record.datetime <= datetime_range[1]]
-        filtered_gdf = self.gdf[self.gdf['datetime'].between(datetime_range[0], datetime_range[1])]
         filtered_trajectory = Trajectory(
             user_id=self.user_id,
             trajectory_id=self.trajectory_id,
-            records=filtered_records,
-            gdf=filtered_gdf,
+            columns=self.columns[self.time_slice(*time_bounds(datetime_range))],
             color=self.color
         )
-        return filtered_trajectory
\ No newline at end of file
+        return filtered_trajectory
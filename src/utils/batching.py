@@ -0,0 +1,42 @@
+from typing import Dict, List
+import numpy as np
+
+
+def pack(
+    arrays: List[np.ndarray],
+    gap=np.nan
+) -> np.ndarray:
+    """
+    Concatenate arrays with a gap value between consecutive ones (NaN for floats, NaT for datetimes),
+    so that plotly breaks the line between two trajectories drawn in the same trace
+    """
+    if not arrays:
+        return np.array([])
+    packed = np.full(sum(len(array) for array in arrays) + len(arrays) - 1, gap, dtype=np.result_type(*arrays))
+    start = 0
+    for array in arrays:
+        packed[start:start + len(array)] = array
+        start += len(array) + 1
+    return packed
+
+
+def color_codes(counts: List[int]) -> np.ndarray:
+    """
+    Return the index of the trajectory of each point of a packed trace, as integers to keep the JSON small
+    (the gaps get 0, they have no marker)
+    """
+    return pack([np.full(count, i, dtype=np.int32) for i, count in enumerate(counts)], gap=0)
+
+
+def marker_colors(colors: List[str]) -> Dict:
+    """
+    Return the marker attributes mapping the codes of `color_codes` to the colors of the trajectories,
+    with a discrete colorscale: the colors are sent once instead of once per point
+    """
+    if len(colors) == 1:
+        colors = colors * 2
+    n = len(colors)
+    colorscale = []
+    for i, color in enumerate(colors):
+        colorscale += [[i / n, color], [(i + 1) / n, color]]
+    return dict(colorscale=colorscale, cmin=-0.5, cmax=n - 0.5, showscale=False)
@@ -0,0 +1,316 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+
+_MISSING = object()
+
+
+def make_key(*parts: Any) -> str:
+    """
+    Return a stable key for JSON-serializable parts: the same selection gives the same key in every process
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class FigureCache:
+    """
+    Bounded cache of the query results and figures of the dashboard callbacks.
+
+    Entries are kept in memory in least-recently-used order, at most max_entries of them, and expire ttl
+    seconds after being stored. With a disk_path, the entries stored with persist=True are also pickled to
+    `<disk_path>/<key>.pkl`: the worker processes of a server share them, a miss in memory is looked up on
+    disk before computing. The disk files expire with the same ttl and the oldest are removed beyond
+    max_disk_bytes. The files are unpickled, so the folder must only be writable by the user of the app: it is
+    created with mode 0700, an existing folder of another user is refused.
+
+    Properties
+    ----------
+    stats : Dict
+        Hit, miss, disk hit and eviction counters, and the number of entries in memory.
+    Methods
+    -------
+    get(key: str, default=None) -> Any
+        Return the value of a key, from memory then from disk, or default.
+    put(key: str, value: Any, persist: bool = True) -> None
+        Store a value, also on disk when persist is True and the cache has a disk_path.
+    get_or_compute(key: str, compute: Callable[[], Any], persist: bool = True) -> Any
+        Return the cached value of a key, computing and storing it on a miss.
+    clear() -> None
+        Remove all the entries, in memory and on disk.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 64,
+        ttl: float = 600.0,
+        disk_path: str = None,
+        max_disk_bytes: int = 512 * 2 ** 20
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        if disk_path:
+            os.makedirs(disk_path, mode=0o700, exist_ok=True)
+            if os.stat(disk_path).st_uid != os.getuid():
+                raise ValueError(f'The figure cache folder {disk_path} must belong to the user of the app')
+            os.chmod(disk_path, 0o700)
+
+    @property
+    def stats(self) -> Dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'disk_hits': self.disk_hits,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+        }
+
+    def _file_path(self, key: str) -> str:
+        return os.path.join(self.disk_path, f'{key}.pkl')
+
+    def _read_disk(self, key: str) -> Any:
+        file_path = self._file_path(key)
+        try:
+            if time.time() - os.path.getmtime(file_path) > self.ttl:
+                os.remove(file_path)
+                return _MISSING
+            with open(file_path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # missing, removed by another worker or partially written by an older version
+            return _MISSING
+
+    def _write_disk(self, key: str, value: Any) -> None:
+        file_path = self._file_path(key)
+        tmp_path = f'{file_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, file_path)
+        self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        """
+        Remove the expired files, then the oldest ones until the folder fits in max_disk_bytes
+        """
+        files = []
+        now = time.time()
+        for entry in os.scandir(self.disk_path):
+            if not entry.name.endswith('.pkl'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                self._remove_file(entry.path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, file_path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            self._remove_file(file_path)
+            total -= size
+
+    @staticmethod
+    def _remove_file(file_path: str) -> None:
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+        if self.disk_path:
+            value = self._read_disk(key)
+            if value is not _MISSING:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._store(key, value)
+                return value
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def _store(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, key: str, value: Any, persist: bool = True) -> None:
+        with self._lock:
+            self._store(key, value)
+        if persist and self.disk_path:
+            self._write_disk(key, value)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], persist: bool = True) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value, persist=persist)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self.disk_path:
+            for entry in os.scandir(self.disk_path):
+                if entry.name.endswith('.pkl'):
+                    self._remove_file(entry.path)
+
+
+class UserCache:
+    """
+    Trajectories of the users loaded on demand, kept in least-recently-used order within a memory budget.
+
+    `load` returns the trajectories of one user (e.g. `Trajectories.from_store(store_path, user_ids=[user_id])`);
+    the users are evicted once the arrays of the loaded users exceed max_bytes, the last one requested is always
+    kept. After a request, the users next to it in `user_ids` are loaded by a background thread, so that browsing
+    the users dropdown usually finds them ready. Concurrent requests of a user being loaded wait for that load.
+
+    Properties
+    ----------
+    stats : Dict
+        Hit, miss, prefetch and eviction counters, the loaded users and their bytes.
+    Methods
+    -------
+    get(user_id: str) -> Any
+        Return the trajectories of a user, loading them when needed.
+    prefetch(user_id: str) -> None
+        Load the neighbours of a user in the background.
+    """
+
+    def __init__(
+        self,
+        user_ids: List[str],
+        load: Callable[[str], Any],
+        max_bytes: int = 2 * 2 ** 30,
+        prefetch_count: int = 2
+    ):
+        self.user_ids = list(user_ids)
+        self.load = load
+        self.max_bytes = max_bytes
+        self.prefetch_count = prefetch_count
+        self._positions = {user_id: i for i, user_id in enumerate(self.user_ids)}
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._loading: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.evictions = 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(nbytes for _, nbytes in self._entries.values())
+
+    @property
+    def stats(self) -> Dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'prefetched': self.prefetched,
+            'evictions': self.evictions,
+            'users': list(self._entries),
+            'bytes': self.nbytes,
+        }
+
+    @staticmethod
+    def _nbytes(trajectories: Any) -> int:
+        return sum(trajectory.columns.nbytes for trajectory in trajectories.trajectories)
+
+    def _load(self, user_id: str, prefetch: bool = False) -> Any:
+        """
+        Load a user once, the other threads asking for it wait for the same future.
+        A prefetched user is stored as the least recently used one: it is evicted before the users being browsed.
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                return entry[0]
+            future = self._loading.get(user_id)
+            owner = future is None
+            if owner:
+                future = self._loading[user_id] = Future()
+        if not owner:
+            return future.result()
+        try:
+            trajectories = self.load(user_id)
+        except BaseException as error:
+            with self._lock:
+                del self._loading[user_id]
+            future.set_exception(error)
+            raise
+        with self._lock:
+            del self._loading[user_id]
+            self._entries[user_id] = (trajectories, self._nbytes(trajectories))
+            if prefetch:
+                self._entries.move_to_end(user_id, last=False)
+            # the most recently used user stays, even alone over the budget
+            self._evict(keep=next(reversed(self._entries)))
+        future.set_result(trajectories)
+        return trajectories
+
+    def _evict(self, keep: str) -> None:
+        total = self.nbytes
+        for user_id in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if user_id == keep:
+                continue
+            total -= self._entries.pop(user_id)[1]
+            self.evictions += 1
+
+    def get(self, user_id: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        return self._load(user_id)
+
+    def _prefetch_user(self, user_id: str) -> None:
+        with self._lock:
+            if user_id in self._entries or user_id in self._loading:
+                return
+            self.prefetched += 1
+        self._load(user_id, prefetch=True)
+
+    def prefetch(self, user_id: str) -> None:
+        position = self._positions.get(user_id)
+        if position is None or self.prefetch_count <= 0:
+            return
+        # the thread pool is created in the process using it, not inherited from a server master process
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='user-prefetch')
+            self._executor_pid = os.getpid()
+        neighbours = self.user_ids[position + 1:position + 1 + self.prefetch_count] + self.user_ids[max(0, position - 1):position]
+        for neighbour in neighbours:
+            self._executor.submit(self._prefetch_user, neighbour)
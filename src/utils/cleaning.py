@@ -0,0 +1,205 @@
+"""
+Vectorized cleaning of GPS points: duplicate timestamps, speed and acceleration outliers, segmentation at
+recording gaps and resampling to a fixed time step.
+
+The arrays hold trajectories back to back, trajectory i holding the points offsets[i]:offsets[i + 1], and are
+processed for all of them at once. The functions return masks and offsets, `models.preprocessing` applies them
+to `TrajectoryColumns`.
+"""
+from typing import Dict, Sequence, Tuple
+import numpy as np
+
+from utils.kinematics import bearing, compute_kinematics, distance, step_kinematics
+
+# above the high-speed trains of GeoLife, 360 km/h; airplane trajectories need a higher threshold
+MAX_SPEED = 100.0
+# about 1 g, in m/s²
+MAX_ACCELERATION = 10.0
+# a trajectory is split where two consecutive points are more than 20 minutes or 2 km apart
+MAX_TIME_GAP = 1200.0
+MAX_DISTANCE_GAP = 2000.0
+MIN_POINTS = 2
+
+
+def trajectory_index(offsets: Sequence[int]) -> np.ndarray:
+    """
+    Return the index of the trajectory of each point
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def mask_offsets(offsets: Sequence[int], keep: np.ndarray) -> np.ndarray:
+    """
+    Return the offsets of the trajectories once reduced to the points of the keep mask
+    """
+    return np.concatenate([[0], np.cumsum(keep)])[np.asarray(offsets, dtype=np.int64)]
+
+
+def start_mask(offsets: Sequence[int], n: int) -> np.ndarray:
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts = np.zeros(n, dtype=bool)
+    starts[offsets[:-1][offsets[:-1] < n]] = True
+    return starts
+
+
+def duplicate_mask(timestamp: np.ndarray, offsets: Sequence[int]) -> np.ndarray:
+    """
+    Return True for the points with the timestamp of the previous point of their trajectory: their speed
+    would be undefined (0 for `compute_kinematics`). The timestamps are expected sorted within each trajectory.
+    """
+    duplicates = np.zeros(len(timestamp), dtype=bool)
+    duplicates[1:] = np.diff(timestamp) == 0
+    return duplicates & ~start_mask(offsets, len(timestamp))
+
+
+def drop_kinematics(
+    kinematics: Dict[str, np.ndarray],
+    keep: np.ndarray,
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    timestamp: np.ndarray,
+    offsets: Sequence[int],
+    method: str = 'vincenty'
+) -> Dict[str, np.ndarray]:
+    """
+    Return the kinematics of the points of the keep mask from the kinematics of all the points, offsets being
+    the offsets of the kept points: only the distances and bearings of the steps over dropped points are computed
+    again, the speed and acceleration are derived from them (see `utils.kinematics.step_kinematics`)
+    """
+    index = np.flatnonzero(keep)
+    n = len(index)
+    starts = start_mask(offsets, n)
+    # the kept points whose previous point was dropped
+    rows = np.flatnonzero(np.insert(np.diff(index) > 1, 0, False) & ~starts)
+    after, before = index[rows], index[rows - 1]
+    time_diff = np.zeros(n)
+    time_diff[1:] = np.diff(timestamp[index])
+    dist = kinematics['distance'][index]
+    heading = kinematics['bearing'][index]
+    dist[rows] = distance(latitude[before], longitude[before], latitude[after], longitude[after], method=method)
+    heading[rows] = bearing(latitude[before], longitude[before], latitude[after], longitude[after])
+    return step_kinematics(time_diff, dist, heading, starts)
+
+
+def outlier_mask(
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    timestamp: np.ndarray,
+    offsets: Sequence[int],
+    max_speed: float = MAX_SPEED,
+    max_acceleration: float = MAX_ACCELERATION,
+    method: str = 'vincenty',
+    max_passes: int = 8
+) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Return the mask of the points to keep and the kinematics of the kept points.
+    A point is a spike when the steps to and from it are both faster than max_speed, or when the speed jumps by
+    more than max_acceleration on the step to it and drops back by as much after the step from it (the speed
+    changes of the steps before and after the point have opposite signs). The first and last points of a
+    trajectory have a single step, they are outliers when it is faster than max_speed and the neighbour is not
+    a spike itself. A jump after which the track continues is not a spike, it is left to `gap_offsets`.
+    The kinematics are updated for the remaining points until no outlier is left (at most max_passes times),
+    the acceleration spikes are looked for once the speed spikes are removed.
+    """
+    latitude, longitude, timestamp = (np.asarray(values, dtype=np.float64) for values in (latitude, longitude, timestamp))
+    offsets = np.asarray(offsets, dtype=np.int64)
+    index = np.arange(len(timestamp))
+    kinematics = compute_kinematics(latitude, longitude, timestamp, offsets=offsets[:-1], method=method)
+    for _ in range(max_passes):
+        n = len(index)
+        starts = start_mask(offsets, n)
+        ends = np.zeros(n, dtype=bool)
+        ends[np.maximum(offsets[1:] - 1, 0)[offsets[1:] > offsets[:-1]]] = True
+        # steps to and from each point
+        fast = kinematics['speed'] > max_speed
+        fast[starts] = False
+        fast_into, fast_out = fast, np.append(fast[1:], False)
+        spikes = fast_into & fast_out & ~starts & ~ends
+        spike_after = np.append(spikes[1:], False)
+        spike_before = np.insert(spikes[:-1], 0, False)
+        outliers = (
+            spikes
+            | (starts & ~ends & fast_out & ~spike_after)
+            | (ends & ~starts & fast_into & ~spike_before)
+        )
+        if not outliers.any() and max_acceleration is not None:
+            # the speed changes around a speed spike are large too, the acceleration is only checked without them
+            acceleration = kinematics['acceleration']
+            after = np.append(acceleration[2:], [0.0, 0.0])
+            outliers = (
+                (np.abs(acceleration) > max_acceleration) & (np.abs(after) > max_acceleration)
+                & (np.sign(acceleration) != np.sign(after)) & ~starts & ~ends & ~np.append(ends[1:], False)
+            )
+        if not outliers.any():
+            break
+        offsets = mask_offsets(offsets, ~outliers)
+        kinematics = drop_kinematics(
+            kinematics, ~outliers, latitude[index], longitude[index], timestamp[index], offsets, method=method
+        )
+        index = index[~outliers]
+    keep = np.zeros(len(timestamp), dtype=bool)
+    keep[index] = True
+    return keep, kinematics
+
+
+def gap_offsets(
+    time_diff: np.ndarray,
+    distance: np.ndarray,
+    offsets: Sequence[int],
+    max_time_gap: float = MAX_TIME_GAP,
+    max_distance_gap: float = MAX_DISTANCE_GAP
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the offsets of the segments of the trajectories split where the time or the distance from the previous
+    point exceeds the gaps (None disables a criterion), and the index of the trajectory of each segment.
+    The empty trajectories have no segment.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n = len(time_diff)
+    gaps = np.zeros(n, dtype=bool)
+    if max_time_gap is not None:
+        gaps |= np.asarray(time_diff) > max_time_gap
+    if max_distance_gap is not None:
+        gaps |= np.asarray(distance) > max_distance_gap
+    gaps &= ~start_mask(offsets, n)
+    # an empty trajectory has no segment, its offset is also the start of the next trajectory
+    bounds = np.unique(np.concatenate([offsets, np.flatnonzero(gaps)]))
+    parent = np.searchsorted(offsets, bounds[:-1], side='right') - 1
+    return bounds, parent
+
+
+def resample_positions(
+    timestamp: np.ndarray,
+    offsets: Sequence[int],
+    step: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Return the timestamps of the trajectories resampled every step seconds from their first point and the offsets
+    of the resampled trajectories; for each new point, the indices of the original points before (at or before
+    its timestamp) and after it in the same trajectory, and its linear interpolation weight between them
+    """
+    timestamp = np.asarray(timestamp, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    filled = counts > 0
+    start = np.zeros(len(counts))
+    end = np.zeros(len(counts))
+    start[filled] = timestamp[offsets[:-1][filled]]
+    end[filled] = timestamp[offsets[1:][filled] - 1]
+    new_counts = np.where(filled, np.floor((end - start) / step).astype(np.int64) + 1, 0)
+    new_offsets = np.concatenate([[0], np.cumsum(new_counts)])
+    new_trajectory = np.repeat(np.arange(len(counts)), new_counts)
+    elapsed = (np.arange(new_offsets[-1]) - new_offsets[:-1][new_trajectory]) * step
+    new_timestamp = start[new_trajectory] + elapsed
+
+    # search each new timestamp among the points of its own trajectory: the keys of trajectory i are shifted
+    # past the keys of the previous trajectories
+    spacing = float(np.max(end - start, initial=0)) + 2 * step
+    keys = trajectory_index(offsets) * spacing + (timestamp - np.repeat(start, counts))
+    previous = np.searchsorted(keys, new_trajectory * spacing + elapsed, side='right') - 1
+    following = np.minimum(previous + 1, offsets[1:][new_trajectory] - 1)
+    span = timestamp[following] - timestamp[previous]
+    weight = np.zeros(len(new_timestamp))
+    np.divide(new_timestamp - timestamp[previous], span, out=weight, where=span > 0)
+    return new_timestamp, new_offsets, previous, following, weight
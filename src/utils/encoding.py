@@ -0,0 +1,106 @@
+"""
+Compact encoding of the trajectory points, see `models.encoded.EncodedTrajectories`:
+
+    latitude, longitude   int32 fixed point, 1e-6 degree (about 0.1 m)
+    timestamp             int32 seconds from the start of the trajectory
+    user, trajectory      integer codes into dictionaries of the IDs
+    label                 int8 codes into `LABELS`, like `TrajectoryColumns`
+
+The .plt files hold 6 decimals and whole seconds: their coordinates and timestamps are decoded exactly.
+
+Run from `src/` to encode the pickle or the store of the dashboard into the file it loads instead:
+    python -m utils.encoding --store-path data/store data/trajectories_001.npz
+"""
+from typing import Sequence, Tuple
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+# fixed-point units per degree
+COORDINATE_SCALE = 10 ** 6
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def encode_coordinates(values: np.ndarray) -> np.ndarray:
+    """
+    Return degrees as int32 multiples of 1e-6 degree
+    """
+    return np.rint(np.asarray(values, dtype=np.float64) * COORDINATE_SCALE).astype(np.int32)
+
+
+def decode_coordinates(codes: np.ndarray) -> np.ndarray:
+    return codes / COORDINATE_SCALE
+
+
+def encode_bounds(low: float, high: float) -> Tuple[int, int]:
+    """
+    Return the fixed-point codes c with low <= decode(c) <= high as an inclusive range
+    """
+    return int(np.ceil(low * COORDINATE_SCALE - 1e-6)), int(np.floor(high * COORDINATE_SCALE + 1e-6))
+
+
+def encode_times(
+    timestamp: np.ndarray,
+    offsets: Sequence[int]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the int64 start of each trajectory and the int32 seconds of each point from the start of its trajectory,
+    trajectory i holding the points offsets[i]:offsets[i + 1]. The timestamps are rounded to whole seconds.
+    Raise a ValueError when a trajectory lasts more than 68 years.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    seconds = np.rint(np.asarray(timestamp, dtype=np.float64)).astype(np.int64)
+    start = np.zeros(len(counts), dtype=np.int64)
+    start[counts > 0] = seconds[offsets[:-1][counts > 0]]
+    delta = seconds - np.repeat(start, counts)
+    if len(delta) and np.abs(delta).max() > INT32_MAX:
+        raise ValueError('The timestamps of a trajectory span more than the int32 seconds of the encoding')
+    return start, delta.astype(np.int32)
+
+
+def decode_times(
+    start: np.ndarray,
+    delta: np.ndarray,
+    offsets: Sequence[int]
+) -> np.ndarray:
+    """
+    Return the float64 seconds since the epoch of the points
+    """
+    return (np.repeat(start, np.diff(offsets)) + delta).astype(np.float64)
+
+
+def encode_dictionary(values: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the int32 code of each value and the sorted dictionary of the distinct values
+    """
+    codes, dictionary = pd.factorize(np.asarray(values, dtype=object), sort=True)
+    return codes.astype(np.int32), np.asarray(dictionary, dtype=object)
+
+
+def main():
+    from models.trajectories import Trajectories
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output_file')
+    parser.add_argument('--store-path', default=None)
+    parser.add_argument('--pickle-path', default=None)
+    parser.add_argument('--uncompressed', action='store_true')
+    args = parser.parse_args()
+    if args.store_path:
+        trajectories = Trajectories.from_store(args.store_path)
+    elif args.pickle_path:
+        trajectories = pd.read_pickle(args.pickle_path)
+    else:
+        parser.error('Provide --store-path or --pickle-path')
+    encoded = trajectories.encode()
+    encoded.save(args.output_file, compressed=not args.uncompressed)
+    print(
+        f'{len(encoded)} trajectories, {encoded.points} points: {trajectories.columns.nbytes / 2 ** 20:.1f} MiB of columns, '
+        f'{encoded.nbytes / 2 ** 20:.1f} MiB encoded, {os.path.getsize(args.output_file) / 2 ** 20:.1f} MiB on disk'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Ingest the raw GeoLife `Data/` tree into a DatasetStore, incrementally by default.
+
+Run from `src/`:
+    python -m utils.ingest --data-path /path/to/Data --store-path data/store
+"""
+from typing import Dict, List
+import argparse
+import hashlib
+import os
+import numpy as np
+
+from models.columns import NO_LABEL
+from models.trajectories import Trajectories
+from utils.metrics import format_snapshot, metrics
+from utils.parsers import PltBulkParser, list_plt_files, list_users
+from utils.store import DatasetStore
+
+
+def file_signature(
+    file_path: str,
+    previous: Dict = None
+) -> Dict:
+    """
+    Return the size, mtime and sha1 of a file.
+    The hash of `previous` is reused when the size and the mtime did not change.
+    """
+    stat = os.stat(file_path)
+    signature = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if previous and all(previous.get(key) == value for key, value in signature.items()):
+        return {**signature, 'sha1': previous['sha1']}
+    with open(file_path, 'rb') as f:
+        signature['sha1'] = hashlib.sha1(f.read()).hexdigest()
+    return signature
+
+
+@metrics.timed('ingest.user')
+def ingest_user(
+    store: DatasetStore,
+    data_path: str,
+    user_id: str,
+    incremental: bool = True,
+    method: str = 'vincenty'
+) -> Dict[str, int]:
+    """
+    Parse, compute the speed, the levels of detail and the labels of the trajectories of a user and write its partition.
+    In incremental mode the manifest of the partition (path, size, mtime and sha1 of each source file) is used
+    to re-parse only the new and changed .plt files; the others are read back from the store with their speed
+    and labels, which are only recomputed when labels.txt changed. Users without any change are not rewritten,
+    only their missing density grids are written.
+    Return the number of added, changed, unchanged and removed files.
+    """
+    user_path = os.path.join(data_path, user_id)
+    file_paths = list_plt_files(user_path)
+    labels_path = os.path.join(user_path, 'labels.txt')
+
+    previous = {}
+    stored = {}
+    previous_labels = None
+    if incremental and user_id in store.user_ids:
+        manifest = store.read_metadata(user_id).get('manifest', {})
+        previous = {source['path']: source for source in manifest.get('sources', [])}
+        previous_labels = manifest.get('labels')
+        stored = {
+            source['path']: trajectory
+            for source, trajectory in zip(manifest.get('sources', []), store.read_user(user_id))
+        }
+
+    sources = [
+        {'path': os.path.relpath(file_path, data_path), **file_signature(file_path, previous.get(os.path.relpath(file_path, data_path)))}
+        for file_path in file_paths
+    ]
+    labels = file_signature(labels_path, previous_labels) if os.path.exists(labels_path) else None
+    unchanged = [
+        source['path'] in stored and previous[source['path']]['sha1'] == source['sha1']
+        for source in sources
+    ]
+    labels_changed = (labels or {}).get('sha1') != (previous_labels or {}).get('sha1')
+    summary = {
+        'added': sum(source['path'] not in previous for source in sources),
+        'changed': sum(source['path'] in previous and not kept for source, kept in zip(sources, unchanged)),
+        'unchanged': sum(unchanged),
+        'removed': len(set(previous) - {source['path'] for source in sources}),
+    }
+    for key, value in summary.items():
+        metrics.count(f'ingest.files_{key}', value)
+    manifest = {'sources': sources, 'labels': labels}
+    if incremental and all(unchanged) and not summary['removed'] and not labels_changed and previous:
+        if manifest != {'sources': list(previous.values()), 'labels': previous_labels}:
+            # only refresh the sizes and mtimes of files touched without content change
+            store.update_metadata(user_id, {'manifest': manifest})
+        if not os.path.exists(os.path.join(store.user_path(user_id), 'density.npz')):
+            # partitions written before the density grids
+            store.write_density(user_id, store.build_density(user_id))
+        return summary
+
+    trajectory_ids = [f'{user_id}_{i}' for i in range(len(file_paths))]
+    parsed = [i for i, kept in enumerate(unchanged) if not kept]
+    batch = PltBulkParser().parse_files(
+        file_paths=[file_paths[i] for i in parsed],
+        user_ids=[user_id] * len(parsed),
+        trajectory_ids=[trajectory_ids[i] for i in parsed],
+    )
+    new_trajectories = Trajectories.from_batch(batch)
+    new_trajectories.compute_trajectories_speed(method=method)
+    new_trajectories.compute_lod()
+
+    new_iter = iter(new_trajectories.trajectories)
+    trajectories = []
+    for i, kept in enumerate(unchanged):
+        trajectory = stored[sources[i]['path']] if kept else next(new_iter)
+        trajectory.trajectory_id = trajectory_ids[i]
+        trajectories.append(trajectory)
+
+    relabelled = Trajectories(trajectories) if labels_changed else new_trajectories
+    for trajectory in relabelled.trajectories:
+        trajectory.columns.label = np.full(trajectory.count, NO_LABEL, dtype=np.int8)
+    relabelled.ugpdate_labels(user_path)
+
+    store.write_user(user_id, trajectories, metadata={'manifest': manifest})
+    return summary
+
+
+def ingest(
+    data_path: str,
+    store_path: str,
+    user_ids: List[str] = None,
+    incremental: bool = True,
+    method: str = 'vincenty'
+) -> Dict[str, Dict[str, int]]:
+    """
+    Ingest the users of the `Data/` folder (all of them by default) into the DatasetStore at store_path
+    """
+    store = DatasetStore(store_path)
+    user_ids = list_users(data_path) if user_ids is None else user_ids
+    return {
+        user_id: ingest_user(store, data_path, user_id, incremental=incremental, method=method)
+        for user_id in user_ids
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-path', default=os.getenv('DATA_PATH'))
+    parser.add_argument('--store-path', default=os.getenv('STORE_PATH'))
+    parser.add_argument('--user-ids', nargs='*', default=None)
+    parser.add_argument('--full', action='store_true', help='re-parse every file, ignoring the manifest')
+    parser.add_argument('--metrics', nargs='?', const='-', default=None,
+                        help='print the timings of the stages, or write them to a JSON file')
+    args = parser.parse_args()
+    for user_id, summary in ingest(args.data_path, args.store_path, args.user_ids, incremental=not args.full).items():
+        print(user_id, summary)
+    if args.metrics == '-':
+        print(format_snapshot(metrics.snapshot()))
+    elif args.metrics:
+        metrics.dump(args.metrics)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+from typing import Dict, Sequence
+import numpy as np
+from geographiclib.geodesic import Geodesic
+
+from utils.metrics import metrics
+
+EARTH_RADIUS = 6371008.8  # mean earth radius in meters
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+METHODS = ('haversine', 'vincenty', 'karney')
+
+
+def haversine(
+    lat1: np.ndarray,
+    lon1: np.ndarray,
+    lat2: np.ndarray,
+    lon2: np.ndarray
+) -> np.ndarray:
+    """
+    Great-circle distance in meters between arrays of coordinates, on a spherical earth
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def vincenty(
+    lat1: np.ndarray,
+    lon1: np.ndarray,
+    lat2: np.ndarray,
+    lon2: np.ndarray,
+    max_iter: int = 200,
+    tol: float = 1e-12
+) -> np.ndarray:
+    """
+    Ellipsoidal (WGS84) distance in meters between arrays of coordinates, using Vincenty's inverse formula.
+    Pairs that do not converge (nearly antipodal points) fall back to Karney's algorithm.
+    """
+    lat1, lon1, lat2, lon2 = (np.asarray(x, dtype=np.float64) for x in (lat1, lon1, lat2, lon2))
+    U1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2)))
+    L = np.radians(lon2 - lon1)
+    sinU1, cosU1, sinU2, cosU2 = np.sin(U1), np.cos(U1), np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    active = np.ones(L.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cosU2 * sin_lam, cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)
+            cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0, cosU1 * cosU2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0, cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha)
+            C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * WGS84_F * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+            )
+            active = np.abs(lam - lam_prev) > tol
+            if not active.any():
+                break
+
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+        ))
+        distances = WGS84_B * A * (sigma - delta_sigma)
+
+    fallback = active | ~np.isfinite(distances)
+    if fallback.any():
+        distances[fallback] = karney(lat1[fallback], lon1[fallback], lat2[fallback], lon2[fallback])
+    return distances
+
+
+def karney(
+    lat1: np.ndarray,
+    lon1: np.ndarray,
+    lat2: np.ndarray,
+    lon2: np.ndarray
+) -> np.ndarray:
+    """
+    Ellipsoidal (WGS84) distance in meters using Karney's algorithm (the one used by geopy.distance.geodesic).
+    Exact but evaluated pair by pair, prefer `vincenty` for large arrays.
+    """
+    inverse = Geodesic.WGS84.Inverse
+    return np.array(
+        [inverse(a, b, c, d, Geodesic.DISTANCE)['s12'] for a, b, c, d in zip(lat1, lon1, lat2, lon2)],
+        dtype=np.float64
+    )
+
+
+def bearing(
+    lat1: np.ndarray,
+    lon1: np.ndarray,
+    lat2: np.ndarray,
+    lon2: np.ndarray
+) -> np.ndarray:
+    """
+    Initial bearing in degrees [0, 360) from the first to the second coordinates
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    dlon = lon2 - lon1
+    x = np.sin(dlon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return np.degrees(np.arctan2(x, y)) % 360
+
+
+def distance(
+    lat1: np.ndarray,
+    lon1: np.ndarray,
+    lat2: np.ndarray,
+    lon2: np.ndarray,
+    method: str = 'vincenty'
+) -> np.ndarray:
+    """
+    Distance in meters between arrays of coordinates with the selected method
+    """
+    if method not in METHODS:
+        raise ValueError(f'Unknown distance method {method!r}, expected one of {METHODS}')
+    return {'haversine': haversine, 'vincenty': vincenty, 'karney': karney}[method](lat1, lon1, lat2, lon2)
+
+
+@metrics.timed('kinematics.compute')
+def compute_kinematics(
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    timestamp: np.ndarray,
+    offsets: Sequence[int] = (0,),
+    method: str = 'vincenty'
+) -> Dict[str, np.ndarray]:
+    """
+    Compute time_diff (s), distance (m), speed (m/s), acceleration (m/s²) and bearing (degrees) between
+    consecutive points in one pass.
+    The arrays may hold several trajectories back to back, `offsets` gives the index of the first point of
+    each of them: these points get 0 for time_diff, distance, speed and acceleration, and NaN for bearing.
+    Points are expected to be sorted by timestamp within each trajectory.
+    """
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    timestamp = np.asarray(timestamp, dtype=np.float64)
+    n = len(timestamp)
+    metrics.count('kinematics.points', n)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts = np.zeros(n, dtype=bool)
+    starts[offsets[offsets < n]] = True
+
+    time_diff = np.zeros(n)
+    dist = np.zeros(n)
+    heading = np.full(n, np.nan)
+    if n > 1:
+        time_diff[1:] = np.diff(timestamp)
+        dist[1:] = distance(latitude[:-1], longitude[:-1], latitude[1:], longitude[1:], method=method)
+        heading[1:] = bearing(latitude[:-1], longitude[:-1], latitude[1:], longitude[1:])
+    return step_kinematics(time_diff, dist, heading, starts)
+
+
+def step_kinematics(
+    time_diff: np.ndarray,
+    dist: np.ndarray,
+    heading: np.ndarray,
+    starts: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """
+    Derive the speed and acceleration from the time differences and distances between consecutive points,
+    the first points of the trajectories (the starts mask) get 0 and a NaN bearing
+    """
+    time_diff[starts] = 0
+    dist[starts] = 0
+    heading[starts] = np.nan
+    n = len(time_diff)
+
+    moving = time_diff > 0
+    speed = np.zeros(n)
+    np.divide(dist, time_diff, out=speed, where=moving)
+    acceleration = np.zeros(n)
+    if n > 1:
+        np.divide(np.diff(speed), time_diff[1:], out=acceleration[1:], where=moving[1:])
+        acceleration[1:][starts[:-1]] = 0  # the speed of a first point is unknown
+    acceleration[starts] = 0
+    return {
+        'time_diff': time_diff,
+        'distance': dist,
+        'speed': speed,
+        'acceleration': acceleration,
+        'bearing': heading,
+    }
@@ -0,0 +1,118 @@
+from typing import Dict, List
+import os
+import numpy as np
+import pandas as pd
+
+from models.columns import NO_LABEL, encode_labels
+from utils.metrics import metrics
+
+LABELS_COLUMNS = ['start_datetime', 'end_datetime', 'label']
+# spacing between the timestamps of two users in the keys of `label_users`, larger than any timestamp
+USER_KEY_SPACING = 2.0 ** 32
+
+
+@metrics.timed('labels.read')
+def read_labels(user_path: str) -> pd.DataFrame:
+    """
+    Read the labels.txt file of a user's folder into a DataFrame with the start_datetime, end_datetime and label
+    columns, empty when the user has no labels
+    """
+    labels_file = os.path.join(user_path, 'labels.txt')
+    if not os.path.exists(labels_file):
+        return pd.DataFrame({
+            'start_datetime': pd.Series(dtype='datetime64[ns]'),
+            'end_datetime': pd.Series(dtype='datetime64[ns]'),
+            'label': pd.Series(dtype=object),
+        })
+    df_labels = pd.read_csv(labels_file, sep='\t', skiprows=1, names=LABELS_COLUMNS, dtype=str)
+    for column in ['start_datetime', 'end_datetime']:
+        df_labels[column] = pd.to_datetime(df_labels[column].str.strip(), format='%Y/%m/%d %H:%M:%S')
+    df_labels['label'] = df_labels['label'].str.strip()
+    return df_labels
+
+
+def to_seconds(values: pd.Series) -> np.ndarray:
+    return values.to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9
+
+
+@metrics.timed('labels.join')
+def label_points(
+    timestamp: np.ndarray,
+    start: np.ndarray,
+    end: np.ndarray,
+    codes: np.ndarray
+) -> np.ndarray:
+    """
+    Interval join: return the label code of the segment [start, end] containing each timestamp, NO_LABEL when none.
+    The segments are sorted by start and each point is matched to the latest segment starting before it with a
+    binary search, in O((points + segments) log segments). A point outside that segment but inside an earlier,
+    overlapping one is resolved by walking back over the segments.
+    """
+    timestamp = np.asarray(timestamp, dtype=np.float64)
+    metrics.count('labels.points', len(timestamp))
+    labels = np.full(len(timestamp), NO_LABEL, dtype=np.int8)
+    if len(start) == 0 or len(timestamp) == 0:
+        return labels
+    order = np.argsort(start, kind='stable')
+    start, end, codes = np.asarray(start)[order], np.asarray(end)[order], np.asarray(codes)[order]
+
+    index = np.searchsorted(start, timestamp, side='right') - 1
+    matched = index >= 0
+    covered = matched & (end[np.maximum(index, 0)] >= timestamp)
+    labels[covered] = codes[index[covered]]
+
+    # an earlier segment may still cover the point when the segments overlap
+    max_end = np.maximum.accumulate(end)
+    overlapped = np.flatnonzero(matched & ~covered & (max_end[np.maximum(index, 0)] >= timestamp))
+    for i in overlapped:
+        j = index[i] - 1
+        while end[j] < timestamp[i]:
+            j -= 1
+        labels[i] = codes[j]
+    return labels
+
+
+def label_users(
+    timestamp: np.ndarray,
+    point_users: np.ndarray,
+    labels: Dict[int, pd.DataFrame]
+) -> np.ndarray:
+    """
+    Label the points of many users in a single interval join.
+    `point_users` gives the user index of each point and `labels` the labels DataFrame of each user index;
+    the timestamps and segment bounds are shifted by user index so that the segments of a user only match
+    the points of the same user.
+    """
+    segments = [(user, df) for user, df in labels.items() if not df.empty]
+    if not segments:
+        return np.full(len(timestamp), NO_LABEL, dtype=np.int8)
+    shift = np.concatenate([np.full(len(df), user * USER_KEY_SPACING) for user, df in segments])
+    start = np.concatenate([to_seconds(df['start_datetime']) for _, df in segments]) + shift
+    end = np.concatenate([to_seconds(df['end_datetime']) for _, df in segments]) + shift
+    codes = np.concatenate([encode_labels(df['label']) for _, df in segments])
+    return label_points(np.asarray(timestamp) + np.asarray(point_users) * USER_KEY_SPACING, start, end, codes)
+
+
+def label_user_points(
+    timestamp: np.ndarray,
+    df_labels: pd.DataFrame
+) -> np.ndarray:
+    """
+    Label the points of one user from its labels DataFrame
+    """
+    return label_points(
+        timestamp,
+        to_seconds(df_labels['start_datetime']),
+        to_seconds(df_labels['end_datetime']),
+        encode_labels(df_labels['label'])
+    )
+
+
+def split_codes(
+    codes: np.ndarray,
+    counts: List[int]
+) -> List[np.ndarray]:
+    """
+    Split the codes of concatenated trajectories back into one array per trajectory
+    """
+    return np.split(codes, np.cumsum(counts)[:-1]) if counts else []
@@ -0,0 +1,202 @@
+"""
+In-process instrumentation of the pipeline and the dashboard: timing spans and counters.
+
+    from utils.metrics import metrics
+
+    with metrics.span('labels.join'):
+        ...
+    metrics.count('parse.points', len(columns))
+
+    @metrics.timed('figure.map')
+    def plot_map(...): ...
+
+A span records its duration under its name: the count, total and maximum since the start, and the p50/p90/p99
+over the last `window` durations. Spans and counters cost a flag check when the metrics are disabled
+(METRICS_ENABLED=0). The dashboard serves the snapshot of its process at `/metrics`; with METRICS_DUMP_PATH
+the snapshot is also written to that file when the process exits ('{pid}' in the path is replaced by the
+process ID, one file per server worker).
+"""
+from typing import Any, Callable, Dict
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import numpy as np
+
+
+class _NoSpan:
+    """
+    The span of disabled metrics, shared by all the calls
+    """
+
+    def __enter__(self) -> '_NoSpan':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics: 'Metrics', name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self) -> '_Span':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.metrics.count(f'{self.name}.errors')
+
+
+class _Timings:
+    """
+    Durations of a span: lifetime count, total and maximum, and a ring buffer of the recent durations
+    """
+    __slots__ = ('count', 'total', 'max', 'recent')
+
+    def __init__(self, window: int):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = np.empty(window)
+
+    def add(self, seconds: float) -> None:
+        self.recent[self.count % len(self.recent)] = seconds
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def summary(self) -> Dict[str, float]:
+        recent = self.recent[:min(self.count, len(self.recent))]
+        p50, p90, p99 = np.percentile(recent, [50, 90, 99]) if len(recent) else (np.nan,) * 3
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else float('nan'),
+            'max': self.max,
+            'p50': float(p50),
+            'p90': float(p90),
+            'p99': float(p99),
+        }
+
+
+class Metrics:
+    """
+    Registry of the timing spans and counters of a process.
+
+    Properties
+    ----------
+    enabled : bool
+        Whether spans and counters are recorded, they are no-ops otherwise.
+    Methods
+    -------
+    span(name: str) -> context manager
+        Time the block under name.
+    timed(name: str) -> decorator
+        Time each call of a function under name.
+    record(name: str, seconds: float) -> None
+        Add a duration measured elsewhere.
+    count(name: str, value: float = 1) -> None
+        Increment a counter.
+    snapshot() -> Dict
+        Return the spans (count, total, mean, max and percentiles in seconds) and the counters.
+    dump(file_path: str) -> None
+        Write the snapshot as JSON.
+    reset() -> None
+        Forget the spans and counters.
+    """
+
+    def __init__(self, enabled: bool = True, window: int = 2048):
+        self.enabled = enabled
+        self.window = window
+        self._spans: Dict[str, _Timings] = {}
+        self._counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._started = time.time()
+
+    def span(self, name: str):
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, name)
+
+    def timed(self, name: str) -> Callable:
+        def decorator(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs) -> Any:
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Span(self, name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, name: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            timings = self._spans.get(name)
+            if timings is None:
+                timings = self._spans[name] = _Timings(self.window)
+            timings.add(seconds)
+
+    def count(self, name: str, value: float = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'uptime': time.time() - self._started,
+                'spans': {name: timings.summary() for name, timings in sorted(self._spans.items())},
+                'counters': dict(sorted(self._counters.items())),
+            }
+
+    def dump(self, file_path: str) -> None:
+        """
+        Write the snapshot to file_path, '{pid}' being replaced by the process ID
+        """
+        file_path = file_path.replace('{pid}', str(os.getpid()))
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        with open(f'{file_path}.tmp', 'w') as f:
+            json.dump(self.snapshot(), f, indent=1)
+        os.replace(f'{file_path}.tmp', file_path)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+            self._started = time.time()
+
+
+def format_snapshot(snapshot: Dict) -> str:
+    """
+    Return the spans and counters of a snapshot as a text table, durations in milliseconds
+    """
+    lines = [f'{"span":<40} {"count":>8} {"total s":>10} {"mean ms":>10} {"p50 ms":>10} {"p90 ms":>10} {"p99 ms":>10} {"max ms":>10}']
+    for name, span in snapshot['spans'].items():
+        lines.append(
+            f'{name:<40} {span["count"]:>8} {span["total"]:>10.3f} '
+            + ' '.join(f'{span[key] * 1000:>10.2f}' for key in ('mean', 'p50', 'p90', 'p99', 'max'))
+        )
+    for name, value in snapshot['counters'].items():
+        lines.append(f'{name:<40} {value:>8.12g}')
+    return '\n'.join(lines)
+
+
+# the metrics of the process
+metrics = Metrics(enabled=os.getenv('METRICS_ENABLED', '1') == '1')
+if os.getenv('METRICS_DUMP_PATH'):
+    atexit.register(metrics.dump, os.getenv('METRICS_DUMP_PATH'))
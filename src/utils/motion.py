@@ -0,0 +1,162 @@
+from typing import Dict, Sequence, Tuple
+import numpy as np
+
+# thresholds of the transportation mode features of the GeoLife papers: heading change (degrees),
+# stop speed (m/s) and velocity change ratio
+HEADING_CHANGE_THRESHOLD = 19.0
+STOP_SPEED_THRESHOLD = 3.4
+VELOCITY_CHANGE_THRESHOLD = 0.26
+
+# columns of the segment feature matrix of `segment_features`
+MOTION_FEATURES = (
+    'distance', 'duration', 'mean_speed', 'speed_std',
+    'speed_top1', 'speed_top2', 'speed_top3',
+    'acceleration_top1', 'acceleration_top2', 'acceleration_top3',
+    'mean_abs_acceleration', 'mean_abs_jerk', 'mean_heading_change_rate',
+    'heading_change_rate', 'stop_rate', 'velocity_change_rate',
+)
+TOP_K = 3
+
+
+def point_positions(n: int, offsets: Sequence[int]) -> np.ndarray:
+    """
+    Return the position of each point within its trajectory, trajectory i holding the points offsets[i]:offsets[i + 1]
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    return np.arange(n) - np.repeat(offsets[:-1], np.diff(offsets))
+
+
+def point_features(
+    time_diff: np.ndarray,
+    distance: np.ndarray,
+    speed: np.ndarray,
+    acceleration: np.ndarray,
+    bearing: np.ndarray,
+    offsets: Sequence[int]
+) -> Dict[str, np.ndarray]:
+    """
+    Compute the per-point motion features of concatenated trajectories from their kinematics
+    (see `utils.kinematics.compute_kinematics`):
+    jerk (m/s³) is 0 on the first three points of a trajectory, where the acceleration is not known;
+    heading_change (degrees, in [0, 180]) and heading_change_rate (degrees/s) are NaN when one of the two steps
+    does not move; velocity_change is the relative speed change |v[i] - v[i-1]| / v[i-1], NaN after a stop.
+    """
+    n = len(time_diff)
+    position = point_positions(n, offsets)
+    jerk = np.zeros(n)
+    heading_change = np.full(n, np.nan)
+    velocity_change = np.full(n, np.nan)
+    heading_change_rate = np.full(n, np.nan)
+    if n > 1:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            np.divide(np.diff(acceleration), time_diff[1:], out=jerk[1:], where=(position[1:] >= 3) & (time_diff[1:] > 0))
+            turn = np.abs((np.diff(bearing) + 180) % 360 - 180)
+            moving = (distance[1:] > 0) & (distance[:-1] > 0) & (position[1:] >= 2)
+            heading_change[1:] = np.where(moving, turn, np.nan)
+            velocity_change[1:] = np.where((position[1:] >= 2) & (speed[:-1] > 0), np.abs(np.diff(speed)) / speed[:-1], np.nan)
+        np.divide(heading_change, time_diff, out=heading_change_rate, where=time_diff > 0)
+    return {
+        'jerk': jerk,
+        'heading_change': heading_change,
+        'heading_change_rate': heading_change_rate,
+        'velocity_change': velocity_change,
+    }
+
+
+def segment_offsets(label: np.ndarray, offsets: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split concatenated trajectories into segments of consecutive points with the same label code.
+    Return the offsets of the segments (segment k holds the points offsets[k]:offsets[k + 1]) and the
+    trajectory of each segment.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n = len(label)
+    starts = np.zeros(n, dtype=bool)
+    starts[offsets[:-1][np.diff(offsets) > 0]] = True
+    if n > 1:
+        starts[1:] |= label[1:] != label[:-1]
+    segment_starts = np.flatnonzero(starts)
+    trajectory = np.searchsorted(offsets, segment_starts, side='right') - 1
+    return np.append(segment_starts, n), trajectory
+
+
+def _top_k(values: np.ndarray, segment: np.ndarray, n_segments: int) -> np.ndarray:
+    """
+    Return the (n_segments, TOP_K) largest values of each segment, NaN when a segment has fewer values
+    """
+    top = np.full((n_segments, TOP_K), np.nan)
+    valid = ~np.isnan(values)
+    values, segment = values[valid], segment[valid]
+    order = np.lexsort((-values, segment))
+    segment = segment[order]
+    rank = np.arange(len(order)) - np.searchsorted(segment, segment, side='left')
+    keep = rank < TOP_K
+    top[segment[keep], rank[keep]] = values[order][keep]
+    return top
+
+
+def segment_features(
+    time_diff: np.ndarray,
+    distance: np.ndarray,
+    speed: np.ndarray,
+    acceleration: np.ndarray,
+    bearing: np.ndarray,
+    offsets: Sequence[int],
+    segments: Sequence[int],
+    heading_change_threshold: float = HEADING_CHANGE_THRESHOLD,
+    stop_speed_threshold: float = STOP_SPEED_THRESHOLD,
+    velocity_change_threshold: float = VELOCITY_CHANGE_THRESHOLD
+) -> np.ndarray:
+    """
+    Compute the float32 (segments, len(MOTION_FEATURES)) feature matrix of the segments of concatenated
+    trajectories, trajectory i holding the points offsets[i]:offsets[i + 1] and segment k the points
+    segments[k]:segments[k + 1] (see `segment_offsets`), with one reduceat per feature.
+
+    The distance and duration sum the steps reaching the points of the segment, the first point of a
+    trajectory has no step. The rates count the points turning by more than heading_change_threshold degrees,
+    slower than stop_speed_threshold m/s and changing speed by more than velocity_change_threshold, per kilometer.
+    """
+    segments = np.asarray(segments, dtype=np.int64)
+    n_segments = len(segments) - 1
+    matrix = np.full((n_segments, len(MOTION_FEATURES)), np.nan, dtype=np.float32)
+    if n_segments == 0:
+        return matrix
+    n = len(time_diff)
+    points = point_features(time_diff, distance, speed, acceleration, bearing, offsets)
+    # the first point of a trajectory has no step: no speed, acceleration or stop
+    step = point_positions(n, offsets) >= 1
+    counts = np.diff(segments)
+    segment = np.repeat(np.arange(n_segments), counts)
+    starts = segments[:-1]
+
+    def total(values: np.ndarray) -> np.ndarray:
+        return np.add.reduceat(np.asarray(values, dtype=np.float64), starts)
+
+    steps = total(step)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        length = total(distance)
+        duration = total(time_diff)
+        mean_step_speed = total(np.where(step, speed, 0)) / steps
+        speed_variance = total(np.where(step, speed ** 2, 0)) / steps - mean_step_speed ** 2
+        turned = points['heading_change'] > heading_change_threshold
+        kilometers = np.where(length > 0, length / 1000, np.nan)
+        columns = {
+            'distance': length,
+            'duration': duration,
+            'mean_speed': np.where(duration > 0, length / duration, np.nan),
+            'speed_std': np.sqrt(np.maximum(speed_variance, 0)),
+            'mean_abs_acceleration': total(np.where(step, np.abs(acceleration), 0)) / steps,
+            'mean_abs_jerk': total(np.abs(points['jerk'])) / steps,
+            'mean_heading_change_rate': total(np.nan_to_num(points['heading_change_rate'])) / total(~np.isnan(points['heading_change_rate'])),
+            'heading_change_rate': total(turned) / kilometers,
+            'stop_rate': total(step & (speed < stop_speed_threshold)) / kilometers,
+            'velocity_change_rate': total(points['velocity_change'] > velocity_change_threshold) / kilometers,
+        }
+    top_speed = _top_k(np.where(step, speed, np.nan), segment, n_segments)
+    top_acceleration = _top_k(np.where(step, np.abs(acceleration), np.nan), segment, n_segments)
+    for k in range(TOP_K):
+        columns[f'speed_top{k + 1}'] = top_speed[:, k]
+        columns[f'acceleration_top{k + 1}'] = top_acceleration[:, k]
+    for j, name in enumerate(MOTION_FEATURES):
+        matrix[:, j] = columns[name]
+    return matrix
@@ -1,15 +1,61 @@
-from typing import List
+from typing import List, Tuple
+import io
+import os
+import time
+import numpy as np
 import pandas as pd
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
 from typing import List
 
+from models.columns import TrajectoryColumns
 from models.record import Record
+from utils.metrics import metrics
+
+PLT_HEADER_LINES = 6
+# the 5th .plt column is the number of days since 1899-12-30, 25569 days before the unix epoch
+PLT_EPOCH_DAYS = 25569
+
+
+def list_users(data_path: str) -> List[str]:
+    """
+    Return the sorted IDs of the users of the `Data/` folder
+    """
+    return sorted(user for user in os.listdir(data_path) if os.path.isdir(os.path.join(data_path, user, 'Trajectory')))
+
+
+def list_plt_files(user_path: str) -> List[str]:
+    """
+    Return the sorted paths of the .plt files of a user's folder
+    """
+    trajectory_path = os.path.join(user_path, 'Trajectory')
+    return sorted(os.path.join(trajectory_path, file) for file in os.listdir(trajectory_path) if file.endswith('.plt'))
+
+
+def list_tree_files(
+    data_path: str,
+    user_ids: List[str] = None
+) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Return the .plt file paths of the users of the `Data/` folder (all of them by default), with the user ID
+    and the trajectory ID of each file: the i-th file of a user gets the trajectory ID `{user_id}_{i}`
+    """
+    if user_ids is None:
+        user_ids = list_users(data_path)
+    file_paths, file_user_ids, trajectory_ids = [], [], []
+    for user_id in user_ids:
+        user_file_paths = list_plt_files(os.path.join(data_path, user_id))
+        file_paths += user_file_paths
+        file_user_ids += [user_id] * len(user_file_paths)
+        trajectory_ids += [f'{user_id}_{i}' for i in range(len(user_file_paths))]
+    return file_paths, file_user_ids, trajectory_ids
+
 
 class RecordParser(ABC):
     @abstractmethod
     def parse(
-        self, 
-        file_path: str, 
+        self,
+        file_path: str,
         user_id: str,
         trajectory_id: str
     ) -> List[Record]:
@@ -18,22 +64,198 @@ class RecordParser(ABC):
         """
         pass
 
+    def parse_columns(
+        self,
+        file_path: str
+    ) -> TrajectoryColumns:
+        """
+        Parse the file and return the columns of its points
+        """
+        return TrajectoryColumns.from_records(self.parse(file_path=file_path, user_id=None, trajectory_id=None))
+
 class PltRecordParser(RecordParser):
+    plt_files_columns = ['latitude', 'longitude', 'zero', 'altitude', 'days', 'date', 'time']
+
+    @metrics.timed('parse.plt_file')
+    def read(
+        self,
+        file_path: str
+    ) -> pd.DataFrame:
+        """
+        Read a .plt file into a DataFrame with the latitude, longitude, altitude, datetime and timestamp columns
+        """
+        df = pd.read_csv(file_path, skiprows=6, header=None, names=self.plt_files_columns)
+        df.drop(columns=['zero', 'days'], inplace=True)
+        df['datetime'] = pd.to_datetime(df['date'] + ' ' + df['time'])
+        df['timestamp'] = df['datetime'].to_numpy(dtype='datetime64[ns]').astype('int64') / 1e9
+        df.drop(columns=['date', 'time'], inplace=True)
+        return df
+
     def parse(
-        self, 
-        file_path: str, 
+        self,
+        file_path: str,
         user_id: str,
         trajectory_id: str
     ) -> List[Record]:
         """
         Parse a .plt file and return a list of Record objects
         """
-        plt_files_columns = ['latitude', 'longitude', 'zero', 'altitude', 'days', 'date', 'time']
-        df = pd.read_csv(file_path, skiprows=6, header=None, names=plt_files_columns)
-        df.drop(columns=['zero', 'days'], inplace=True)
-        df['datetime'] = pd.to_datetime(df['date'] + ' ' + df['time'])
-        df['timestamp'] = df['datetime'].apply(lambda x: x.timestamp())
-        df.drop(columns=['date', 'time'], inplace=True)
+        df = self.read(file_path)
         df['user_id'] = user_id
         df['trajectory_id'] = trajectory_id
         return [Record(**record) for record in df.to_dict(orient='records')]
+
+    def parse_columns(
+        self,
+        file_path: str
+    ) -> TrajectoryColumns:
+        """
+        Parse a .plt file and return the columns of its points, without creating Record objects
+        """
+        return TrajectoryColumns.from_frame(self.read(file_path))
+
+
+@dataclass
+class PltBatch:
+    """
+    The points of many .plt files parsed at once, stored back to back in a single TrajectoryColumns.
+    The points of the i-th file are `columns[offsets[i]:offsets[i + 1]]`.
+    """
+
+    user_ids: List[str]
+    trajectory_ids: List[str]
+    file_paths: List[str]
+    offsets: np.ndarray
+    columns: TrajectoryColumns
+
+    def __len__(self) -> int:
+        return len(self.file_paths)
+
+    def trajectory_columns(self, i: int) -> TrajectoryColumns:
+        """
+        Return the columns of the i-th file, as views on the batch arrays
+        """
+        return self.columns[self.offsets[i]:self.offsets[i + 1]]
+
+    @classmethod
+    def concatenate(cls, batches: List['PltBatch']) -> 'PltBatch':
+        """
+        Concatenate several batches in order
+        """
+        counts = np.concatenate([np.diff(batch.offsets) for batch in batches]) if batches else np.array([], dtype=np.int64)
+        return cls(
+            user_ids=[user_id for batch in batches for user_id in batch.user_ids],
+            trajectory_ids=[trajectory_id for batch in batches for trajectory_id in batch.trajectory_ids],
+            file_paths=[file_path for batch in batches for file_path in batch.file_paths],
+            offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            columns=TrajectoryColumns.concatenate([batch.columns for batch in batches]) if batches else PltBulkParser.empty_columns(),
+        )
+
+
+class PltBulkParser:
+    """
+    Parse many .plt files in one `pd.read_csv` call, straight into columns.
+    The timestamps come from the day-number column, without parsing the date and time strings,
+    and no Record object is created.
+    The parser accumulates the number of files, points and seconds spent, see `points_per_second`.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.points = 0
+        self.seconds = 0.0
+
+    @property
+    def points_per_second(self) -> float:
+        return self.points / self.seconds if self.seconds else 0.0
+
+    @staticmethod
+    def empty_columns() -> TrajectoryColumns:
+        return TrajectoryColumns(*(np.array([], dtype=np.float64) for _ in range(4)))
+
+    @staticmethod
+    def read_body(file_path: str) -> bytes:
+        """
+        Return the data lines of a .plt file, without the header and with a single trailing newline
+        """
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        position = 0
+        for _ in range(PLT_HEADER_LINES):
+            position = data.find(b'\n', position) + 1
+            if position == 0:
+                return b''
+        body = data[position:].rstrip()
+        return body + b'\n' if body else b''
+
+    @metrics.timed('parse.plt_files')
+    def parse_files(
+        self,
+        file_paths: List[str],
+        user_ids: List[str],
+        trajectory_ids: List[str]
+    ) -> PltBatch:
+        """
+        Parse .plt files into a single PltBatch
+        """
+        start = time.perf_counter()
+        bodies = [self.read_body(file_path) for file_path in file_paths]
+        counts = np.array([body.count(b'\n') for body in bodies], dtype=np.int64)
+        buffer = b''.join(bodies)
+        if buffer:
+            df = pd.read_csv(
+                io.BytesIO(buffer),
+                header=None,
+                usecols=[0, 1, 3, 4],
+                names=['latitude', 'longitude', 'altitude', 'days'],
+                dtype=np.float64,
+                skip_blank_lines=False,
+            )
+            if len(df) != counts.sum():
+                raise ValueError(f'Parsed {len(df)} points from {len(file_paths)} .plt files, expected {counts.sum()}')
+            columns = TrajectoryColumns(
+                latitude=df['latitude'].to_numpy(),
+                longitude=df['longitude'].to_numpy(),
+                altitude=df['altitude'].to_numpy(),
+                timestamp=np.round((df['days'].to_numpy() - PLT_EPOCH_DAYS) * 86400),
+            )
+        else:
+            columns = self.empty_columns()
+        self.files += len(file_paths)
+        self.points += len(columns)
+        metrics.count('parse.files', len(file_paths))
+        metrics.count('parse.points', len(columns))
+        self.seconds += time.perf_counter() - start
+        return PltBatch(
+            user_ids=list(user_ids),
+            trajectory_ids=list(trajectory_ids),
+            file_paths=list(file_paths),
+            offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            columns=columns,
+        )
+
+    def parse_user(
+        self,
+        user_path: str,
+        user_id: str
+    ) -> PltBatch:
+        """
+        Parse all the .plt files of a user's folder, the i-th file gets the trajectory ID `{user_id}_{i}`
+        """
+        file_paths = list_plt_files(user_path)
+        return self.parse_files(
+            file_paths=file_paths,
+            user_ids=[user_id] * len(file_paths),
+            trajectory_ids=[f'{user_id}_{i}' for i in range(len(file_paths))],
+        )
+
+    def parse_tree(
+        self,
+        data_path: str,
+        user_ids: List[str] = None
+    ) -> PltBatch:
+        """
+        Parse the .plt files of all the users of the `Data/` folder (or of the given user_ids) into a single PltBatch
+        """
+        file_paths, batch_user_ids, trajectory_ids = list_tree_files(data_path, user_ids)
+        return self.parse_files(file_paths=file_paths, user_ids=batch_user_ids, trajectory_ids=trajectory_ids)
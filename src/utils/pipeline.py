@@ -0,0 +1,305 @@
+"""
+Bounded-memory ingestion of the whole GeoLife `Data/` tree into a DatasetStore.
+
+The points flow through generator stages, one chunk of .plt files of a user at a time:
+
+    plan -> parse -> kinematics -> labels -> summaries -> write
+
+A chunk holds the files of a user that fit in the memory limit (a single file larger than the limit is a
+chunk of its own, a trajectory is never split). The writer streams the chunks of a user to its partition and
+the totals of the users and of the dataset are accumulated from the summaries of the chunks, so the peak
+memory depends on the limit and not on the size of the dataset. The partitions hold the same arrays and
+manifest as `utils.ingest`, which can update them incrementally afterwards.
+
+Run from `src/`:
+    python -m utils.pipeline --data-path /path/to/Data --store-path data/store --memory-limit 256
+"""
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+from models.columns import LABELS, NO_LABEL
+from models.summary import TrajectorySummaries
+from utils.ingest import file_signature
+from utils.kinematics import compute_kinematics
+from utils.labels import label_user_points, read_labels
+from utils.metrics import format_snapshot, metrics
+from utils.parsers import PltBatch, PltBulkParser, list_plt_files, list_users
+from utils.simplify import douglas_peucker_significance
+from utils.store import DatasetStore
+
+# average size of a .plt line, to estimate the points of a file from its size
+PLT_LINE_BYTES = 60
+# memory of a point while it goes through the stages: the raw lines, the parsed frame, the columns with the
+# kinematics and the temporaries of the kinematics and of the level of detail
+POINT_BYTES = 600
+MEMORY_LIMIT = 256 * 2 ** 20
+
+
+@dataclass
+class PipelineChunk:
+    """
+    Trajectories of a user going through the pipeline stages.
+    Attributes
+    ----------
+    user_id : str
+        The user of all the trajectories.
+    batch : PltBatch
+        The parsed files, their columns filled by the stages.
+    first, last : bool
+        Whether the chunk is the first or the last one of the user.
+    summaries : TrajectorySummaries
+        Summary statistics of the trajectories, None until the summaries stage.
+    """
+
+    user_id: str
+    batch: PltBatch
+    first: bool
+    last: bool
+    summaries: TrajectorySummaries = None
+
+
+@dataclass
+class ChunkPlan:
+    """
+    Files of a user to parse as one chunk, see `plan_chunks`
+    """
+
+    user_id: str
+    file_paths: List[str]
+    trajectory_ids: List[str]
+    first: bool
+    last: bool
+
+
+def plan_chunks(
+    data_path: str,
+    user_ids: List[str],
+    max_points: int
+) -> Iterator[ChunkPlan]:
+    """
+    Yield the files of the users in consecutive groups of about max_points points, estimated from the file sizes.
+    A user yields at least one (possibly empty) group so that its partition is written.
+    """
+    for user_id in user_ids:
+        file_paths = list_plt_files(os.path.join(data_path, user_id))
+        points = [os.path.getsize(file_path) // PLT_LINE_BYTES for file_path in file_paths]
+        bounds = [0]
+        total = 0
+        for i, count in enumerate(points):
+            if total and total + count > max_points:
+                bounds.append(i)
+                total = 0
+            total += count
+        bounds.append(len(file_paths))
+        for j, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            yield ChunkPlan(
+                user_id=user_id,
+                file_paths=file_paths[start:end],
+                trajectory_ids=[f'{user_id}_{i}' for i in range(start, end)],
+                first=j == 0,
+                last=j == len(bounds) - 2,
+            )
+
+
+def parse_stage(plans: Iterable[ChunkPlan]) -> Iterator[PipelineChunk]:
+    """
+    Parse the files of each chunk, the points of each trajectory sorted by timestamp like `Trajectory` does
+    """
+    parser = PltBulkParser()
+    for plan in plans:
+        batch = parser.parse_files(plan.file_paths, [plan.user_id] * len(plan.file_paths), plan.trajectory_ids)
+        trajectory_index = np.repeat(np.arange(len(batch)), np.diff(batch.offsets))
+        unsorted = np.diff(batch.columns.timestamp) < 0
+        if np.any(unsorted & (trajectory_index[1:] == trajectory_index[:-1])):
+            batch.columns = batch.columns[np.lexsort((batch.columns.timestamp, trajectory_index))]
+        yield PipelineChunk(user_id=plan.user_id, batch=batch, first=plan.first, last=plan.last)
+
+
+def kinematics_stage(chunks: Iterable[PipelineChunk], method: str = 'vincenty') -> Iterator[PipelineChunk]:
+    """
+    Compute the kinematics and the level of detail of the trajectories of each chunk
+    """
+    for chunk in chunks:
+        columns, offsets = chunk.batch.columns, chunk.batch.offsets
+        for name, values in compute_kinematics(columns.latitude, columns.longitude, columns.timestamp, offsets=offsets[:-1], method=method).items():
+            setattr(columns, name, values)
+        with metrics.span('lod.compute'):
+            columns.significance = np.concatenate([np.empty(0)] + [
+                douglas_peucker_significance(columns.latitude[start:end], columns.longitude[start:end])
+                for start, end in zip(offsets[:-1], offsets[1:])
+            ])
+        yield chunk
+
+
+def labels_stage(chunks: Iterable[PipelineChunk], data_path: str) -> Iterator[PipelineChunk]:
+    """
+    Label the points of each chunk, the labels.txt of a user being read once for all its chunks
+    """
+    df_labels = None
+    for chunk in chunks:
+        if chunk.first:
+            df_labels = read_labels(os.path.join(data_path, chunk.user_id))
+        columns = chunk.batch.columns
+        columns.label = (
+            np.full(len(columns), NO_LABEL, dtype=np.int8) if df_labels.empty
+            else label_user_points(columns.timestamp, df_labels)
+        )
+        yield chunk
+
+
+def summaries_stage(chunks: Iterable[PipelineChunk]) -> Iterator[PipelineChunk]:
+    for chunk in chunks:
+        batch = chunk.batch
+        chunk.summaries = TrajectorySummaries.from_columns(batch.columns, batch.offsets, batch.trajectory_ids, batch.user_ids)
+        yield chunk
+
+
+def write_stage(
+    chunks: Iterable[PipelineChunk],
+    store: DatasetStore,
+    data_path: str
+) -> Iterator[PipelineChunk]:
+    """
+    Append the chunks of each user to its partition, published with the ingest manifest after its last chunk
+    """
+    writer, sources = None, []
+    for chunk in chunks:
+        if chunk.first:
+            writer, sources = store.open_writer(chunk.user_id), []
+        batch = chunk.batch
+        with metrics.span('store.append'):
+            writer.append(batch.columns, batch.offsets, batch.trajectory_ids, summaries=chunk.summaries)
+        sources += [
+            {'path': os.path.relpath(file_path, data_path), **file_signature(file_path)}
+            for file_path in batch.file_paths
+        ]
+        if chunk.last:
+            labels_path = os.path.join(data_path, chunk.user_id, 'labels.txt')
+            labels = file_signature(labels_path) if os.path.exists(labels_path) else None
+            writer.close({'manifest': {'sources': sources, 'labels': labels}})
+            writer = None
+        yield chunk
+    if writer is not None:
+        writer.abort()
+
+
+class PipelineTotals:
+    """
+    Totals of the users and of the dataset, accumulated chunk by chunk from the trajectory summaries.
+    Methods
+    -------
+    update(summaries: TrajectorySummaries) -> None
+        Add the trajectories of a chunk.
+    users() -> pd.DataFrame
+        Return one row per user: trajectories, points, first and last timestamps, distance, duration,
+        mean speed, maximum speed and one point count per label.
+    dataset() -> Dict
+        Return the totals over all the users.
+    """
+
+    def __init__(self):
+        self._users: Dict[str, Dict] = {}
+
+    def update(self, summaries: TrajectorySummaries) -> None:
+        for user_id in np.unique(summaries.user_id):
+            selected = summaries[summaries.user_id == user_id]
+            totals = self._users.setdefault(user_id, {
+                'trajectories': 0, 'points': 0, 'start_timestamp': np.inf, 'end_timestamp': -np.inf,
+                'distance': 0.0, 'duration': 0.0, 'max_speed': 0.0,
+                'label_counts': np.zeros(len(LABELS) + 1, dtype=np.int64),
+            })
+            totals['trajectories'] += len(selected)
+            totals['points'] += int(selected.count.sum())
+            totals['start_timestamp'] = min(totals['start_timestamp'], np.nanmin(selected.start_timestamp, initial=np.inf))
+            totals['end_timestamp'] = max(totals['end_timestamp'], np.nanmax(selected.end_timestamp, initial=-np.inf))
+            totals['distance'] += float(np.nansum(selected.total_distance))
+            totals['duration'] += float(np.nansum(selected.duration))
+            totals['max_speed'] = max(totals['max_speed'], float(np.nanmax(selected.max_speed, initial=0.0)))
+            totals['label_counts'] += selected.label_counts.sum(axis=0)
+
+    def users(self) -> pd.DataFrame:
+        df = pd.DataFrame.from_dict(
+            {user_id: {k: v for k, v in totals.items() if k != 'label_counts'} for user_id, totals in self._users.items()},
+            orient='index',
+        )
+        if df.empty:
+            return df
+        df.index.name = 'user_id'
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df['mean_speed'] = df['distance'] / df['duration']
+        for column in ('start_timestamp', 'end_timestamp'):
+            df[column.replace('timestamp', 'datetime')] = pd.to_datetime(df.pop(column).replace([np.inf, -np.inf], np.nan), unit='s')
+        counts = np.array([totals['label_counts'] for totals in self._users.values()])
+        for i, label in enumerate(LABELS + ('unlabelled',)):
+            df[f'{label}_points'] = counts[:, i]
+        return df.sort_index()
+
+    def dataset(self) -> Dict:
+        users = self._users.values()
+        distance = sum(totals['distance'] for totals in users)
+        duration = sum(totals['duration'] for totals in users)
+        label_counts = sum((totals['label_counts'] for totals in users), np.zeros(len(LABELS) + 1, dtype=np.int64))
+        return {
+            'users': len(self._users),
+            'trajectories': sum(totals['trajectories'] for totals in users),
+            'points': sum(totals['points'] for totals in users),
+            'labelled_points': int(label_counts[:len(LABELS)].sum()),
+            'distance_km': distance / 1000,
+            'duration_hours': duration / 3600,
+            'mean_speed': distance / duration if duration else float('nan'),
+        }
+
+
+def run_pipeline(
+    data_path: str,
+    store_path: str,
+    user_ids: List[str] = None,
+    memory_limit: int = MEMORY_LIMIT,
+    method: str = 'vincenty'
+) -> PipelineTotals:
+    """
+    Ingest the users of the `Data/` folder (all of them by default) into the DatasetStore at store_path,
+    with about memory_limit bytes of points in flight, and return their totals
+    """
+    store = DatasetStore(store_path)
+    user_ids = list_users(data_path) if user_ids is None else user_ids
+    chunks = plan_chunks(data_path, user_ids, max_points=max(memory_limit // POINT_BYTES, 1))
+    chunks = parse_stage(chunks)
+    chunks = kinematics_stage(chunks, method=method)
+    chunks = labels_stage(chunks, data_path)
+    chunks = summaries_stage(chunks)
+    chunks = write_stage(chunks, store, data_path)
+    totals = PipelineTotals()
+    for chunk in chunks:
+        totals.update(chunk.summaries)
+        metrics.count('pipeline.chunks')
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-path', default=os.getenv('DATA_PATH'))
+    parser.add_argument('--store-path', default=os.getenv('STORE_PATH'))
+    parser.add_argument('--user-ids', nargs='*', default=None)
+    parser.add_argument('--memory-limit', type=float, default=MEMORY_LIMIT / 2 ** 20, help='MiB of points in flight')
+    parser.add_argument('--users-csv', default=None, help='write the totals of the users to a CSV file')
+    parser.add_argument('--metrics', nargs='?', const='-', default=None,
+                        help='print the timings of the stages, or write them to a JSON file')
+    args = parser.parse_args()
+    totals = run_pipeline(args.data_path, args.store_path, args.user_ids, memory_limit=int(args.memory_limit * 2 ** 20))
+    for key, value in totals.dataset().items():
+        print(f'{key:>16}: {value:,.1f}' if isinstance(value, float) else f'{key:>16}: {value:,}')
+    if args.users_csv:
+        totals.users().to_csv(args.users_csv)
+    if args.metrics == '-':
+        print(format_snapshot(metrics.snapshot()))
+    elif args.metrics:
+        metrics.dump(args.metrics)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Similarity search between trajectories with the discrete Fréchet distance or dynamic time warping (DTW).
+
+The curves are (n, 2) arrays of local meters (`utils.simplify.local_xy` around the latitude of the query), the
+ground distance is the euclidean distance between their points. The k nearest curves are found without
+computing most of the distances:
+- lower bounds from the first and last points and the bounding box of each candidate, for all of them at once:
+  both distances match the first points together and the last points together, and every point of the query
+  with some point of the candidate, at least as far as the bounding box of the candidate (the envelope of
+  LB_Keogh without warping window);
+- exact distances in increasing order of lower bound, by batches of candidates, until the next lower bound
+  exceeds the k-th distance found; the dynamic programs run along the anti-diagonals for a whole batch and
+  abandon the candidates with two consecutive diagonals entirely above the k-th distance.
+"""
+from typing import Callable, List, Sequence, Tuple
+import numpy as np
+
+from utils.metrics import metrics
+
+MEASURES = ('frechet', 'dtw')
+# points of the query compared to the bounding boxes of the candidates
+ENVELOPE_POINTS = 64
+# candidates of a batch of exact distances
+BATCH_SIZE = 32
+
+
+def _check_measure(measure: str) -> None:
+    if measure not in MEASURES:
+        raise ValueError(f'Unknown similarity measure {measure!r}, expected one of {MEASURES}')
+
+
+def box_distance(points: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """
+    Return the (len(boxes), len(points)) distances of the points to the boxes (min_x, min_y, max_x, max_y),
+    0 inside a box
+    """
+    x, y = points[None, :, 0], points[None, :, 1]
+    dx = np.maximum(np.maximum(boxes[:, 0, None] - x, x - boxes[:, 2, None]), 0)
+    dy = np.maximum(np.maximum(boxes[:, 1, None] - y, y - boxes[:, 3, None]), 0)
+    return np.hypot(dx, dy)
+
+
+def lower_bounds(
+    query: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    boxes: np.ndarray,
+    counts: np.ndarray,
+    measure: str = 'frechet'
+) -> np.ndarray:
+    """
+    Return lower bounds of the distances between the query curve and candidates known by their first and last
+    points (n, 2), bounding boxes (n, 4) and numbers of points
+    """
+    _check_measure(measure)
+    first = np.hypot(*(starts - query[0]).T)
+    last = np.hypot(*(ends - query[-1]).T)
+    # interior points of the query, each matched at least once, on distinct cells of the warping path
+    interior = query[1:-1]
+    if len(interior) > ENVELOPE_POINTS:
+        interior = interior[np.linspace(0, len(interior) - 1, ENVELOPE_POINTS).astype(np.int64)]
+    envelope = box_distance(interior, boxes)
+    if measure == 'frechet':
+        return np.maximum(np.maximum(first, last), envelope.max(axis=1, initial=0))
+    # a single cell when the query and the candidate have one point each
+    last = np.where((len(query) > 1) | (np.asarray(counts) > 1), last, 0)
+    return first + last + envelope.sum(axis=1)
+
+
+def curve_distances(
+    query: np.ndarray,
+    curves: Sequence[np.ndarray],
+    measure: str = 'frechet',
+    threshold: float = np.inf
+) -> np.ndarray:
+    """
+    Return the distances between the query curve and each of the curves, computed together along the
+    anti-diagonals of their dynamic programs. The distances above the threshold are returned as inf, their
+    computation stops at the first two consecutive diagonals above it (a diagonal step skips a diagonal).
+    """
+    _check_measure(measure)
+    m = len(query)
+    lengths = np.array([len(curve) for curve in curves], dtype=np.int64)
+    distances = np.full(len(curves), np.inf)
+    if m == 0 or len(curves) == 0:
+        return distances
+    # the curves are padded with NaN points, infinitely far
+    padded = np.full((len(curves), lengths.max(initial=1), 2), np.nan)
+    for b, curve in enumerate(curves):
+        padded[b, :len(curve)] = curve
+    alive = lengths > 0
+    previous_min = np.zeros(len(curves))
+    previous = np.full((len(curves), m), np.inf)
+    before = np.full((len(curves), m), np.inf)
+    for k in range(m + padded.shape[1] - 1):
+        i = np.arange(max(0, k - padded.shape[1] + 1), min(m - 1, k) + 1)
+        cost = np.hypot(*(padded[:, k - i] - query[i]).transpose(2, 0, 1))
+        cost[np.isnan(cost)] = np.inf
+        if k == 0:
+            best = np.zeros_like(cost)
+        else:
+            up = np.where(i > 0, previous[:, i - 1], np.inf)
+            left = previous[:, i]
+            diagonal = np.where(i > 0, before[:, i - 1], np.inf)
+            best = np.minimum(np.minimum(up, left), diagonal)
+        current = np.full((len(curves), m), np.inf)
+        current[:, i] = np.maximum(cost, best) if measure == 'frechet' else cost + best
+        # the curves whose last cell is on this diagonal
+        done = alive & (lengths - 1 + m - 1 == k)
+        distances[done] = current[done, m - 1]
+        current_min = current[:, i].min(axis=1)
+        alive &= ~done & (np.minimum(current_min, previous_min) <= threshold)
+        previous_min = current_min
+        if not alive.any():
+            break
+        before, previous = previous, current
+    distances[distances > threshold] = np.inf
+    return distances
+
+
+def nearest(
+    query: np.ndarray,
+    bounds: np.ndarray,
+    curves: Callable[[np.ndarray], List[np.ndarray]],
+    k: int = 10,
+    measure: str = 'frechet',
+    max_distance: float = None,
+    batch_size: int = BATCH_SIZE
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the indices of the k candidates nearest to the query curve and their distances, sorted by distance.
+    bounds holds a lower bound of the distance of each candidate and curves(indices) returns their curves, it
+    is only called for the candidates whose lower bound is below the k-th distance found (and max_distance).
+    The first batch holds the k lowest bounds, to find a k-th distance before the larger batches.
+    """
+    order = np.argsort(bounds, kind='stable')
+    if max_distance is not None:
+        order = order[bounds[order] <= max_distance]
+    found = np.empty(0, dtype=np.int64)
+    distances = np.empty(0)
+    threshold = np.inf if max_distance is None else max_distance
+    computed = 0
+    start = 0
+    while start < len(order):
+        size = min(k, batch_size) if start == 0 else batch_size
+        batch = order[start:start + size]
+        start += size
+        if len(found) >= k:
+            threshold = min(threshold, distances[k - 1])
+        batch = batch[bounds[batch] <= threshold]
+        if len(batch) == 0:
+            break
+        batch_distances = curve_distances(query, curves(batch), measure=measure, threshold=threshold)
+        computed += len(batch)
+        kept = np.isfinite(batch_distances)
+        found = np.concatenate([found, batch[kept]])
+        distances = np.concatenate([distances, batch_distances[kept]])
+        ranking = np.argsort(distances, kind='stable')[:k]
+        found, distances = found[ranking], distances[ranking]
+    metrics.count('similarity.candidates', len(bounds))
+    metrics.count('similarity.exact', computed)
+    return found, distances
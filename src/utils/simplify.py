@@ -0,0 +1,150 @@
+from typing import List
+import numpy as np
+
+# meters per pixel at zoom 0 on the equator, for 256 px web mercator tiles
+METERS_PER_PIXEL_ZOOM_0 = 156543.03392
+
+
+def local_xy(latitude: np.ndarray, longitude: np.ndarray, reference_latitude: float = None) -> np.ndarray:
+    """
+    Project coordinates to local equirectangular meters around their mean latitude, or a reference latitude
+    shared by several projections
+    """
+    latitude, longitude = np.asarray(latitude, dtype=np.float64), np.asarray(longitude, dtype=np.float64)
+    if len(latitude) == 0:
+        return np.empty((0, 2))
+    scale = np.cos(np.radians(latitude.mean() if reference_latitude is None else reference_latitude))
+    return np.column_stack([longitude * 111320.0 * scale, latitude * 110540.0])
+
+
+def douglas_peucker_significance(
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    min_tolerance: float = 0.5
+) -> np.ndarray:
+    """
+    Return, for each point, the largest Douglas-Peucker tolerance in meters at which it is kept:
+    `significance >= tolerance` selects the simplified line for any tolerance, so a single array holds
+    every level of detail. The end points are always kept (infinite significance).
+    All the segments of a recursion level are split at once with vectorized operations; segments whose
+    farthest point is closer than min_tolerance are not split further, their points get significance 0.
+    """
+    n = len(latitude)
+    significance = np.zeros(n)
+    if n == 0:
+        return significance
+    significance[[0, -1]] = np.inf
+    if n < 3:
+        return significance
+    xy = local_xy(latitude, longitude)
+    kept = np.zeros(n, dtype=bool)
+    kept[[0, -1]] = True
+    active = ~kept
+    while active.any():
+        anchors = np.flatnonzero(kept)
+        segment = np.cumsum(kept) - 1
+        points = np.flatnonzero(active)
+        left, right = anchors[segment[points]], anchors[segment[points] + 1]
+        a, b, p = xy[left], xy[right], xy[points]
+        ab = b - a
+        length2 = np.einsum('ij,ij->i', ab, ab)
+        t = np.clip(np.einsum('ij,ij->i', p - a, ab) / np.where(length2 > 0, length2, 1), 0, 1)
+        distance = np.hypot(*(p - a - t[:, None] * ab).T)
+
+        # farthest point of each segment, the active points of a segment are contiguous
+        starts = np.flatnonzero(np.diff(segment[points], prepend=-1))
+        farthest = np.maximum.reduceat(distance, starts)
+        group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(points))))
+        is_max = distance == farthest[group]
+        first_max = np.flatnonzero(is_max & ~np.r_[False, is_max[:-1] & (group[1:] == group[:-1])])
+        splits = first_max[farthest[group[first_max]] >= min_tolerance]
+
+        # a point is never more significant than the anchors of its segment
+        significance[points[splits]] = np.minimum(
+            distance[splits], np.minimum(significance[left[splits]], significance[right[splits]])
+        )
+        kept[points[splits]] = True
+        done = farthest[group] < min_tolerance
+        active[points[done]] = False
+        active[points[splits]] = False
+    return significance
+
+
+def tolerance_for_zoom(
+    zoom: float,
+    latitude: float,
+    pixels: float = 1.0
+) -> float:
+    """
+    Return the tolerance in meters matching `pixels` screen pixels at a web map zoom level
+    """
+    return pixels * METERS_PER_PIXEL_ZOOM_0 * np.cos(np.radians(latitude)) / 2 ** zoom
+
+
+def tolerance_for_budget(
+    significances: List[np.ndarray],
+    point_budget: int
+) -> float:
+    """
+    Return the smallest tolerance keeping at most point_budget points over all the significance arrays
+    """
+    significance = np.concatenate(significances) if significances else np.array([])
+    if len(significance) <= point_budget:
+        return 0.0
+    # the point_budget-th largest significance, ties above it are dropped with a tolerance just above
+    threshold = np.partition(significance, len(significance) - point_budget)[len(significance) - point_budget]
+    return float(np.nextafter(threshold, np.inf))
+
+
+def minmax_downsample(
+    y: np.ndarray,
+    n_buckets: int
+) -> np.ndarray:
+    """
+    Return the sorted indices of the first and last points and of the min and max of y in n_buckets buckets of
+    consecutive points, at most 2 * n_buckets + 2 points keeping the visual envelope of the series
+    """
+    n = len(y)
+    if n <= 2 * n_buckets + 2:
+        return np.arange(n)
+    size = int(np.ceil(n / n_buckets))
+    padded = np.full(size * n_buckets, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(n_buckets, size)
+    valid = ~np.all(np.isnan(padded), axis=1)
+    offsets = np.arange(n_buckets)[valid] * size
+    with np.errstate(invalid='ignore'):
+        filled = np.where(np.isnan(padded[valid]), np.inf, padded[valid])
+        lows = offsets + np.argmin(filled, axis=1)
+        filled = np.where(np.isnan(padded[valid]), -np.inf, padded[valid])
+        highs = offsets + np.argmax(filled, axis=1)
+    return np.unique(np.concatenate([[0, n - 1], lows, highs]))
+
+
+def lttb_downsample(
+    x: np.ndarray,
+    y: np.ndarray,
+    n_out: int
+) -> np.ndarray:
+    """
+    Return the sorted indices of n_out points chosen by Largest-Triangle-Three-Buckets
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    bounds = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    indices = np.zeros(n_out, dtype=np.int64)
+    indices[-1] = n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = bounds[i], bounds[i + 1]
+        next_start, next_end = bounds[i + 1], bounds[i + 2] if i + 2 < len(bounds) else n
+        next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(area)) if end > start else start
+        indices[i + 1] = previous
+    return np.unique(indices)
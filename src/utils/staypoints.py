@@ -0,0 +1,146 @@
+from typing import Sequence, Tuple
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+from utils.kinematics import EARTH_RADIUS, haversine
+
+# thresholds of the GeoLife stay point papers: 200 meters, 20 minutes
+DISTANCE_THRESHOLD = 200.0
+TIME_THRESHOLD = 20 * 60.0
+
+
+def detect_stays(
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    timestamp: np.ndarray,
+    offsets: Sequence[int],
+    distance_threshold: float = DISTANCE_THRESHOLD,
+    time_threshold: float = TIME_THRESHOLD,
+    window: int = 64
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Detect the stay points of concatenated trajectories, trajectory i holding the points offsets[i]:offsets[i + 1].
+
+    A stay starts at an anchor point i and covers the following points within distance_threshold meters of it,
+    up to the first point j beyond (the leaving point); it is kept when t[j] - t[i] >= time_threshold and the
+    next anchor is then j, otherwise the next anchor is i + 1. No stay is kept without a leaving point.
+    An anchor can only start a stay if the last point before t[i] + time_threshold is within the radius and a
+    point follows it, so the anchors advance from one such candidate to the next.
+    All the trajectories are scanned together: each step compares the current anchor of every trajectory with
+    its next `window` points in one (anchors, window) array.
+
+    Returns the trajectory index of each stay, and the first point and the leaving point of the stay, as indices
+    in the concatenated arrays.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts, ends = offsets[:-1], offsets[1:]
+    latitude, longitude = np.asarray(latitude), np.asarray(longitude)
+    timestamp = np.asarray(timestamp, dtype=np.float64)
+    n = len(timestamp)
+
+    # the first point at least time_threshold after each point, found with one binary search in times from the
+    # start of each trajectory shifted apart by more than the longest duration
+    lengths = ends - starts
+    position = np.repeat(np.arange(len(lengths)), lengths)
+    elapsed = timestamp - np.repeat(np.append(timestamp, 0.0)[starts], lengths)
+    span = (elapsed.max(initial=0) + time_threshold) * 2 + 1
+    keys = elapsed + position * span
+    # a margin keeps the test necessary despite rounding
+    later = np.searchsorted(keys, keys + time_threshold * (1 - 1e-9), side='left')
+    point_end = np.repeat(ends, lengths)
+    reachable = later < point_end
+    before = np.maximum(np.minimum(later, point_end) - 1, np.arange(n))
+    candidates = np.flatnonzero(reachable & (haversine(
+        latitude, longitude, latitude[before], longitude[before]
+    ) <= distance_threshold))
+
+    def next_candidate(points: np.ndarray) -> np.ndarray:
+        found = np.searchsorted(candidates, points, side='left')
+        return np.where(found < len(candidates), candidates[np.minimum(found, len(candidates) - 1)], n)
+
+    active = np.flatnonzero(lengths > 1)
+    anchor = next_candidate(starts[active]) if len(candidates) else np.full(len(active), n)
+    remaining = anchor < ends[active] - 1
+    active, anchor = active[remaining], anchor[remaining]
+    # number of points after the anchor already known to be within the radius
+    scanned = np.zeros(len(active), dtype=np.int64)
+    steps = np.arange(1, window + 1)
+
+    stays = []
+    while len(active):
+        end = ends[active]
+        index = anchor[:, None] + scanned[:, None] + steps[None, :]
+        valid = index < end[:, None]
+        index = np.minimum(index, end[:, None] - 1)
+        outside = valid & (haversine(
+            latitude[anchor, None], longitude[anchor, None], latitude[index], longitude[index]
+        ) > distance_threshold)
+        left = outside.any(axis=1)
+        done = left | ~valid[:, -1]
+
+        leave = anchor + scanned + 1 + np.argmax(outside, axis=1)
+        keep = left & (timestamp[np.minimum(leave, end - 1)] - timestamp[anchor] >= time_threshold)
+        stays.append(np.stack([active[keep], anchor[keep], leave[keep]]))
+
+        # a kept stay continues from its leaving point, the other anchors from the next candidate after them
+        anchor = np.where(done, next_candidate(np.where(keep, leave, anchor + 1)), anchor)
+        scanned = np.where(done, 0, scanned + window)
+        remaining = anchor < end - 1
+        active, anchor, scanned = active[remaining], anchor[remaining], scanned[remaining]
+
+    stays = np.concatenate(stays, axis=1) if stays else np.zeros((3, 0), dtype=np.int64)
+    order = np.argsort(stays[1], kind='stable')
+    return stays[0][order], stays[1][order], stays[2][order]
+
+
+def unit_vectors(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """
+    Return the (n, 3) positions on the unit sphere of coordinates in degrees
+    """
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def dbscan(
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    eps: float,
+    min_samples: int = 2,
+    timestamp: np.ndarray = None,
+    time_eps: float = None
+) -> np.ndarray:
+    """
+    Cluster points with DBSCAN, eps in meters, and return the cluster of each point, -1 for noise.
+
+    The neighbour pairs come from a kd-tree over the positions on the unit sphere (a great-circle distance of
+    eps is a chord of 2 sin(eps / 2R)), so the clustering holds anywhere on the earth. With timestamp and
+    time_eps, two points are neighbours only if they are also within time_eps seconds (ST-DBSCAN).
+    A point with at least min_samples neighbours, itself included, is a core point; the clusters are the
+    connected components of the core points, and the other points join the cluster of a core neighbour.
+    """
+    n = len(latitude)
+    labels = np.full(n, -1, dtype=np.int64)
+    if n == 0:
+        return labels
+    tree = cKDTree(unit_vectors(latitude, longitude))
+    pairs = tree.query_pairs(2 * np.sin(eps / (2 * EARTH_RADIUS)), output_type='ndarray')
+    if time_eps is not None and len(pairs):
+        pairs = pairs[np.abs(timestamp[pairs[:, 0]] - timestamp[pairs[:, 1]]) <= time_eps]
+    i, j = np.concatenate([pairs[:, 0], pairs[:, 1]]), np.concatenate([pairs[:, 1], pairs[:, 0]])
+    core = np.bincount(i, minlength=n) + 1 >= min_samples
+    if not core.any():
+        return labels
+
+    both = core[i] & core[j]
+    graph = coo_matrix((np.ones(both.sum(), dtype=np.int8), (i[both], j[both])), shape=(n, n))
+    _, components = connected_components(graph, directed=False)
+    # number the clusters of the core points 0, 1, ... in order of first point
+    _, first, inverse = np.unique(components[core], return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    labels[core] = rank[inverse]
+    border = ~core[i] & core[j]
+    labels[i[border]] = labels[j[border]]
+    return labels
@@ -0,0 +1,349 @@
+from dataclasses import fields
+from typing import BinaryIO, Dict, List, Sequence, Tuple
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+
+from models.columns import TrajectoryColumns
+from models.density import LEVELS, DensityGrid, build_levels
+from models.summary import TrajectorySummaries
+from models.trajectory import Trajectory
+from utils.metrics import metrics
+
+REQUIRED_COLUMNS = ('latitude', 'longitude', 'altitude', 'timestamp')
+
+
+class DatasetStore:
+    """
+    On-disk columnar dataset, partitioned by user:
+
+        <path>/users/<user_id>/trajectories.json   trajectory IDs, offsets of their points and summary statistics
+        <path>/users/<user_id>/<column>.npy        one array per TrajectoryColumns column
+        <path>/users/<user_id>/density.npz         density grids of the points at each level (`models.density`)
+
+    The arrays are opened with `np.load(mmap_mode='r')`: opening a user costs a few syscalls and
+    the pages of a column are only read from disk when a query touches them. The summary statistics of the
+    trajectories (`TrajectorySummaries`) are written with the partition, the features table and the indexes
+    of a user are built without reading its points. So are the density grids: the grid of the dataset is the
+    merge of the grids of the users, only the rewritten partitions are aggregated again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @property
+    def users_path(self) -> str:
+        return os.path.join(self.path, 'users')
+
+    @property
+    def user_ids(self) -> List[str]:
+        """
+        Return the sorted IDs of the users written in the store
+        """
+        if not os.path.isdir(self.users_path):
+            return []
+        return sorted(
+            user_id for user_id in os.listdir(self.users_path)
+            if os.path.exists(os.path.join(self.users_path, user_id, 'trajectories.json'))
+        )
+
+    def user_path(self, user_id: str) -> str:
+        return os.path.join(self.users_path, user_id)
+
+    @metrics.timed('store.write_user')
+    def write_user(
+        self,
+        user_id: str,
+        trajectories: List[Trajectory],
+        metadata: Dict = None
+    ) -> None:
+        """
+        Write (or replace) the partition of a user.
+        The partition is written in a temporary folder then renamed, readers never see a partial partition.
+        """
+        writer = self.open_writer(user_id)
+        if trajectories:
+            writer.append(
+                TrajectoryColumns.concatenate([trajectory.columns for trajectory in trajectories]),
+                np.cumsum([0] + [trajectory.count for trajectory in trajectories]),
+                [trajectory.trajectory_id for trajectory in trajectories],
+            )
+        writer.close(metadata)
+
+    def open_writer(self, user_id: str) -> 'PartitionWriter':
+        """
+        Return a writer replacing the partition of a user chunk by chunk, see `PartitionWriter`
+        """
+        return PartitionWriter(self, user_id)
+
+    def write(self, trajectories: List[Trajectory]) -> None:
+        """
+        Write the partitions of all the users of the trajectories
+        """
+        by_user = {}
+        for trajectory in trajectories:
+            by_user.setdefault(trajectory.user_id, []).append(trajectory)
+        for user_id, user_trajectories in by_user.items():
+            self.write_user(user_id, user_trajectories)
+
+    def version(self, user_ids: List[str] = None) -> str:
+        """
+        Return a version of the partitions of the users (all of them by default), which changes whenever one of
+        them is rewritten: the modification times of their metadata files, without reading them
+        """
+        mtimes = []
+        for user_id in self.user_ids if user_ids is None else user_ids:
+            try:
+                mtimes.append(os.stat(os.path.join(self.user_path(user_id), 'trajectories.json')).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return hashlib.sha1(json.dumps(mtimes).encode()).hexdigest()
+
+    def read_metadata(self, user_id: str) -> Dict:
+        with open(os.path.join(self.user_path(user_id), 'trajectories.json')) as f:
+            return json.load(f)
+
+    def update_metadata(
+        self,
+        user_id: str,
+        metadata: Dict
+    ) -> None:
+        """
+        Update the metadata of a user partition without rewriting its arrays
+        """
+        metadata_path = os.path.join(self.user_path(user_id), 'trajectories.json')
+        with open(f'{metadata_path}.tmp', 'w') as f:
+            json.dump({**self.read_metadata(user_id), **metadata}, f)
+        os.replace(f'{metadata_path}.tmp', metadata_path)
+
+    def read_summaries(self, user_ids: List[str] = None) -> TrajectorySummaries:
+        """
+        Return the summary statistics of the trajectories of the users (all of them by default) from the partition
+        metadata, the points are only read for the partitions written before the summaries
+        """
+        summaries = []
+        for user_id in self.user_ids if user_ids is None else user_ids:
+            metadata = self.read_metadata(user_id)
+            if metadata.get('summary'):
+                summaries.append(TrajectorySummaries.from_dict(metadata['summary']))
+            elif metadata['trajectory_ids']:
+                summaries.extend(trajectory.summary for trajectory in self.read_user(user_id))
+        return TrajectorySummaries.concatenate(summaries)
+
+    def read_columns(
+        self,
+        user_id: str,
+        columns: List[str] = None,
+        mmap: bool = True
+    ) -> Tuple[TrajectoryColumns, List[int], List[str]]:
+        """
+        Read the points of all the trajectories of a user as one TrajectoryColumns of memory-mapped arrays,
+        with the offsets of the trajectories (trajectory i holds the points offsets[i]:offsets[i + 1]) and their IDs.
+        `columns` restricts the optional columns (label, kinematics) that are opened, all of them by default.
+        The columns are None for a user without trajectories.
+        """
+        metadata = self.read_metadata(user_id)
+        if not metadata['trajectory_ids']:
+            return None, [0], []
+        return self._open_columns(user_id, columns, mmap), metadata['offsets'], metadata['trajectory_ids']
+
+    def _open_columns(self, user_id: str, columns: List[str], mmap: bool) -> TrajectoryColumns:
+        user_path = self.user_path(user_id)
+        names = [field.name for field in fields(TrajectoryColumns)]
+        if columns is not None:
+            names = [name for name in names if name in REQUIRED_COLUMNS or name in columns]
+        return TrajectoryColumns(**{
+            name: np.load(os.path.join(user_path, f'{name}.npy'), mmap_mode='r' if mmap else None)
+            for name in names
+            if os.path.exists(os.path.join(user_path, f'{name}.npy'))
+        })
+
+    def write_density(self, user_id: str, grids: Dict[float, DensityGrid]) -> None:
+        """
+        Write (or replace) the density grids of a user partition, one set of arrays per level
+        """
+        write_density(os.path.join(self.user_path(user_id), 'density.npz'), grids)
+
+    def build_density(self, user_id: str) -> Dict[float, DensityGrid]:
+        """
+        Aggregate the density grids of a user partition from its points
+        """
+        columns, offsets, _ = self.read_columns(user_id, columns=['label', 'speed'])
+        if columns is None:
+            return {cell_size: DensityGrid.merge([], cell_size) for cell_size in LEVELS}
+        return build_levels(columns, offsets)
+
+    def read_user_density(self, user_id: str, cell_size: float) -> DensityGrid:
+        """
+        Return the density grid of a user at a level. The grids of the partitions written before them are
+        aggregated from the points on each call, without writing them: the readers never write to the store,
+        the ingestion writes the missing grids (`utils.ingest`).
+        """
+        density_path = os.path.join(self.user_path(user_id), 'density.npz')
+        if not os.path.exists(density_path):
+            return self.build_density(user_id)[cell_size]
+        prefix = f'{cell_size:g}_'
+        with np.load(density_path) as data:
+            return DensityGrid.from_arrays({
+                name[len(prefix):]: data[name] for name in data.files if name.startswith(prefix)
+            })
+
+    @metrics.timed('store.read_density')
+    def read_density(
+        self,
+        cell_size: float,
+        user_ids: List[str] = None,
+        bbox: Tuple[float, float, float, float] = None
+    ) -> DensityGrid:
+        """
+        Return the density grid of the users (all of them by default) at a level, restricted to the cells
+        intersecting the bbox (min_lon, min_lat, max_lon, max_lat) when given
+        """
+        grids = []
+        for user_id in self.user_ids if user_ids is None else user_ids:
+            grid = self.read_user_density(user_id, cell_size)
+            grids.append(grid if bbox is None else grid.query(*bbox))
+        return DensityGrid.merge(grids, cell_size)
+
+    @metrics.timed('store.read_user')
+    def read_user(
+        self,
+        user_id: str,
+        columns: List[str] = None,
+        mmap: bool = True
+    ) -> List[Trajectory]:
+        """
+        Read the trajectories of a user, the trajectory columns are views on memory-mapped arrays.
+        `columns` restricts the optional columns (label, kinematics) that are opened, all of them by default.
+        """
+        metadata = self.read_metadata(user_id)
+        if not metadata['trajectory_ids']:
+            return []
+        user_columns = self._open_columns(user_id, columns, mmap)
+        offsets = metadata['offsets']
+        trajectories = [
+            Trajectory(
+                trajectory_id=trajectory_id,
+                user_id=user_id,
+                columns=user_columns[offsets[i]:offsets[i + 1]],
+            )
+            for i, trajectory_id in enumerate(metadata['trajectory_ids'])
+        ]
+        # partitions written before the summaries are summarized on first use
+        if metadata.get('summary'):
+            summaries = TrajectorySummaries.from_dict(metadata['summary'])
+            for i, trajectory in enumerate(trajectories):
+                trajectory.cache_summary(summaries[i])
+        return trajectories
+
+
+def write_density(file_path: str, grids: Dict[float, DensityGrid]) -> None:
+    """
+    Write the density grids in a .npz file, the arrays of a level prefixed with its cell size
+    """
+    arrays = {
+        f'{cell_size:g}_{name}': values
+        for cell_size, grid in grids.items() for name, values in grid.to_arrays().items()
+    }
+    # a temporary file per process, concurrent writers of the same grids replace each other's file
+    tmp_path = f'{file_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, file_path)
+
+
+class PartitionWriter:
+    """
+    Write the partition of a user by appending chunks of trajectories, without holding more than one chunk
+    in memory: each column is streamed to its .npy file behind a placeholder header, rewritten with the final
+    shape on `close`. The density grids of the chunks are added as they come and written on `close`.
+    Like `DatasetStore.write_user`, the partition is written in a temporary folder and only replaces the
+    previous one on `close`.
+    Methods
+    -------
+    append(columns: TrajectoryColumns, offsets: Sequence[int], trajectory_ids: List[str], summaries: TrajectorySummaries = None) -> None
+        Append the trajectories concatenated in columns, trajectory i holding the points offsets[i]:offsets[i + 1].
+        Their summaries are computed when not given.
+    close(metadata: Dict = None) -> None
+        Finish the .npy files, write the metadata and publish the partition.
+    abort() -> None
+        Remove the temporary partition, the previous one is kept.
+    """
+
+    def __init__(self, store: DatasetStore, user_id: str):
+        self.store = store
+        self.user_id = user_id
+        self.user_path = store.user_path(user_id)
+        self.tmp_path = f'{self.user_path}.tmp'
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.files: Dict[str, BinaryIO] = {}
+        self.dtypes: Dict[str, np.dtype] = {}
+        self.points = 0
+        self.trajectory_ids: List[str] = []
+        self.offsets = [0]
+        self.summaries: List[TrajectorySummaries] = []
+        self.density: Dict[float, DensityGrid] = {cell_size: DensityGrid.merge([], cell_size) for cell_size in LEVELS}
+
+    def append(
+        self,
+        columns: TrajectoryColumns,
+        offsets: Sequence[int],
+        trajectory_ids: List[str],
+        summaries: TrajectorySummaries = None
+    ) -> None:
+        if not trajectory_ids:
+            return
+        arrays = {name: values for name, values in columns.arrays.items() if values is not None}
+        if self.trajectory_ids and set(arrays) != set(self.files):
+            raise ValueError(f'The columns of the chunk {sorted(arrays)} differ from the previous ones {sorted(self.files)}')
+        for name, values in arrays.items():
+            if name not in self.files:
+                self.dtypes[name] = values.dtype
+                self.files[name] = open(os.path.join(self.tmp_path, f'{name}.npy'), 'wb')
+                self._write_header(name, 0)
+            np.ascontiguousarray(values, dtype=self.dtypes[name]).tofile(self.files[name])
+        if summaries is None:
+            summaries = TrajectorySummaries.from_columns(columns, offsets, trajectory_ids, [self.user_id] * len(trajectory_ids))
+        self.summaries.append(summaries)
+        with metrics.span('store.density'):
+            for cell_size, grid in build_levels(columns, offsets).items():
+                self.density[cell_size] = DensityGrid.merge([self.density[cell_size], grid], cell_size)
+        self.offsets.extend((self.points + np.asarray(offsets[1:], dtype=np.int64)).tolist())
+        self.trajectory_ids.extend(trajectory_ids)
+        self.points += len(columns)
+
+    def _write_header(self, name: str, count: int) -> None:
+        # the header is padded to 64 bytes, its length does not depend on the count
+        f = self.files[name]
+        f.seek(0)
+        np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(self.dtypes[name]), 'fortran_order': False, 'shape': (count,)})
+        f.seek(0, os.SEEK_END)
+
+    def close(self, metadata: Dict = None) -> None:
+        for name, f in self.files.items():
+            self._write_header(name, self.points)
+            f.close()
+        summaries = TrajectorySummaries.concatenate(self.summaries) if self.summaries else None
+        with open(os.path.join(self.tmp_path, 'trajectories.json'), 'w') as f:
+            json.dump({
+                'user_id': self.user_id,
+                'trajectory_ids': self.trajectory_ids,
+                'offsets': self.offsets,
+                'summary': summaries.to_dict() if summaries is not None else None,
+                **(metadata or {}),
+            }, f)
+        write_density(os.path.join(self.tmp_path, 'density.npz'), self.density)
+
+        old_path = f'{self.user_path}.old'
+        if os.path.exists(self.user_path):
+            os.replace(self.user_path, old_path)
+        os.replace(self.tmp_path, self.user_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def abort(self) -> None:
+        for f in self.files.values():
+            f.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
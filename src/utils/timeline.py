@@ -1,10 +1,15 @@
+import numpy as np
 import plotly.graph_objs as go
 
 from models.trajectories import Trajectories
+from utils.batching import color_codes, marker_colors, pack
+from utils.metrics import metrics
+from utils.simplify import lttb_downsample, minmax_downsample
 
 import random
 random_colors_list = [f'rgba({random.randint(0, 255)}, {random.randint(0, 255)}, {random.randint(0, 255)}, 1)' for i in range(500)]
 
+@metrics.timed('figure.timeline')
 def plot_timeline(
     trajectories: Trajectories,
     y_data: str = 'speed',
@@ -12,12 +17,51 @@ def plot_timeline(
     height: int = 250,
     marker: dict = dict(color='red', size=5),
     colors_list: list = random_colors_list,
+    point_budget: int = None,
+    downsample: str = 'minmax',
+    batched: bool = False,
+    line_color: str = 'rgba(200, 200, 200, 0.5)',
 ) -> go.Figure:
+    """
+    Plot y_data over time for each trajectory.
+    With a point_budget, the budget is shared between the trajectories by number of points and each one is
+    downsampled with min-max buckets ('minmax') or Largest-Triangle-Three-Buckets ('lttb'); as the trajectories
+    are cut to the visible time range beforehand, zooming in brings back the full resolution.
+    With batched=True all the trajectories are packed in a single trace with x in epoch milliseconds on a date
+    axis: NaN gaps break the line between two trajectories, the line is drawn in line_color and the markers
+    take the color of their trajectory, whose number is shown on hover.
+    The y-axis range comes from the 99th percentile of the plotted values of all the trajectories.
+    """
+    total = sum(trajectory.count for trajectory in trajectories.trajectories)
+    columns_list = []
+    for trajectory in trajectories.trajectories:
+        columns = trajectory.columns
+        if point_budget is not None and total > point_budget:
+            share = max(4, int(point_budget * trajectory.count / total))
+            if downsample == 'minmax':
+                columns = columns[minmax_downsample(getattr(columns, y_data), share // 2)]
+            elif downsample == 'lttb':
+                columns = columns[lttb_downsample(columns.timestamp, getattr(columns, y_data), share)]
+            else:
+                raise ValueError(f"downsample must be 'minmax' or 'lttb', not {downsample!r}")
+        columns_list.append(columns)
+
     fig = go.Figure()
-    for i, trajectory in enumerate(trajectories.trajectories):
+    if batched and columns_list:
+        colors = [trajectory.color or colors_list[i % len(colors_list)] for i, trajectory in enumerate(trajectories.trajectories)]
+        fig.add_trace(go.Scatter(
+            x=pack([columns.timestamp * 1000 for columns in columns_list]),
+            y=pack([getattr(columns, y_data) for columns in columns_list]),
+            mode=mode,
+            line=dict(width=1, color=line_color),
+            marker=dict(size=3, color=color_codes([len(columns) for columns in columns_list]), **marker_colors(colors)),
+            hovertemplate='Trajectory %{marker.color}<extra></extra>',
+            showlegend=False,
+        ))
+    for i, (trajectory, columns) in enumerate([] if batched else zip(trajectories.trajectories, columns_list)):
         fig.add_trace(go.Scatter(
-            x=trajectory.gdf['datetime'],
-            y=trajectory.gdf[y_data],
+            x=columns.datetime,
+            y=getattr(columns, y_data),
             mode=mode,
             line=dict(
                 width=1,
@@ -32,12 +76,16 @@ def plot_timeline(
             hoverinfo='text',
             showlegend=False,
         ))
+    y_values = np.concatenate([getattr(columns, y_data) for columns in columns_list] or [np.zeros(0)])
+    y_values = y_values[np.isfinite(y_values)]
+    y_max = float(np.quantile(y_values, 0.99)) if len(y_values) else 0
     fig.update_layout(
         template='plotly_dark',
         margin=dict(l=0, r=0, t=0, b=0),
         yaxis=dict(
-            range=[0, max(50, trajectories.gdf[y_data].quantile(0.99) + 20)]
+            range=[0, max(50, y_max + 20)]
             ),
+        xaxis=dict(type='date'),
         height=250,
     )
     return fig
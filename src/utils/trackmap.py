@@ -1,12 +1,46 @@
 import plotly.graph_objects as go
 import geopandas as gpd
+import numpy as np
 import os
 
+from models.density import DensityGrid
 from models.trajectories import Trajectories
+from utils.batching import color_codes, marker_colors, pack
+from utils.metrics import metrics
+from utils.simplify import tolerance_for_budget, tolerance_for_zoom
 
 import random
 random_colors_list = [f'rgba({random.randint(0, 255)}, {random.randint(0, 255)}, {random.randint(0, 255)}, 1)' for i in range(500)]
 
+def add_batched_trace(
+    fig: go.Figure,
+    trajectories: Trajectories,
+    tolerance: float,
+    colors_list: list,
+    mode: str,
+    marker_size: int,
+    line_color: str,
+) -> None:
+    """
+    Add all the trajectories to the map as a single trace: NaN gaps break the line between two trajectories,
+    the line is drawn in line_color and the markers take the color of their trajectory, whose number is shown
+    on hover
+    """
+    columns = [trajectory.level_of_detail(tolerance) for trajectory in trajectories.trajectories]
+    if not columns:
+        return
+    colors = [trajectory.color or colors_list[i % len(colors_list)] for i, trajectory in enumerate(trajectories.trajectories)]
+    fig.add_trace(go.Scattermapbox(
+        lat=pack([c.latitude for c in columns]),
+        lon=pack([c.longitude for c in columns]),
+        mode=mode,
+        line=dict(width=2, color=line_color),
+        marker=dict(size=marker_size, color=color_codes([len(c) for c in columns]), **marker_colors(colors)),
+        hovertemplate='Trajectory %{marker.color}<extra></extra>',
+        showlegend=False,
+    ))
+
+@metrics.timed('figure.map')
 def plot_map(
     trajectories: Trajectories,
     lat_col: str = "latitude",
@@ -21,13 +55,38 @@ def plot_map(
     template: str = "plotly_dark",
     marker_size: int = 10,
     height: int = 400,
+    point_budget: int = None,
+    pixel_tolerance: float = 1.0,
+    batched: bool = False,
+    line_color: str = 'rgba(200, 200, 200, 0.5)',
 ):
+    """
+    Plot the trajectories on a mapbox map.
+    With a point_budget, each trajectory is simplified with Douglas-Peucker at the coarser of the tolerance of
+    pixel_tolerance pixels at this zoom and the tolerance keeping at most point_budget points;
+    the full resolution is only sent once the zoom is high enough for the budget.
+    With batched=True all the trajectories are packed in a single trace (see `add_batched_trace`)
+    instead of one trace per trajectory.
+    """
+    tolerance = 0.0
+    if point_budget is not None and trajectories.trajectories:
+        for trajectory in trajectories.trajectories:
+            if trajectory.columns.significance is None:
+                trajectory.compute_lod()
+        latitude = trajectories.average_centroid['latitude'] if center_lat is None else center_lat
+        tolerance = max(
+            tolerance_for_zoom(zoom, latitude, pixel_tolerance),
+            tolerance_for_budget([trajectory.columns.significance for trajectory in trajectories.trajectories], point_budget),
+        )
     fig = go.Figure()
-    for i, trajectory in enumerate(trajectories.trajectories):
+    if batched:
+        add_batched_trace(fig, trajectories, tolerance, colors_list, mode, marker_size, line_color)
+    for i, trajectory in enumerate([] if batched else trajectories.trajectories):
         color = colors_list[i % len(colors_list)]
+        columns = trajectory.level_of_detail(tolerance)
         fig.add_trace(go.Scattermapbox(
-            lat=trajectory.gdf['latitude'],
-            lon=trajectory.gdf['longitude'],
+            lat=columns.latitude,
+            lon=columns.longitude,
             mode=mode,
             line=dict(
                 width=2,
@@ -46,8 +105,8 @@ def plot_map(
         mapbox=dict(
             accesstoken=mapbox_token,
             center=dict(
-                lat=trajectory.gdf['latitude'].mean() if center_lat is None else center_lat, 
-                lon=trajectory.gdf['longitude'].mean() if center_lon is None else center_lon
+                lat=trajectories.trajectories[-1].columns.latitude.mean() if center_lat is None and trajectories.trajectories else center_lat,
+                lon=trajectories.trajectories[-1].columns.longitude.mean() if center_lon is None and trajectories.trajectories else center_lon
             ),
             zoom=zoom,
             style=mapbox_style,
@@ -57,4 +116,51 @@ def plot_map(
         height=height,
     )
     
-    return fig
\ No newline at end of file
+    return fig
+
+
+@metrics.timed('figure.density')
+def plot_density(
+    grid: DensityGrid,
+    mapbox_token: str = os.getenv("MAPBOX_TOKEN"),
+    center_lat: float = None,
+    center_lon: float = None,
+    zoom: float = 8,
+    mapbox_style: str = "dark",
+    template: str = "plotly_dark",
+    height: int = 400,
+    point_budget: int = None,
+):
+    """
+    Plot the cells of a density grid as a heatmap of the log of their number of points, each cell blurred over
+    its width at this zoom. With a point_budget, only the point_budget cells with the most points are sent.
+    The hover shows the number of points, the dwell time, the mean speed and the main label of the cells.
+    """
+    if point_budget is not None and len(grid) > point_budget:
+        grid = grid[np.sort(np.argsort(-grid.count, kind='stable')[:point_budget])]
+    latitude = float(np.average(grid.latitude, weights=grid.count)) if len(grid) else 0.0
+    longitude = float(np.average(grid.longitude, weights=grid.count)) if len(grid) else 0.0
+    center_lat = latitude if center_lat is None else center_lat
+    radius = grid.cell_size * 111320.0 * np.cos(np.radians(center_lat)) / tolerance_for_zoom(zoom, center_lat)
+    fig = go.Figure(go.Densitymapbox(
+        lat=grid.latitude,
+        lon=grid.longitude,
+        z=np.log10(grid.count),
+        radius=max(float(radius), 2.0),
+        colorscale='Inferno',
+        customdata=np.column_stack([grid.count, grid.dwell / 3600, grid.mean_speed * 3.6, grid.label]),
+        hovertemplate='%{customdata[0]} points<br>%{customdata[1]:.1f} h<br>%{customdata[2]:.1f} km/h<br>%{customdata[3]}<extra></extra>',
+        colorbar=dict(title='log10 points'),
+    ))
+    fig.update_layout(
+        mapbox=dict(
+            accesstoken=mapbox_token,
+            center=dict(lat=center_lat, lon=longitude if center_lon is None else center_lon),
+            zoom=zoom,
+            style=mapbox_style,
+        ),
+        template=template,
+        margin=dict(l=0, r=0, t=0, b=0),
+        height=height,
+    )
+    return fig